@@ -18,6 +18,7 @@ import ckan.model as model
 import ckan.plugins as p
 import ckan.lib.helpers as h
 import ckan.lib.app_globals as app_globals
+import ckan.lib.engines as engines
 
 log = logging.getLogger(__name__)
 
@@ -297,8 +298,17 @@ def load_environment(global_conf, app_conf):
 
 
     # Create Jinja2 environment
+    bytecode_cache = None
+    if config.get('cache_dir') and \
+            asbool(config.get('ckan.jinja2_bytecode_cache', 'true')):
+        bytecode_cache = lib.jinja_extensions.CkanBytecodeCache(
+            os.path.join(config['cache_dir'], 'jinja2'))
     env = lib.jinja_extensions.Environment(
         loader=lib.jinja_extensions.CkanFileSystemLoader(template_paths),
+        bytecode_cache=bytecode_cache,
+        # there are only so many templates, and precompile_templates()
+        # loads all of them
+        cache_size=-1,
         autoescape=True,
         extensions=['jinja2.ext.do', 'jinja2.ext.with_',
                     lib.jinja_extensions.SnippetExtension,
@@ -307,7 +317,8 @@ def load_environment(global_conf, app_conf):
                     lib.jinja_extensions.LinkForExtension,
                     lib.jinja_extensions.ResourceExtension,
                     lib.jinja_extensions.UrlForStaticExtension,
-                    lib.jinja_extensions.UrlForExtension]
+                    lib.jinja_extensions.UrlForExtension,
+                    lib.jinja_extensions.FragmentCacheExtension]
     )
     env.install_gettext_callables(_, ungettext, newstyle=True)
     # custom filters
@@ -339,11 +350,14 @@ def load_environment(global_conf, app_conf):
     else:
         extras = {}
 
-    engine = sqlalchemy.engine_from_config(config, 'sqlalchemy.', **extras)
+    engine = engines.get_engine('main', sqlalchemy_url, **extras)
 
     if not model.meta.engine:
         model.init_model(engine)
 
+    # Load the licenses now rather than in the first request that needs them.
+    model.Package.get_license_register()
+
 
     for plugin in p.PluginImplementations(p.IConfigurable):
         plugin.configure(config)
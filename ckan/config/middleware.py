@@ -4,12 +4,13 @@ import urllib2
 import logging
 import json
 import hashlib
+import random
 
-import sqlalchemy as sa
 from beaker.middleware import CacheMiddleware, SessionMiddleware
 from paste.cascade import Cascade
 from paste.registry import RegistryManager
 from paste.urlparser import StaticURLParser
+import paste.wsgilib as wsgilib
 from paste.deploy.converters import asbool
 from pylons import config
 from pylons.middleware import ErrorHandler, StatusCodeRedirect
@@ -19,12 +20,17 @@ from repoze.who.config import WhoConfig
 from repoze.who.middleware import PluggableAuthenticationMiddleware
 from fanstatic import Fanstatic
 
+import ckan.lib.engines as engines
 from ckan.plugins import PluginImplementations
 from ckan.plugins.interfaces import IMiddleware
 from ckan.lib.i18n import get_locales_from_config
 
 from ckan.config.environment import load_environment
 import ckan.lib.app_globals as app_globals
+import ckan.lib.render as render
+import ckan.lib.timing as timing
+
+log = logging.getLogger(__name__)
 
 
 def make_app(global_conf, full_stack=True, static_files=True, **app_conf):
@@ -58,6 +64,13 @@ def make_app(global_conf, full_stack=True, static_files=True, **app_conf):
     # set pylons globals
     app_globals.reset()
 
+    # Compile the templates now rather than in the first requests for them
+    if asbool(config.get('ckan.template_warm_up',
+                         not asbool(config.get('debug', False)))):
+        for template_name, error in render.precompile_templates():
+            log.error('Could not compile template %s: %s',
+                      template_name, error)
+
     for plugin in PluginImplementations(IMiddleware):
         app = plugin.make_middleware(app, config)
 
@@ -162,6 +175,10 @@ def make_app(global_conf, full_stack=True, static_files=True, **app_conf):
     if asbool(config.get('ckan.tracking_enabled', 'false')):
         app = TrackingMiddleware(app, config)
 
+    # Request timing
+    if asbool(config.get('ckan.timing.enabled', 'false')):
+        app = TimingMiddleware(app, config)
+
     return app
 
 
@@ -316,7 +333,8 @@ class TrackingMiddleware(object):
 
     def __init__(self, app, config):
         self.app = app
-        self.engine = sa.create_engine(config.get('sqlalchemy.url'))
+        self.engine = engines.get_engine('tracking',
+                                         config.get('sqlalchemy.url'))
 
     def __call__(self, environ, start_response):
         path = environ['PATH_INFO']
@@ -346,3 +364,50 @@ class TrackingMiddleware(object):
             self.engine.execute(sql, key, data.get('url'), data.get('type'))
             return []
         return self.app(environ, start_response)
+
+
+class TimingMiddleware(object):
+    '''Times the SQL, Solr, template, action and auth calls of each request.
+
+    See ckan.lib.timing.
+    '''
+
+    def __init__(self, app, config):
+        self.app = app
+        self.header = asbool(config.get('debug', False))
+        self.log_sample_rate = float(
+            config.get('ckan.timing.log_sample_rate', 0))
+        statsd_host = config.get('ckan.timing.statsd_host')
+        if statsd_host:
+            self.statsd = timing.StatsdSink(
+                statsd_host, config.get('ckan.timing.statsd_port', 8125),
+                config.get('ckan.timing.statsd_prefix', 'ckan'))
+        else:
+            self.statsd = None
+        self.log = logging.getLogger('ckan.lib.timing')
+
+    def __call__(self, environ, start_response):
+        timings = environ['ckan.timings'] = timing.start()
+
+        def _start_response(status, response_headers, exc_info=None):
+            if self.header:
+                response_headers.append(('X-CKAN-Timing', timings.header()))
+            return start_response(status, response_headers, exc_info)
+
+        def finish():
+            timing.stop()
+            if self.log_sample_rate and \
+                    random.random() < self.log_sample_rate:
+                self.log.info('%s %s %s', environ['REQUEST_METHOD'],
+                              environ['PATH_INFO'], timings.header())
+            if self.statsd:
+                self.statsd.send(timings)
+
+        try:
+            app_iter = self.app(environ, _start_response)
+        except:
+            finish()
+            raise
+        # streamed responses do their work while the body is read, so the
+        # request ends when the server closes it
+        return wsgilib.add_close(app_iter, finish)
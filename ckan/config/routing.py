@@ -164,6 +164,8 @@ def make_map():
                   conditions=GET)
         m.connect('/util/dataset/autocomplete', action='dataset_autocomplete',
                   conditions=GET)
+        m.connect('/util/dataset/export', action='dataset_export',
+                  conditions=GET)
         m.connect('/util/tag/autocomplete', action='tag_autocomplete',
                   conditions=GET)
         m.connect('/util/resource/format_autocomplete',
@@ -288,16 +288,17 @@ class AdminController(base.BaseController):
                 else:
                     revs_to_purge = [rev.id for rev in c.deleted_revisions]
                 revs_to_purge = list(set(revs_to_purge))
-                for id in revs_to_purge:
-                    revision = model.Session.query(model.Revision).get(id)
-                    try:
-                        # TODO deleting the head revision corrupts the edit
-                        # page Ensure that whatever 'head' pointer is used
-                        # gets moved down to the next revision
-                        model.repo.purge_revision(revision, leave_record=False)
-                    except Exception, inst:
-                        msg = _('Problem purging revision %s: %s') % (id, inst)
-                        msgs.append(msg)
+                try:
+                    # TODO deleting the head revision corrupts the edit
+                    # page Ensure that whatever 'head' pointer is used
+                    # gets moved down to the next revision
+                    model.repo.purge_revisions(revs_to_purge,
+                                               leave_record=False)
+                except Exception, inst:
+                    model.Session.rollback()
+                    msg = _('Problem purging revisions %s: %s') % (
+                        ', '.join(revs_to_purge), inst)
+                    msgs.append(msg)
                 h.flash_success(_('Purge complete'))
             else:
                 msgs.append(_('Action not implemented.'))
@@ -1,11 +1,11 @@
 import os.path
 import logging
 import cgi
-import datetime
-import glob
+import hashlib
 import urllib
 
 from pylons import c, request, response
+from pylons.controllers.util import etag_cache
 from pylons.i18n import _, gettext
 from paste.util.multidict import MultiDict
 from webob.multidict import UnicodeMultiDict
@@ -15,6 +15,7 @@ import ckan.model as model
 import ckan.logic as logic
 import ckan.lib.base as base
 import ckan.lib.helpers as h
+import ckan.lib.api_metrics as api_metrics
 import ckan.lib.search as search
 import ckan.lib.navl.dictization_functions
 import ckan.lib.jsonp as jsonp
@@ -35,8 +36,17 @@ CONTENT_TYPES = {
     'text': 'text/plain;charset=utf-8',
     'html': 'text/html;charset=utf-8',
     'json': 'application/json;charset=utf-8',
+    'jsonl': 'application/x-ndjson;charset=utf-8',
 }
 
+# datasets per package_search call of dataset_export
+EXPORT_PAGE_SIZE = 1000
+
+
+# Actions whose results only change when a new revision is made, so they can
+# be given an ETag based on the latest revision.
+REVISION_ETAG_ACTIONS = ['package_list']
+
 
 class ApiController(base.BaseController):
 
@@ -142,6 +152,18 @@ class ApiController(base.BaseController):
             raise Exception(msg)
         response.headers[name] = value
 
+    def _revision_etag_cache(self, *key):
+        '''Set an ETag header made from the latest revision and `key`.
+
+        If the request's If-None-Match header matches it, this aborts with a
+        304 Not Modified response.
+
+        '''
+        latest = model.Session.query(model.Revision.id,
+                                     model.Revision.timestamp) \
+            .order_by(model.Revision.timestamp.desc()).first()
+        etag_cache(hashlib.md5(repr((latest, key))).hexdigest())
+
     def get_api(self, ver=None):
         response_data = {}
         response_data['version'] = ver
@@ -180,8 +202,12 @@ class ApiController(base.BaseController):
                 gettext('Bad request data: %s') %
                 'Request data JSON decoded to %r but '
                 'it needs to be a dictionary.' % request_data)
+        if logic_function in REVISION_ETAG_ACTIONS:
+            self._revision_etag_cache(logic_function, ver,
+                                      sorted(request_data.items()))
         try:
-            result = function(context, request_data)
+            with api_metrics.timed(logic_function):
+                result = function(context, request_data)
             return_dict['success'] = True
             return_dict['result'] = result
         except DataError, e:
@@ -266,6 +292,8 @@ class ApiController(base.BaseController):
         if not action:
             return self._finish_bad_request(
                 gettext('Cannot list entity of this type: %s') % register)
+        if register in ('dataset', 'package') and not subregister:
+            self._revision_etag_cache('package_list', ver)
         try:
             return self._finish_ok(action(context, {'id': id}))
         except NotFound, e:
@@ -590,17 +618,10 @@ class ApiController(base.BaseController):
 
     def _calc_throughput(self, ver=None):
         period = 10  # Seconds.
-        timing_cache_path = self._get_timing_cache_path()
-        call_count = 0
-        for t in range(0, period):
-            expr = '%s/%s*' % (
-                timing_cache_path,
-                (datetime.datetime.now() -
-                 datetime.timedelta(0, t)).isoformat()[0:19],
-            )
-            call_count += len(glob.glob(expr))
-        # Todo: Clear old records.
-        return float(call_count) / period
+        stats = api_metrics.stats(period)
+        if stats is None:
+            return 0.0
+        return stats['throughput']
 
     @jsonp.jsonpify
     def user_autocomplete(self):
@@ -683,6 +704,45 @@ class ApiController(base.BaseController):
         resultSet = {'ResultSet': {'Result': package_dicts}}
         return self._finish_ok(resultSet)
 
+    def dataset_export(self):
+        '''Stream all of the datasets that match the q and fq parameters as
+        JSON lines, one dataset dict per line, in the order of the sort
+        parameter (default "id asc", see package_search's cursor).
+
+        The datasets are fetched a page at a time with package_search's
+        cursor paging, so the last page takes no longer than the first.'''
+        context = {'model': model, 'session': model.Session,
+                   'user': c.user or c.author}
+        data_dict = {'cursor': '*', 'rows': EXPORT_PAGE_SIZE,
+                     'facet': 'false'}
+        for param in ('q', 'fq', 'sort'):
+            if param in request.params:
+                data_dict[param] = request.params[param]
+        package_search = get_action('package_search')
+        try:
+            page = package_search(dict(context), dict(data_dict))
+        except NotAuthorized:
+            return self._finish_not_authz()
+        except search.SearchError, e:
+            return self._finish_bad_request(
+                gettext('Bad search option: %s') % e)
+
+        def chunks(page):
+            try:
+                while True:
+                    yield ''.join(h.json.dumps(package_dict) + '\n'
+                                  for package_dict in page['results'])
+                    if not page['next_cursor']:
+                        return
+                    data_dict['cursor'] = page['next_cursor']
+                    page = package_search(dict(context), dict(data_dict))
+            finally:
+                # the response is sent after the request's session is removed
+                model.Session.remove()
+
+        response.headers['Content-Type'] = CONTENT_TYPES['jsonl']
+        return chunks(page)
+
     def tag_autocomplete(self):
         q = request.params.get('incomplete', '')
         limit = request.params.get('limit', 10)
@@ -149,7 +149,9 @@ class GroupController(BaseController):
                    'user': c.user or c.author,
                    'schema': self._db_to_form_schema(group_type=group_type),
                    'for_view': True, 'extras_as_string': True}
-        data_dict = {'id': id}
+        # The group's datasets are searched for below, so don't load them all
+        # in group_show.
+        data_dict = {'id': id, 'packages_limit': 0, 'include_users': False}
         # unicode format (decoded from utf8)
         q = c.q = request.params.get('q', '')
 
@@ -472,7 +474,8 @@ class GroupController(BaseController):
         try:
             c.members = self._action('member_list')(context, {'id': id,
                                                               'object_type': 'user'})
-            c.group_dict = self._action('group_show')(context, {'id': id})
+            c.group_dict = self._action('group_show')(context, {
+                'id': id, 'packages_limit': 0, 'include_users': False})
         except NotAuthorized:
             abort(401, _('Unauthorized to delete group %s') % '')
         except NotFound:
@@ -614,7 +617,7 @@ class GroupController(BaseController):
 
         context = {'model': model, 'session': model.Session,
                    'user': c.user or c.author, 'for_view': True}
-        data_dict = {'id': id}
+        data_dict = {'id': id, 'packages_limit': 0, 'include_users': False}
 
         try:
             c.group_dict = get_action('group_show')(context, data_dict)
@@ -696,7 +699,8 @@ class GroupController(BaseController):
                    'user': c.user or c.author,
                    'for_view': True}
         try:
-            return get_action('group_show')(context, {'id': id})
+            return get_action('group_show')(context, {
+                'id': id, 'packages_limit': 0, 'include_users': False})
         except NotFound:
             abort(404, _('Group not found'))
         except NotAuthorized:
@@ -5,15 +5,13 @@ import sqlalchemy.exc
 
 import ckan.logic
 import ckan.lib.maintain as maintain
+import ckan.lib.home_page_cache as home_page_cache
 from ckan.lib.search import SearchError
 from ckan.lib.base import *
 from ckan.lib.helpers import url_for
 
 CACHE_PARAMETERS = ['__cache', '__no_cache__']
 
-# horrible hack
-dirty_cached_group_stuff = None
-
 class HomeController(BaseController):
     repo = model.repo
 
@@ -37,44 +35,125 @@ class HomeController(BaseController):
             else:
                 raise
 
+    def _search_data(self):
+        '''Return the package search and group data for the home page.'''
+        # package search
+        context = {'model': model, 'session': model.Session,
+                   'user': c.user or c.author}
+        data_dict = {
+            'q': '*:*',
+            'facet.field': g.facets,
+            'rows': 4,
+            'start': 0,
+            'sort': 'views_recent desc',
+            'fq': 'capacity:"public"'
+        }
+        query = ckan.logic.get_action('package_search')(
+            context, data_dict)
+
+        data_dict = {'sort': 'packages', 'all_fields': 1}
+        # only give the terms to group dictize that are returned in the
+        # facets as full results take a lot longer
+        if 'groups' in query['search_facets']:
+            data_dict['groups'] = [ item['name'] for item in
+                query['search_facets']['groups']['items'] ]
+        groups = ckan.logic.get_action('group_list')(context, data_dict)
+
+        return {
+            'search_facets': query['search_facets'],
+            'package_count': query['count'],
+            'datasets': query['results'],
+            'facets': query['facets'],
+            'groups': groups,
+        }
+
+    def _featured_groups_data(self, groups):
+        '''Return the two groups shown on the home page with two of their
+        datasets each.
+
+        These are the ``demo.featured_groups`` groups, filled up with the
+        first of the given `groups` if there are fewer than two of them.
+
+        '''
+        def get_group(id):
+            def _get_group_type(id):
+                """
+                Given the id of a group it determines the type of a group given
+                a valid id/name for the group.
+                """
+                group = model.Group.get(id)
+                if not group:
+                    return None
+                return group.type
+
+            def db_to_form_schema(group_type=None):
+                from ckan.lib.plugins import lookup_group_plugin
+                return lookup_group_plugin(group_type).db_to_form_schema()
+
+            group_type = _get_group_type(id.split('@')[0])
+            context = {'model': model, 'session': model.Session,
+                       'ignore_auth': True,
+                       'user': c.user or c.author,
+                       'schema': db_to_form_schema(group_type=group_type),
+                       'limits': {'packages': 2},
+                       'for_view': True}
+            data_dict = {'id': id, 'include_users': False}
+
+            try:
+                group_dict = ckan.logic.get_action('group_show')(context, data_dict)
+            except ckan.logic.NotFound:
+                return None
+
+            return {'group_dict' :group_dict}
+
+        groups_data = []
+        featured_groups = config.get('demo.featured_groups', '').split()
+
+        for group_name in featured_groups:
+            group = get_group(group_name)
+            if group:
+                groups_data.append(group)
+            if len(groups_data) == 2:
+                break
+
+        # groups is from the solr query in _search_data()
+        if len(groups_data) < 2 and len(groups) > 0:
+            group = get_group(groups[0]['name'])
+            if group:
+                groups_data.append(group)
+        if len(groups_data) < 2 and len(groups) > 1:
+            group = get_group(groups[1]['name'])
+            if group:
+                groups_data.append(group)
+        # We get all the packages or at least too many so
+        # limit it to just 2
+        for group in groups_data:
+            group['group_dict']['packages'] = group['group_dict']['packages'][:2]
+        #now add blanks so we have two
+        while len(groups_data) < 2:
+            groups_data.append({'group_dict' :{}})
+        return groups_data
+
     def index(self):
         try:
-            # package search
-            context = {'model': model, 'session': model.Session,
-                       'user': c.user or c.author}
-            data_dict = {
-                'q': '*:*',
-                'facet.field': g.facets,
-                'rows': 4,
-                'start': 0,
-                'sort': 'views_recent desc',
-                'fq': 'capacity:"public"'
-            }
-            query = ckan.logic.get_action('package_search')(
-                context, data_dict)
-            c.search_facets = query['search_facets']
-            c.package_count = query['count']
-            c.datasets = query['results']
-
-            c.facets = query['facets']
+            # The search and group data is the same for every user, so it's
+            # cached (see ckan.lib.home_page_cache).
+            data = home_page_cache.get('search', self._search_data)
+            c.search_facets = data['search_facets']
+            c.package_count = data['package_count']
+            c.datasets = data['datasets']
+
+            c.facets = data['facets']
             maintain.deprecate_context_item(
               'facets',
               'Use `c.search_facets` instead.')
 
-            c.search_facets = query['search_facets']
-
             c.facet_titles = {'groups': _('Groups'),
                           'tags': _('Tags'),
                           'res_format': _('Formats'),
                           'license': _('Licence'), }
 
-            data_dict = {'sort': 'packages', 'all_fields': 1}
-            # only give the terms to group dictize that are returned in the
-            # facets as full results take a lot longer
-            if 'groups' in c.search_facets:
-                data_dict['groups'] = [ item['name'] for item in
-                    c.search_facets['groups']['items'] ]
-            c.groups = ckan.logic.get_action('group_list')(context, data_dict)
+            c.groups = data['groups']
         except SearchError, se:
             c.package_count = 0
             c.groups = []
@@ -104,73 +183,9 @@ class HomeController(BaseController):
             if msg:
                 h.flash_notice(msg, allow_html=True)
 
-        # START OF DIRTYNESS
-        def get_group(id):
-            def _get_group_type(id):
-                """
-                Given the id of a group it determines the type of a group given
-                a valid id/name for the group.
-                """
-                group = model.Group.get(id)
-                if not group:
-                    return None
-                return group.type
-
-            def db_to_form_schema(group_type=None):
-                from ckan.lib.plugins import lookup_group_plugin
-                return lookup_group_plugin(group_type).db_to_form_schema()
-
-            group_type = _get_group_type(id.split('@')[0])
-            context = {'model': model, 'session': model.Session,
-                       'ignore_auth': True,
-                       'user': c.user or c.author,
-                       'schema': db_to_form_schema(group_type=group_type),
-                       'limits': {'packages': 2},
-                       'for_view': True}
-            data_dict = {'id': id}
-
-            try:
-                group_dict = ckan.logic.get_action('group_show')(context, data_dict)
-            except ckan.logic.NotFound:
-                return None
-
-            return {'group_dict' :group_dict}
-
-        global dirty_cached_group_stuff
-        if not dirty_cached_group_stuff:
-            groups_data = []
-            groups = config.get('demo.featured_groups', '').split()
-
-            for group_name in groups:
-                group = get_group(group_name)
-                if group:
-                    groups_data.append(group)
-                if len(groups_data) == 2:
-                    break
-
-            # c.groups is from the solr query above
-            if len(groups_data) < 2 and len(c.groups) > 0:
-                group = get_group(c.groups[0]['name'])
-                if group:
-                    groups_data.append(group)
-            if len(groups_data) < 2 and len(c.groups) > 1:
-                group = get_group(c.groups[1]['name'])
-                if group:
-                    groups_data.append(group)
-            # We get all the packages or at least too many so
-            # limit it to just 2
-            for group in groups_data:
-                group['group_dict']['packages'] = group['group_dict']['packages'][:2]
-            #now add blanks so we have two
-            while len(groups_data) < 2:
-                groups_data.append({'group_dict' :{}})
-            # cache for later use
-            dirty_cached_group_stuff = groups_data
-
-
-        c.group_package_stuff = dirty_cached_group_stuff
-
-        # END OF DIRTYNESS
+        groups = c.groups
+        c.group_package_stuff = home_page_cache.get('featured_groups',
+                lambda: self._featured_groups_data(groups))
 
         return render('home/index.html', cache_force=True)
 
@@ -187,6 +202,8 @@ class HomeController(BaseController):
             for cache_name in wui_caches:
                 cache_ = cache.get_cache(cache_name, type='dbm')
                 cache_.clear()
+            home_page_cache.clear()
+            wui_caches.append('home_page')
             return 'Cleared caches: %s' % ', '.join(wui_caches)
 
     def cors_options(self, url=None):
@@ -0,0 +1,280 @@
+'''
+Rolling-window call rates, error rates and latencies of the API actions.
+
+When ``ckan.enable_call_timing`` is true, each call to an action through the
+action API is counted by the process's RateCounter in one-second buckets,
+along with whether it failed and a histogram of how long it took. The
+buckets of the last ``ckan.api_metrics.window`` seconds (default: 60) are
+kept.
+
+So that the numbers cover all of a site's worker processes, each process
+writes its finished buckets to a small SQLite database in ``cache_dir`` from
+a background thread, once a second, and stats() adds up its own buckets and
+the other processes' ones from the database. Without a ``cache_dir`` only the
+calls handled by the current process are counted.
+
+The stats are shown by the ``status_show`` action and the overall rate by
+``/api/qos/throughput/``.
+
+'''
+import bisect
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+
+from pylons import config
+from paste.deploy.converters import asbool
+
+log = logging.getLogger(__name__)
+
+# The upper bounds, in milliseconds, of the latency histogram's buckets. The
+# last bucket is for anything slower, and its percentiles are given as
+# OPEN_BUCKET.
+LATENCY_BUCKETS = (5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+OPEN_BUCKET = '+Inf'
+
+PERCENTILES = (50, 90, 99)
+
+
+def _new_bucket():
+    # [calls, errors, latency histogram]
+    return [0, 0, [0] * (len(LATENCY_BUCKETS) + 1)]
+
+
+class RateCounter(object):
+    '''Counts the calls to each action in one-second buckets.
+
+    :param window: how many seconds of buckets to keep
+    :param store_path: the path of the SQLite database that the buckets of
+        all processes are shared in, or None to keep them in this process
+
+    '''
+    def __init__(self, window=60, store_path=None):
+        self.window = window
+        self.store_path = store_path
+        self._lock = threading.Lock()
+        self._start()
+        if store_path:
+            self._create_store()
+
+    def _start(self):
+        # (second, action) -> bucket, of this process
+        self._buckets = {}
+        self._flushed_second = int(time.time())
+        self._pid = os.getpid()
+        # identifies this counter's rows in the store's pid column, as a pid
+        # can be reused
+        self._id = random.SystemRandom().getrandbits(62)
+        self._flusher = None
+
+    def record(self, action, seconds, error=False):
+        '''Count a call to `action` that took `seconds`.'''
+        now = int(time.time())
+        milliseconds = seconds * 1000
+        with self._lock:
+            if self._pid != os.getpid():
+                # a forked process, whose parent counts its own calls
+                self._start()
+            bucket = self._buckets.get((now, action))
+            if bucket is None:
+                bucket = self._buckets[(now, action)] = _new_bucket()
+            bucket[0] += 1
+            if error:
+                bucket[1] += 1
+            bucket[2][bisect.bisect_left(LATENCY_BUCKETS, milliseconds)] += 1
+            if self.store_path and self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_forever,
+                                                 name='api_metrics')
+                self._flusher.daemon = True
+                self._flusher.start()
+
+    def _flush_forever(self):
+        while True:
+            time.sleep(1)
+            self.flush()
+
+    def flush(self, now=None):
+        '''Write the buckets finished before `now` to the store, and forget
+        the ones older than the window.
+
+        The buckets are copied with the lock held and written without it, so
+        that record() never waits for the store.'''
+        now = now or int(time.time())
+        with self._lock:
+            finished = [(key, bucket[0], bucket[1], list(bucket[2]))
+                        for key, bucket in self._buckets.items()
+                        if self._flushed_second <= key[0] < now]
+            self._flushed_second = max(self._flushed_second, now)
+            for key in self._buckets.keys():
+                if key[0] < now - self.window:
+                    del self._buckets[key]
+        if not self.store_path:
+            return
+        try:
+            connection = self._connect()
+            try:
+                connection.executemany(
+                    'INSERT INTO bucket VALUES (?, ?, ?, ?, ?, ?)',
+                    [(self._id, second, action, calls, errors,
+                      ','.join(str(n) for n in histogram))
+                     for (second, action), calls, errors, histogram
+                     in finished])
+                connection.execute('DELETE FROM bucket WHERE second < ?',
+                                   (now - self.window,))
+                connection.commit()
+            finally:
+                connection.close()
+        except sqlite3.Error, e:
+            log.warning('Could not write the API metrics to %s: %s',
+                        self.store_path, e)
+
+    def _connect(self):
+        return sqlite3.connect(self.store_path, timeout=1)
+
+    def _create_store(self):
+        directory = os.path.dirname(self.store_path)
+        try:
+            if not os.path.exists(directory):
+                os.makedirs(directory)
+            connection = self._connect()
+            try:
+                connection.execute('''CREATE TABLE IF NOT EXISTS bucket (
+                    pid integer, second integer, action text, calls integer,
+                    errors integer, latencies text)''')
+                connection.commit()
+            finally:
+                connection.close()
+        except (OSError, sqlite3.Error), e:
+            log.warning('Could not create the API metrics store %s, the '
+                        'metrics will only be for this process: %s',
+                        self.store_path, e)
+            self.store_path = None
+
+    def _all_buckets(self, since):
+        '''Return (action, bucket) for all of the buckets from `since`: this
+        process's from memory, including the ones not written yet, and the
+        other processes' from the store.'''
+        with self._lock:
+            if self._pid != os.getpid():
+                self._start()
+            buckets = [(key[1], bucket)
+                       for key, bucket in self._buckets.items()
+                       if key[0] >= since]
+        if self.store_path:
+            try:
+                connection = self._connect()
+                try:
+                    rows = connection.execute(
+                        'SELECT action, calls, errors, latencies FROM bucket '
+                        'WHERE second >= ? AND pid != ?',
+                        (since, self._id)).fetchall()
+                finally:
+                    connection.close()
+            except sqlite3.Error, e:
+                log.warning('Could not read the API metrics from %s: %s',
+                            self.store_path, e)
+                rows = []
+            for action, calls, errors, latencies in rows:
+                buckets.append((action, [calls, errors,
+                               [int(n) for n in latencies.split(',')]]))
+        return buckets
+
+    def stats(self, period=None):
+        '''Return the call rates, error rates and latency percentiles of the
+        last `period` seconds (default: the whole window), for all actions
+        and for each action.'''
+        period = min(period or self.window, self.window)
+        since = int(time.time()) - period
+        totals = {}
+        for action, bucket in self._all_buckets(since):
+            for key in (None, action):
+                total = totals.get(key)
+                if total is None:
+                    total = totals[key] = _new_bucket()
+                total[0] += bucket[0]
+                total[1] += bucket[1]
+                total[2] = [a + b for a, b in zip(total[2], bucket[2])]
+        overall = _bucket_stats(totals.pop(None, _new_bucket()), period)
+        overall['actions'] = dict(
+            (action, _bucket_stats(bucket, period))
+            for action, bucket in totals.items())
+        return overall
+
+
+def _percentile(histogram, percentile):
+    '''Return the upper bound of the histogram bucket the percentile is in,
+    or OPEN_BUCKET if it's in the last one, which has none.'''
+    calls = sum(histogram)
+    if not calls:
+        return None
+    running_total = 0
+    for index, count in enumerate(histogram):
+        running_total += count
+        if running_total * 100 >= calls * percentile:
+            break
+    if index == len(LATENCY_BUCKETS):
+        return OPEN_BUCKET
+    return LATENCY_BUCKETS[index]
+
+
+def _bucket_stats(bucket, period):
+    calls, errors, histogram = bucket
+    stats = {
+        'calls': calls,
+        'throughput': float(calls) / period,
+        'error_rate': float(errors) / calls if calls else 0.0,
+    }
+    for percentile in PERCENTILES:
+        stats['latency_p%i_ms' % percentile] = _percentile(histogram,
+                                                          percentile)
+    return stats
+
+
+_counter = None
+_counter_lock = threading.Lock()
+
+
+def enabled():
+    return asbool(config.get('ckan.enable_call_timing', False))
+
+
+def get_counter():
+    '''Return this process's RateCounter.'''
+    global _counter
+    if _counter is None:
+        with _counter_lock:
+            if _counter is None:
+                cache_dir = config.get('cache_dir')
+                store_path = os.path.join(cache_dir, 'api_metrics.sqlite') \
+                    if cache_dir else None
+                _counter = RateCounter(
+                    int(config.get('ckan.api_metrics.window', 60)),
+                    store_path)
+    return _counter
+
+
+class timed(object):
+    '''Context manager that counts its block as a call to `action`, which
+    failed if the block raises an exception.'''
+
+    def __init__(self, action):
+        self.action = action
+
+    def __enter__(self):
+        self.start = time.time()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if enabled():
+            get_counter().record(self.action, time.time() - self.start,
+                                 error=exc_type is not None)
+
+
+def stats(period=None):
+    '''Return the stats of the API calls of the last `period` seconds, or
+    None if call timing is off. See RateCounter.stats().'''
+    if not enabled():
+        return None
+    return get_counter().stats(period)
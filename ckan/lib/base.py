@@ -28,6 +28,8 @@ from ckan.lib import i18n
 import lib.render
 import ckan.lib.helpers as h
 import ckan.lib.app_globals as app_globals
+import ckan.lib.fragment_cache as fragment_cache
+import ckan.lib.timing as timing
 from ckan.plugins import PluginImplementations, IGenshiStreamFilter
 from ckan.lib.helpers import json
 import ckan.model as model
@@ -61,11 +63,19 @@ def render_snippet(template_name, **kw):
     the extra template variables. '''
     # allow cache_force to be set in render function
     cache_force = kw.pop('cache_force', None)
-    output = render(template_name, extra_vars=kw, cache_force=cache_force,
-                    renderer='snippet')
-    output = '\n<!-- Snippet %s start -->\n%s\n<!-- Snippet %s end -->\n' % (
-        template_name, output, template_name)
-    return literal(output)
+    # and the snippet's output to be cached, see lib.fragment_cache
+    cache_key = kw.pop('cache_key', None)
+
+    def render_snippet_():
+        output = render(template_name, extra_vars=kw,
+                        cache_force=cache_force, renderer='snippet')
+        return ('\n<!-- Snippet %s start -->\n%s\n<!-- Snippet %s end -->\n'
+                % (template_name, output, template_name))
+
+    if cache_key is None:
+        return literal(render_snippet_())
+    key = fragment_cache.make_key(template_name, cache_key, kw)
+    return literal(fragment_cache.get_fragment(key, render_snippet_))
 
 
 def render_text(template_name, extra_vars=None, cache_force=None):
@@ -193,8 +203,9 @@ def render(template_name, extra_vars=None, cache_key=None, cache_type=None,
 
     # Render Time :)
     try:
-        return cached_template(template_name, render_template,
-                               loader_class=loader_class)
+        with timing.timer('render'):
+            return cached_template(template_name, render_template,
+                                   loader_class=loader_class)
     except ckan.exceptions.CkanUrlException, e:
         raise ckan.exceptions.CkanUrlException(
             '\nAn Exception has been raised for template %s\n%s' %
@@ -0,0 +1,246 @@
+'''
+The plumbing shared by CKAN's caches of expensive results.
+
+Each cache (e.g. ckan.lib.package_cache, ckan.lib.fragment_cache or the
+datastore's search cache) configures a Cache, which keeps its items in a
+bounded, in-process LRUCache and, optionally, in a shared Beaker cache (e.g.
+memcached) used by all the worker processes, and counts its hits and misses.
+A Cache with the config settings prefix ``ckan.example_cache`` reads:
+
+``ckan.example_cache.size``
+  The maximum number of items kept in each process (0 turns the cache off).
+
+``ckan.example_cache.expires``
+  How long, in seconds, a cached item is used for.
+
+``ckan.example_cache.shared_type``
+  The type of an optional Beaker cache shared by all processes, e.g.
+  ``ext:memcached``, using the ``beaker.cache.*`` settings (default: none).
+
+``ckan.example_cache.max_bytes``
+  For the caches that measure their items, the maximum total size of the
+  items kept in each process.
+
+'''
+import collections
+import logging
+import threading
+import time
+
+import beaker.cache
+import beaker.util
+from pylons import config
+
+log = logging.getLogger(__name__)
+
+
+class LRUCache(object):
+    '''A thread-safe cache of at most `max_size` items, whose items expire
+    `expires` seconds after they are set.
+
+    When the cache is full, setting an item drops the least recently used one.
+    If `max_cost` is given, items are also dropped while the total of the
+    costs they were set with (e.g. their sizes in bytes) is more than it.
+
+    '''
+    def __init__(self, max_size, expires=None, max_cost=None):
+        self.max_size = max_size
+        self.expires = expires
+        self.max_cost = max_cost
+        self.cost = 0
+        self._items = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        '''Return the item for `key`, or None if there isn't one.'''
+        with self._lock:
+            try:
+                item = self._items.pop(key)
+            except KeyError:
+                return None
+            if self.expires and time.time() - item[0] > self.expires:
+                self.cost -= item[2]
+                return None
+            # Move it to the most recently used end.
+            self._items[key] = item
+            return item[1]
+
+    def set(self, key, value, cost=0):
+        with self._lock:
+            self._pop(key)
+            self._items[key] = (time.time(), value, cost)
+            self.cost += cost
+            while len(self._items) > self.max_size or (
+                    self.max_cost is not None and self.cost > self.max_cost):
+                self.cost -= self._items.popitem(last=False)[1][2]
+
+    def _pop(self, key):
+        item = self._items.pop(key, None)
+        if item is not None:
+            self.cost -= item[2]
+
+    def delete_matching(self, match):
+        '''Remove the items whose keys the `match` function returns True for.'''
+        with self._lock:
+            for key in [key for key in self._items if match(key)]:
+                self._pop(key)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.cost = 0
+
+    def __len__(self):
+        return len(self._items)
+
+
+_cache_manager = None
+_cache_manager_lock = threading.Lock()
+
+
+def get_beaker_cache(name, type, expire):
+    '''Return the Beaker cache `name` of the given type, using the site's
+    ``beaker.cache.*`` settings (data_dir, lock_dir, url...) so that the
+    shared types are shared by every worker process.'''
+    global _cache_manager
+    if _cache_manager is None:
+        with _cache_manager_lock:
+            if _cache_manager is None:
+                _cache_manager = beaker.cache.CacheManager(
+                        **beaker.util.parse_cache_config_options(config))
+    return _cache_manager.get_cache(name, type=type, expire=expire)
+
+
+class Cache(object):
+    '''An in-process LRUCache and an optional shared Beaker cache, configured
+    by the config settings starting with `prefix`.
+
+    :param name: the name of the shared Beaker cache
+    :param prefix: the prefix of the config settings, e.g.
+        ``'ckan.fragment_cache'``
+    :param size: the default of ``<prefix>.size``
+    :param expires: the default of ``<prefix>.expires``
+    :param max_bytes: the default of ``<prefix>.max_bytes``, or None if the
+        cache doesn't measure its items
+    :param cost: the function that measures an item for ``max_bytes``, e.g.
+        ``len``
+
+    '''
+    def __init__(self, name, prefix, size=1000, expires=3600,
+                 max_bytes=None, cost=None):
+        self.name = name
+        self.prefix = prefix
+        self.default_size = size
+        self.default_expires = expires
+        self.default_max_bytes = max_bytes
+        self.cost = cost
+        self.counts = {'hits': 0, 'misses': 0}
+        self._local_cache = None
+        self._shared_cache = None
+
+    def _option(self, name, default):
+        return config.get('%s.%s' % (self.prefix, name), default)
+
+    def max_size(self):
+        return int(self._option('size', self.default_size))
+
+    def expires(self):
+        return int(self._option('expires', self.default_expires))
+
+    def max_bytes(self):
+        if self.default_max_bytes is None:
+            return None
+        return int(self._option('max_bytes', self.default_max_bytes))
+
+    def local(self):
+        '''Return the in-process LRUCache.'''
+        if self._local_cache is None:
+            self._local_cache = LRUCache(self.max_size(), self.expires(),
+                                         max_cost=self.max_bytes())
+        return self._local_cache
+
+    def shared(self):
+        '''Return the shared Beaker cache, or None if none is configured.'''
+        shared_type = self._option('shared_type', None)
+        if not shared_type:
+            return None
+        if self._shared_cache is None:
+            self._shared_cache = get_beaker_cache(self.name, shared_type,
+                                                  self.expires())
+        return self._shared_cache
+
+    def _cost(self, value):
+        return self.cost(value) if self.cost else 0
+
+    def count(self, name):
+        '''Add one to the count `name` shown by stats().'''
+        self.counts[name] = self.counts.get(name, 0) + 1
+
+    def get(self, key):
+        '''Return the item for `key` from the in-process cache or else the
+        shared one, or None if there isn't one.
+
+        The shared cache is keyed by `key`, or its repr() if it isn't a
+        string.'''
+        local_cache = self.local()
+        value = local_cache.get(key)
+        if value is None:
+            shared_cache = self.shared()
+            if shared_cache:
+                try:
+                    value = shared_cache.get_value(_shared_key(key))
+                    local_cache.set(key, value, cost=self._cost(value))
+                except KeyError:
+                    pass
+                except Exception, e:
+                    log.exception(e)
+        self.count('misses' if value is None else 'hits')
+        return value
+
+    def set(self, key, value):
+        '''Cache `value` under `key` in this process and in the shared
+        cache.'''
+        self.local().set(key, value, cost=self._cost(value))
+        shared_cache = self.shared()
+        if shared_cache:
+            try:
+                shared_cache.set_value(_shared_key(key), value)
+            except Exception, e:
+                log.exception(e)
+
+    def delete_matching(self, match):
+        '''Remove the items whose keys `match` returns True for from this
+        process's cache.'''
+        if self._local_cache is not None:
+            self._local_cache.delete_matching(match)
+
+    def clear(self):
+        '''Remove all the cached items, in this process and in the shared
+        cache.'''
+        if self._local_cache is not None:
+            self._local_cache.clear()
+        shared_cache = self.shared()
+        if shared_cache:
+            try:
+                shared_cache.clear()
+            except Exception, e:
+                log.exception(e)
+
+    def stats(self):
+        '''Return this process's counts, the hit rate and the size of the
+        in-process cache.'''
+        stats = dict(self.counts)
+        lookups = self.counts['hits'] + self.counts['misses']
+        stats['hit_rate'] = (float(self.counts['hits']) / lookups
+                             if lookups else None)
+        local_cache = self._local_cache
+        stats['size'] = len(local_cache) if local_cache is not None else 0
+        stats['max_size'] = self.max_size()
+        if self.default_max_bytes is not None:
+            stats['bytes'] = local_cache.cost if local_cache is not None else 0
+            stats['max_bytes'] = self.max_bytes()
+        return stats
+
+
+def _shared_key(key):
+    return key if isinstance(key, basestring) else repr(key)
@@ -114,6 +114,15 @@ class ManageDb(CkanCommand):
     db load-only {file-path} # load a pg_dump from a file but don\'t do
                              # the schema upgrade or search indexing
     db create-from-model # create database from the model (indexes not made)
+    db index-audit [{rows}] # explain the most frequent queries and list
+                            # missing indexes, optionally after adding
+                            # {rows} fake rows (which are rolled back)
+    db compact-revisions {days} [archive] # remove, or move to *_archive
+                            # tables, the versions of objects that stopped
+                            # being current more than {days} days ago
+    db purge-revisions {author} [{from-date} [{to-date}]] # purge all the
+                            # changes made by {author}, optionally only in
+                            # the given (YYYY-MM-DD) date range
     '''
     summary = __doc__.split('\n')[0]
     usage = __doc__
@@ -171,6 +180,12 @@ class ManageDb(CkanCommand):
                 print 'Creating DB: SUCCESS'
         elif cmd == 'send-rdf':
             self.send_rdf()
+        elif cmd == 'index-audit':
+            self.index_audit()
+        elif cmd == 'compact-revisions':
+            self.compact_revisions()
+        elif cmd == 'purge-revisions':
+            self.purge_revisions()
         else:
             print 'Command %s not recognized' % cmd
             sys.exit(1)
@@ -303,6 +318,62 @@ class ManageDb(CkanCommand):
         talis = ckan.lib.talis.Talis()
         return talis.send_rdf(talis_store, username, password)
 
+    def index_audit(self):
+        import ckan.lib.index_audit as index_audit
+        rows = int(self.args[1]) if len(self.args) > 1 else 0
+        if rows:
+            print 'Adding %i fake rows...' % rows
+        results, missing = index_audit.audit(rows)
+        for name, runtime, tables in results:
+            if runtime is None:
+                print '%-28s no data' % name
+                continue
+            scans = ', '.join(tables)
+            print '%-28s %10.2f ms  %s' % (
+                name, runtime, 'seq scan: %s' % scans if scans else '')
+        if missing:
+            print 'Missing indexes:'
+            for table, columns in missing:
+                print '  %s (%s)' % (table, ', '.join(columns))
+        else:
+            print 'No missing indexes'
+
+    def compact_revisions(self):
+        import ckan.model as model
+        if len(self.args) < 2:
+            print 'Need the number of days of history to keep'
+            sys.exit(1)
+        archive = len(self.args) > 2 and self.args[2] == 'archive'
+        before = datetime.datetime.now() - \
+            datetime.timedelta(days=int(self.args[1]))
+        removed = model.repo.compact_revisions(before, archive=archive)
+        for table, count in sorted(removed.items()):
+            print '%-32s %i %s' % (table, count,
+                                   'archived' if archive else 'deleted')
+        print 'Run VACUUM ANALYZE to reclaim the space and update the ' \
+            'query planner\'s statistics'
+
+    def purge_revisions(self):
+        import ckan.model as model
+        if len(self.args) < 2:
+            print 'Need the author of the revisions to purge'
+            sys.exit(1)
+        query = model.Session.query(model.Revision.id) \
+            .filter(model.Revision.author == self.args[1])
+        if len(self.args) > 2:
+            start = datetime.datetime.strptime(self.args[2], '%Y-%m-%d')
+            query = query.filter(model.Revision.timestamp >= start)
+        if len(self.args) > 3:
+            end = datetime.datetime.strptime(self.args[3], '%Y-%m-%d')
+            query = query.filter(model.Revision.timestamp <
+                                 end + datetime.timedelta(days=1))
+        revision_ids = [row[0] for row in query]
+        if not revision_ids:
+            print 'No revisions to purge'
+            return
+        model.repo.purge_revisions(revision_ids)
+        print 'Purged %i revisions' % len(revision_ids)
+
     def version(self):
         from ckan.model import Session
         print Session.execute('select version from migrate_version;').fetchall()
@@ -316,6 +387,7 @@ class SearchIndexCommand(CkanCommand):
       search-index check                                     - checks for datasets not indexed
       search-index show {dataset-name}                       - shows index of a dataset
       search-index clear [dataset-name]                      - clears the search index for the provided dataset or for the whole ckan instance
+      search-index reconcile-tags                            - removes the tags that no dataset has any more from the index, e.g. from cron
     '''
 
     summary = __doc__.split('\n')[0]
@@ -360,6 +432,8 @@ Default is false.'''
             self.show()
         elif cmd == 'clear':
             self.clear()
+        elif cmd == 'reconcile-tags':
+            self.reconcile_tags()
         else:
             print 'Command %s not recognized' % cmd
 
@@ -400,6 +474,12 @@ Default is false.'''
         package_id =self.args[1] if len(self.args) > 1 else None
         clear(package_id)
 
+    def reconcile_tags(self):
+        from ckan.lib.search import reconcile_tags
+
+        added, deleted = reconcile_tags()
+        print 'Tags added to the index: %i, deleted: %i' % (added, deleted)
+
 class Notification(CkanCommand):
     '''Send out modification notifications.
 
@@ -1740,6 +1820,36 @@ SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
         print 'zh_TW has been mangled'
 
 
+class TemplatesCommand(CkanCommand):
+    '''Manage the compiled templates
+
+    Usage:
+
+        templates precompile      - work out the type of every template and
+                                    compile the Jinja2 ones into the bytecode
+                                    cache in cache_dir
+    '''
+    summary = __doc__.split('\n')[0]
+    usage = __doc__
+    min_args = 1
+    max_args = 1
+
+    def command(self):
+        self._load_config()
+        import ckan.lib.render as render
+
+        cmd = self.args[0]
+        if cmd == 'precompile':
+            errors = render.precompile_templates()
+            for template_name, error in errors:
+                print 'Could not compile %s: %s' % (template_name, error)
+            print '%i templates, %i errors' % (
+                len(render.list_templates()), len(errors))
+        else:
+            print 'Command %s not recognized' % cmd
+            print self.usage
+
+
 class MinifyCommand(CkanCommand):
     '''Create minified versions of the given Javascript and CSS files.
 
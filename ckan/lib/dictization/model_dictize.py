@@ -1,7 +1,7 @@
 import datetime
 
 from pylons import config
-from sqlalchemy.sql import select
+from sqlalchemy.sql import select, func, and_, or_
 
 import ckan.misc as misc
 import ckan.logic as logic
@@ -297,7 +297,13 @@ def package_dictize(pkg, context):
         result_dict['license_title']= pkg.license_id
 
     # creation and modification date
-    result_dict['metadata_modified'] = context.pop('metadata_modified')
+    # The package table's metadata_modified is only right for the current
+    # version of the package, older versions use the latest revision
+    # timestamp of the rows dictized above (see table_dictize).
+    metadata_modified = context.pop('metadata_modified')
+    if context.get('revision_id') or context.get('revision_date') or \
+            not result_dict.get('metadata_modified'):
+        result_dict['metadata_modified'] = metadata_modified
     result_dict['metadata_created'] = pkg.metadata_created.isoformat() \
         if pkg.metadata_created else None
 
@@ -307,6 +313,223 @@ def package_dictize(pkg, context):
 
     return result_dict
 
+def _rows_by(rows, key):
+    '''Group a list of result rows into a dict of lists by the given key.'''
+    grouped = {}
+    for row in rows:
+        grouped.setdefault(row[key], []).append(row)
+    return grouped
+
+def package_list_dictize(package_rows, context):
+    '''
+    Given a list of current package revision rows, returns a list of the
+    equivalent dictionaries, the same as calling package_dictize() on each
+    of them.
+
+    Rather than querying each of the package's related tables for each
+    package, each table is queried once for all of the packages, so the
+    number of queries doesn't grow with the number of packages. Only the
+    current revisions are dictized, revision_id, revision_date and pending
+    in the context are not supported.
+    '''
+    model = context['model']
+    session = model.Session
+    package_ids = [row.id for row in package_rows]
+    if not package_ids:
+        return []
+
+    # metadata_modified comes from the package table, but if it isn't set
+    # it's the latest revision timestamp of any of the rows that make up the
+    # package (see the hack in table_dictize).
+    modified = {}
+    def track_modified(package_id, rows):
+        for row in rows:
+            if row.revision_timestamp:
+                modified[package_id] = max(modified.get(package_id, ''),
+                        row.revision_timestamp.isoformat())
+
+    #resources
+    resource_group = model.resource_group_table
+    q = select([resource_group.c.id, resource_group.c.package_id]
+               ).where(resource_group.c.package_id.in_(package_ids))
+    resource_group_packages = dict(list(session.execute(q)))
+    res_rev = model.resource_revision_table
+    resources = {}
+    if resource_group_packages:
+        q = select([res_rev]).where(
+            res_rev.c.resource_group_id.in_(resource_group_packages.keys()))
+        q = q.where(res_rev.c.current == True)
+        for row in session.execute(q):
+            package_id = resource_group_packages[row.resource_group_id]
+            resources.setdefault(package_id, []).append(row)
+    #tags
+    tag_rev = model.package_tag_revision_table
+    tag = model.tag_table
+    q = select([tag, tag_rev.c.state, tag_rev.c.revision_timestamp,
+                tag_rev.c.package_id],
+        from_obj=tag_rev.join(tag, tag.c.id == tag_rev.c.tag_id)
+        ).where(tag_rev.c.package_id.in_(package_ids))
+    q = q.where(tag_rev.c.current == True)
+    tags = _rows_by(session.execute(q), 'package_id')
+    #extras
+    extra_rev = model.extra_revision_table
+    q = select([extra_rev]).where(extra_rev.c.package_id.in_(package_ids))
+    q = q.where(extra_rev.c.current == True)
+    extras = _rows_by(session.execute(q), 'package_id')
+    #groups
+    member_rev = model.member_revision_table
+    group = model.group_table
+    q = select([group, member_rev.c.capacity, member_rev.c.table_id],
+               from_obj=member_rev.join(group, group.c.id == member_rev.c.group_id)
+               ).where(member_rev.c.table_id.in_(package_ids))\
+                .where(member_rev.c.state == 'active') \
+                .where(group.c.is_organization == False)
+    q = q.where(member_rev.c.current == True)
+    groups = _rows_by(session.execute(q), 'table_id')
+    #owning organizations
+    owner_orgs = set(row.owner_org for row in package_rows if row.owner_org)
+    organizations = {}
+    if owner_orgs:
+        group_rev = model.group_revision_table
+        q = select([group_rev]).where(group_rev.c.id.in_(owner_orgs)) \
+                .where(group_rev.c.state == 'active')
+        q = q.where(group_rev.c.current == True)
+        organizations = _rows_by(session.execute(q), 'id')
+    #relations
+    rel_rev = model.package_relationship_revision_table
+    q = select([rel_rev]).where(rel_rev.c.subject_package_id.in_(package_ids))
+    q = q.where(rel_rev.c.current == True)
+    relationships_as_subject = _rows_by(session.execute(q),
+                                        'subject_package_id')
+    q = select([rel_rev]).where(rel_rev.c.object_package_id.in_(package_ids))
+    q = q.where(rel_rev.c.current == True)
+    relationships_as_object = _rows_by(session.execute(q),
+                                       'object_package_id')
+    #tracking, the most recent summary of each package and resource
+    tracking = model.tracking_summary_table
+    q = select([tracking.c.package_id, tracking.c.running_total,
+                tracking.c.recent_views]
+               ).where(tracking.c.package_id.in_(package_ids))
+    q = q.order_by(tracking.c.package_id, tracking.c.tracking_date.desc())
+    q = q.distinct(tracking.c.package_id)
+    package_tracking = dict((row.package_id, {'total': row.running_total,
+                                              'recent': row.recent_views})
+                            for row in session.execute(q))
+    resource_tracking = {}
+    urls = set(row.url for rows in resources.values() for row in rows)
+    if urls and not context.get('for_edit'):
+        q = select([tracking.c.url, tracking.c.running_total,
+                    tracking.c.recent_views]).where(tracking.c.url.in_(urls))
+        q = q.order_by(tracking.c.url, tracking.c.tracking_date.desc())
+        q = q.distinct(tracking.c.url)
+        resource_tracking = dict((row.url, {'total': row.running_total,
+                                            'recent': row.recent_views})
+                                 for row in session.execute(q))
+    #creation dates
+    package_rev = model.package_revision_table
+    q = select([package_rev.c.id, func.min(package_rev.c.revision_timestamp)]
+               ).where(package_rev.c.id.in_(package_ids)
+               ).group_by(package_rev.c.id)
+    created = dict(list(session.execute(q)))
+
+    license_register = model.Package.get_license_register()
+    # The resources' tracking summaries have been fetched above.
+    resource_context = dict(context, for_edit=True)
+
+    result_list = []
+    for row in package_rows:
+        package_id = row.id
+        track_modified(package_id, [row])
+        result_dict = d.table_dictize(row, context)
+
+        package_resources = resources.get(package_id, [])
+        track_modified(package_id, package_resources)
+        result_dict["resources"] = resource_list_dictize(package_resources,
+                                                         resource_context)
+        if not context.get('for_edit'):
+            # resource_dictize() may have changed the urls, so look them up
+            # by the urls in the database.
+            urls = dict((res.id, res.url) for res in package_resources)
+            for resource in result_dict["resources"]:
+                resource['tracking_summary'] = resource_tracking.get(
+                    urls[resource['id']], {'total': 0, 'recent': 0})
+
+        package_tags = tags.get(package_id, [])
+        track_modified(package_id, package_tags)
+        result_dict["tags"] = d.obj_list_dictize(package_tags, context,
+                                                 lambda x: x["name"])
+        for tag in result_dict['tags']:
+            del tag['package_id']
+            tag['display_name'] = tag['name']
+
+        package_extras = extras.get(package_id, [])
+        track_modified(package_id, package_extras)
+        result_dict["extras"] = extras_list_dictize(package_extras, context)
+
+        result_dict['tracking_summary'] = package_tracking.get(
+            package_id, {'total': 0, 'recent': 0})
+
+        result_dict["groups"] = d.obj_list_dictize(
+            groups.get(package_id, []), context)
+        for group_dict in result_dict["groups"]:
+            del group_dict['table_id']
+
+        package_organizations = organizations.get(row.owner_org, [])
+        track_modified(package_id, package_organizations)
+        package_organizations = d.obj_list_dictize(package_organizations,
+                                                   context)
+        if package_organizations:
+            result_dict["organization"] = package_organizations[0]
+        else:
+            result_dict["organization"] = None
+
+        for key, relationships in (
+                ('relationships_as_subject', relationships_as_subject),
+                ('relationships_as_object', relationships_as_object)):
+            package_relationships = relationships.get(package_id, [])
+            track_modified(package_id, package_relationships)
+            result_dict[key] = d.obj_list_dictize(package_relationships,
+                                                  context)
+
+        # isopen
+        license = None
+        if row.license_id:
+            try:
+                license = license_register[row.license_id]
+            except KeyError:
+                pass
+        result_dict['isopen'] = bool(license and license.isopen())
+
+        # type
+        # if null assign the default value to make searching easier
+        result_dict['type']= row.type or u'dataset'
+
+        # licence
+        if license and license.url:
+            result_dict['license_url']= license.url
+            result_dict['license_title']= license.title.split('::')[-1]
+        elif license:
+            result_dict['license_title']= license.title
+        else:
+            result_dict['license_title']= row.license_id
+
+        # creation and modification date
+        if not result_dict.get('metadata_modified'):
+            result_dict['metadata_modified'] = modified.get(package_id)
+        result_dict['metadata_created'] = created[package_id].isoformat() \
+            if created.get(package_id) else None
+
+        if context.get('for_view'):
+            for item in plugins.PluginImplementations( plugins.IPackageController):
+                result_dict = item.before_view(result_dict)
+
+        result_list.append(result_dict)
+
+    # table_dictize() keeps track of the last metadata_modified in the
+    # context, don't leave it lying around.
+    context.pop('metadata_modified', None)
+    return result_list
+
 def _get_members(context, group, member_type):
 
     model = context['model']
@@ -318,11 +541,40 @@ def _get_members(context, group, member_type):
                filter(model.Member.table_name == member_type[:-1])
     if member_type == 'packages':
         q = q.filter(Entity.private==False)
+    offset = context.get('offsets', {}).get(member_type, 0)
     if 'limits' in context and member_type in context['limits']:
-        return q[:context['limits'][member_type]]
+        # Order the members so that the pages don't overlap.
+        q = q.order_by(Entity.name)
+        return q[offset:offset + context['limits'][member_type]]
+    if offset:
+        return q.order_by(Entity.name)[offset:]
     return q.all()
 
 
+def _get_member_counts(context, group):
+    '''Return the group's number of members of each type, e.g.
+    ``{'package': 120, 'user': 3}``, from a single aggregate query.
+
+    Only public, active datasets are counted.
+
+    '''
+    model = context['model']
+    member = model.member_table
+    package = model.package_table
+    q = select([member.c.table_name,
+                func.count(member.c.table_id.distinct())],
+               from_obj=[member.outerjoin(package, and_(
+                   member.c.table_name == 'package',
+                   package.c.id == member.c.table_id))]) \
+        .where(member.c.group_id == group.id) \
+        .where(member.c.state == 'active') \
+        .where(or_(member.c.table_name != 'package',
+                   and_(package.c.state == 'active',
+                        package.c.private == False))) \
+        .group_by(member.c.table_name)
+    return dict(model.Session.execute(q).fetchall())
+
+
 def group_dictize(group, context):
     model = context['model']
     result_dict = d.table_dictize(group, context)
@@ -338,9 +590,8 @@ def group_dictize(group, context):
         _get_members(context, group, 'packages'),
         context)
 
-    query = search.PackageSearchQuery()
-    q = {'q': 'groups:"%s" +capacity:public' % group.name, 'rows': 1}
-    result_dict['package_count'] = query.run(q)['count']
+    result_dict['package_count'] = _get_member_counts(
+        context, group).get('package', 0)
 
     result_dict['tags'] = tag_list_dictize(
         _get_members(context, group, 'tags'),
@@ -350,9 +601,10 @@ def group_dictize(group, context):
         _get_members(context, group, 'groups'),
         context)
 
-    result_dict['users'] = user_list_dictize(
-        _get_members(context, group, 'users'),
-        context)
+    if context.get('include_users', True):
+        result_dict['users'] = user_list_dictize(
+            _get_members(context, group, 'users'),
+            context)
 
     context['with_capacity'] = False
 
@@ -327,8 +327,23 @@ def package_dict_save(pkg_dict, context):
 
     extras = package_extras_save(pkg_dict.get("extras"), pkg, context)
 
+    if context.get('skip_unchanged'):
+        context['package_unchanged'] = package is not None and \
+            not _has_revisioned_changes(context['session'])
+
     return pkg
 
+def _has_revisioned_changes(session):
+    '''Return whether any revisioned objects have been added, changed or
+    deleted in the session's current transaction.'''
+    changed = [obj for obj in session.dirty if
+        session.is_modified(obj, include_collections=False, passive=True)]
+    objects = set(session.new) | set(session.deleted) | set(changed)
+    # Objects that have already been flushed.
+    for flushed in getattr(session, '_object_cache', {}).values():
+        objects.update(flushed)
+    return any(hasattr(obj, '__revision_class__') for obj in objects)
+
 def group_member_save(context, group_dict, member_table_name):
     model = context["model"]
     session = context["session"]
@@ -5,6 +5,7 @@ users.
 
 '''
 import datetime
+import multiprocessing.pool
 import re
 
 import pylons
@@ -13,6 +14,7 @@ import pylons.i18n
 import ckan.model as model
 import ckan.logic as logic
 import ckan.lib.base as base
+import ckan.lib.dictization.model_dictize as model_dictize
 
 
 def string_to_timedelta(s):
@@ -118,21 +120,16 @@ def _notifications_from_dashboard_activity_list(user_dict, since):
     list since `since`.
 
     '''
-    # Get the user's dashboard activity stream.
+    # Get the user's new dashboard activities. The user's own activities are
+    # filtered out, so they don't get an email every time they themselves do
+    # something (we are not Trac).
+    limit = int(pylons.config.get('ckan.activity_list_limit', 31))
+    activity_objects = model.activity.dashboard_activity_list_since(
+            user_dict['id'], since, limit)
     context = {'model': model, 'session': model.Session,
             'user': user_dict['id']}
-    activity_list = logic.get_action('dashboard_activity_list')(context, {})
-
-    # Filter out the user's own activities., so they don't get an email every
-    # time they themselves do something (we are not Trac).
-    activity_list = [activity for activity in activity_list
-            if activity['user_id'] != user_dict['id']]
-
-    # Filter out the old activities.
-    strptime = datetime.datetime.strptime
-    fmt = '%Y-%m-%dT%H:%M:%S.%f'
-    activity_list = [activity for activity in activity_list
-            if strptime(activity['timestamp'], fmt) > since]
+    activity_list = model_dictize.activity_list_dictize(activity_objects,
+            context)
 
     return _notifications_for_activities(activity_list, user_dict)
 
@@ -183,26 +180,29 @@ def send_notification(user, email_dict):
         raise
 
 
-def get_and_send_notifications_for_user(user):
+def _email_notifications_since():
+    '''Return the datetime before which no email notifications are sent.
 
-    # Parse the email_notifications_since config setting, email notifications
-    # from longer ago than this time will not be sent.
+    This comes from the ckan.email_notifications_since config setting,
+    email notifications from longer ago than this will not be sent.
+
+    '''
     email_notifications_since = pylons.config.get(
             'ckan.email_notifications_since', '2 days')
     email_notifications_since = string_to_timedelta(
             email_notifications_since)
-    email_notifications_since = (datetime.datetime.now()
-            - email_notifications_since)
+    return datetime.datetime.now() - email_notifications_since
+
+
+def get_and_send_notifications_for_user(user):
+
+    since = _email_notifications_since()
 
     # FIXME: We are accessing model from lib here but I'm not sure what
     # else to do unless we add a get_email_last_sent() logic function which
     # would only be needed by this lib.
-    email_last_sent = model.Dashboard.get(user['id']).email_last_sent
-    activity_stream_last_viewed = (
-            model.Dashboard.get(user['id']).activity_stream_last_viewed)
-
-    since = max(email_notifications_since, email_last_sent,
-            activity_stream_last_viewed)
+    dash = model.Dashboard.get(user['id'])
+    since = max(since, dash.email_last_sent, dash.activity_stream_last_viewed)
 
     notifications = get_notifications(user, since)
 
@@ -210,17 +210,136 @@ def get_and_send_notifications_for_user(user):
     for notification in notifications:
         send_notification(user, notification)
 
-    # FIXME: We are accessing model from lib here but I'm not sure what
-    # else to do unless we add a update_email_last_sent()
-    # logic function which would only be needed by this lib.
-    dash = model.Dashboard.get(user['id'])
     dash.email_last_sent = datetime.datetime.now()
     model.repo.commit()
 
 
-def get_and_send_notifications_for_all_users():
-    context = {'model': model, 'session': model.Session, 'ignore_auth': True,
-            'keep_sensitive_data': True}
-    users = logic.get_action('user_list')(context, {})
+def _user_dict(user):
+    '''Return the few user fields that notifications need.
+
+    Cheaper than user_dictize(), which counts the user's edits and datasets.
+
+    '''
+    return {
+        'id': user.id,
+        'name': user.name,
+        'display_name': user.display_name,
+        'email': user.email,
+        'activity_streams_email_notifications':
+            user.activity_streams_email_notifications,
+        }
+
+
+def _send_messages(batch):
+    '''Send a batch of emails over a single SMTP connection.
+
+    :param batch: a list of (user_id, recipient_email, messages) tuples, where
+        messages is a list of messages made by ckan.lib.mailer.make_msg()
+
+    :returns: the ids of the users whose emails were all sent, and the
+        MailerException that stopped the batch or None
+    :rtype: tuple
+
+    '''
+    import ckan.lib.mailer
+
+    sent = []
+    try:
+        with ckan.lib.mailer.smtp_connection() as smtp_connection:
+            for user_id, recipient_email, messages in batch:
+                for msg in messages:
+                    ckan.lib.mailer.send_msg(smtp_connection,
+                            recipient_email, msg)
+                sent.append(user_id)
+    except ckan.lib.mailer.MailerException, e:
+        return sent, e
+    return sent, None
+
+
+def _get_and_send_notifications_for_users(user_ids, since, workers):
+    '''Send any email notifications for a chunk of users.
+
+    The users and their dashboards are loaded with one query each, the emails
+    are rendered here and then sent by `workers` threads each with their own
+    SMTP connection. Finally the email_last_sent time of each user whose
+    emails went out is updated in a single commit, making the dashboard rows
+    of users who don't have one yet.
+
+    '''
+    import ckan.lib.mailer
+
+    users = model.Session.query(model.User).filter(
+            model.User.id.in_(user_ids)).all()
+    dashboards = model.Session.query(model.Dashboard).filter(
+            model.Dashboard.user_id.in_(user_ids)).all()
+    dashboards = dict((dash.user_id, dash) for dash in dashboards)
+
+    # Rendering the emails needs the Pylons request-local objects, so it's
+    # done in this thread. Only the SMTP traffic is done by the workers.
+    outbox = []
     for user in users:
-        get_and_send_notifications_for_user(user)
+        dash = dashboards.get(user.id)
+        user_dict = _user_dict(user)
+        if dash is None:
+            user_since = since
+        else:
+            user_since = max(since, dash.email_last_sent,
+                    dash.activity_stream_last_viewed)
+        messages = [ckan.lib.mailer.make_msg(user_dict['display_name'],
+                user_dict['email'], notification['subject'],
+                notification['body'])
+            for notification in get_notifications(user_dict, user_since)]
+        outbox.append((user.id, user_dict['email'], messages))
+
+    batches = [outbox[i::workers] for i in range(workers)]
+    batches = [batch for batch in batches if batch]
+    if len(batches) > 1:
+        pool = multiprocessing.pool.ThreadPool(len(batches))
+        try:
+            results = pool.map(_send_messages, batches)
+        finally:
+            pool.close()
+    else:
+        results = [_send_messages(batch) for batch in batches]
+
+    # Record our progress before raising any errors, so that users who have
+    # already been emailed aren't emailed again when the job is rerun.
+    now = datetime.datetime.now()
+    for sent, error in results:
+        for user_id in sent:
+            dash = dashboards.get(user_id)
+            if dash is None:
+                # the user hasn't viewed their dashboard yet
+                dash = model.Dashboard(user_id)
+                model.Session.add(dash)
+            dash.email_last_sent = now
+    model.repo.commit()
+
+    for sent, error in results:
+        if error is not None:
+            raise error
+
+
+def get_and_send_notifications_for_all_users():
+    '''Send any pending email notifications to all users.
+
+    Only the users who have new activities are processed: they are found with
+    a single query, and then handled in chunks of
+    ``ckan.email_notifications.batch_size`` users (default: 100), each chunk
+    sent by ``ckan.email_notifications.workers`` threads (default: 1) with one
+    SMTP connection each.
+
+    Each user's email_last_sent time is committed after every chunk, so if the
+    job is interrupted it can simply be run again and will carry on with the
+    users who haven't been emailed yet.
+
+    '''
+    batch_size = int(pylons.config.get(
+        'ckan.email_notifications.batch_size', 100))
+    workers = int(pylons.config.get('ckan.email_notifications.workers', 1))
+
+    since = _email_notifications_since()
+    user_ids = model.activity.users_with_new_dashboard_activity(since)
+    for i in range(0, len(user_ids), batch_size):
+        _get_and_send_notifications_for_users(user_ids[i:i + batch_size],
+                since, workers)
@@ -0,0 +1,215 @@
+'''
+The SQLAlchemy engines of CKAN and the DataStore.
+
+All of the engines are made by get_engine(), which keeps one per pool name
+and URL, so that their connection pools are configured and measured in the
+same way. The pools are:
+
+* ``main``: the database at ``sqlalchemy.url``
+* ``replica``: its read replicas (see ckan.lib.replicas)
+* ``tracking``: the tracking middleware's connections
+* ``datastore``: the DataStore's read and write databases
+
+Each setting is read from ``ckan.db.<pool>.<setting>``, then from
+``ckan.db.<setting>``, and, for the main pool, from the existing
+``sqlalchemy.<setting>`` options:
+
+``pool_size``, ``max_overflow``, ``pool_timeout``, ``pool_recycle``
+  As for SQLAlchemy's create_engine() (defaults: 5, 10, 30 and -1, i.e.
+  connections are never recycled). Only used for PostgreSQL.
+
+``pre_ping``
+  Check that a connection still works, with ``SELECT 1``, each time it's
+  taken from the pool, and replace it if not, e.g. after the database was
+  restarted (default: false).
+
+``statement_timeout``
+  The number of milliseconds after which PostgreSQL cancels a statement
+  (default: none).
+
+The statements of the action functions can be given their own timeouts,
+``ckan.db.read_statement_timeout`` for the side-effect-free ones and
+``ckan.db.write_statement_timeout`` for the others, see statement_timeout().
+
+The number of checkouts of each pool, the time they waited for a connection
+and the share of the pool in use are returned by stats(), which status_show
+reports to sysadmins.
+
+'''
+import contextlib
+import logging
+import threading
+import time
+
+import sqlalchemy
+import sqlalchemy.event
+import sqlalchemy.exc
+import sqlalchemy.pool
+from paste.deploy.converters import asbool
+from pylons import config
+
+import ckan.model.meta as meta
+
+log = logging.getLogger(__name__)
+
+_POOL_SETTINGS = ('pool_size', 'max_overflow', 'pool_timeout',
+                  'pool_recycle')
+
+# (pool name, url) -> engine
+_engines = {}
+_lock = threading.Lock()
+_local = threading.local()
+
+
+class MeasuredQueuePool(sqlalchemy.pool.QueuePool):
+    '''A QueuePool that counts its checkouts, how long they waited for a
+    connection (including making a new one) and how many timed out.'''
+
+    def __init__(self, *args, **kwargs):
+        super(MeasuredQueuePool, self).__init__(*args, **kwargs)
+        self.max_overflow = kwargs.get('max_overflow', 10)
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait = 0.0
+        self.max_wait = 0.0
+
+    def _do_get(self):
+        start = time.time()
+        try:
+            return super(MeasuredQueuePool, self)._do_get()
+        except sqlalchemy.exc.TimeoutError:
+            self.timeouts += 1
+            raise
+        finally:
+            wait = time.time() - start
+            self.checkouts += 1
+            self.wait += wait
+            self.max_wait = max(self.max_wait, wait)
+
+
+def _setting(pool, name, default=None):
+    for key in ('ckan.db.%s.%s' % (pool, name), 'ckan.db.%s' % name):
+        if key in config:
+            return config[key]
+    if pool == 'main':
+        return config.get('sqlalchemy.%s' % name, default)
+    return default
+
+
+def _ping(dbapi_connection, connection_record, connection_proxy):
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute('SELECT 1')
+    except Exception, e:
+        log.warning('Replacing a broken database connection: %s', e)
+        # the pool tries again with a new connection
+        raise sqlalchemy.exc.DisconnectionError()
+    finally:
+        cursor.close()
+
+
+def _create_engine(pool, url, **kwargs):
+    url = sqlalchemy.engine.url.make_url(url)
+    if pool == 'main':
+        # the other sqlalchemy.* options, as engine_from_config() does
+        options = dict((key[len('sqlalchemy.'):], value)
+                       for key, value in config.items()
+                       if key.startswith('sqlalchemy.') and
+                       key[len('sqlalchemy.'):] not in
+                       ('url',) + _POOL_SETTINGS)
+        options['_coerce_config'] = True
+        options.update(kwargs)
+        kwargs = options
+
+    if url.drivername.startswith('postgres'):
+        kwargs['poolclass'] = MeasuredQueuePool
+        for name in _POOL_SETTINGS:
+            value = _setting(pool, name)
+            if value is not None:
+                kwargs[name] = int(value)
+        timeout = _setting(pool, 'statement_timeout')
+        if timeout:
+            connect_args = dict(kwargs.get('connect_args', {}))
+            connect_args['options'] = '-c statement_timeout=%i' % int(timeout)
+            kwargs['connect_args'] = connect_args
+    elif _setting(pool, 'pool_recycle') is not None:
+        kwargs['pool_recycle'] = int(_setting(pool, 'pool_recycle'))
+
+    engine = sqlalchemy.create_engine(url, **kwargs)
+    if asbool(_setting(pool, 'pre_ping', False)):
+        sqlalchemy.event.listen(engine, 'checkout', _ping)
+    if asbool(config.get('ckan.timing.enabled', 'false')):
+        import ckan.lib.timing as timing
+        timing.instrument_engine(engine)
+    return engine
+
+
+def get_engine(pool, url, **kwargs):
+    '''Return the engine for `url` in `pool`, making it with the pool's
+    settings the first time. `kwargs` are passed on to create_engine().'''
+    key = (pool, str(url))
+    engine = _engines.get(key)
+    if engine is None:
+        with _lock:
+            engine = _engines.get(key)
+            if engine is None:
+                engine = _engines[key] = _create_engine(pool, url, **kwargs)
+    return engine
+
+
+def forget(engine):
+    '''Stop keeping `engine`, so that get_engine() makes a new one for its
+    pool and URL, e.g. after the config has changed.'''
+    with _lock:
+        for key, value in _engines.items():
+            if value is engine:
+                del _engines[key]
+
+
+@contextlib.contextmanager
+def statement_timeout(action, context):
+    '''Apply the statement timeout of the class of `action`, read or write,
+    to the queries the model session makes while it runs.
+
+    The timeout is only set by the outermost action, and lasts until the
+    session's transaction ends. DataStore actions set their own.'''
+    depth = getattr(_local, 'action_depth', 0)
+    _local.action_depth = depth + 1
+    try:
+        if not depth and context.get('session') is meta.Session:
+            kind = 'read' if getattr(action, 'side_effect_free', False) \
+                else 'write'
+            timeout = config.get('ckan.db.%s_statement_timeout' % kind)
+            if timeout and meta.engine_is_pg():
+                meta.Session.execute(
+                    'SET LOCAL statement_timeout = %i' % int(timeout))
+        yield
+    finally:
+        _local.action_depth = depth
+
+
+def stats():
+    '''Return the use of each connection pool in this process.'''
+    pools = []
+    for (pool, url), engine in sorted(_engines.items()):
+        if not isinstance(engine.pool, MeasuredQueuePool):
+            continue
+        url = sqlalchemy.engine.url.make_url(url)
+        queue_pool = engine.pool
+        checked_out = queue_pool.checkedout()
+        capacity = queue_pool.size() + queue_pool.max_overflow
+        pools.append({
+            'pool': pool,
+            'database': '%s/%s' % (url.host or 'localhost', url.database),
+            'size': queue_pool.size(),
+            'max_overflow': queue_pool.max_overflow,
+            'checked_out': checked_out,
+            'utilization': (float(checked_out) / capacity
+                            if queue_pool.max_overflow >= 0 else None),
+            'checkouts': queue_pool.checkouts,
+            'timeouts': queue_pool.timeouts,
+            'wait_avg_ms': (queue_pool.wait * 1000 / queue_pool.checkouts
+                            if queue_pool.checkouts else None),
+            'wait_max_ms': queue_pool.max_wait * 1000,
+            })
+    return pools
@@ -0,0 +1,131 @@
+'''
+A cache of rendered template fragments.
+
+Listings like the dataset search results render the same snippets, e.g.
+``snippets/package_item.html``, for the same objects request after request.
+A fragment is cached by giving a key that changes whenever the output
+would, usually the object's id and its ``revision_id`` or
+``metadata_modified``::
+
+  {% snippet 'snippets/package_item.html', package=package,
+             cache_key=[package.id, package.metadata_modified] %}
+
+  {% cache group.id, group.revision_id %}
+    ...
+  {% endcache %}
+
+or ``h.snippet(..., cache_key=...)`` in Python. Keys are also made of the
+template name, the current language and any string, number or boolean
+arguments of the snippet. The fragments are kept in a bounded, in-process
+LRU cache and, optionally, in a shared Beaker cache (e.g. memcached) used by
+all the worker processes. The fanstatic resources that a fragment includes
+are included again whenever it's served from the cache.
+
+The cache is off in debug mode, so that changes to the templates show up.
+
+Config settings:
+
+``ckan.fragment_cache.size``
+  The maximum number of fragments kept in each process (default: 1000, 0
+  turns the cache off).
+
+``ckan.fragment_cache.expires``
+  How long, in seconds, a cached fragment is used for (default: 3600).
+
+``ckan.fragment_cache.shared_type``
+  The type of an optional Beaker cache shared by all processes, e.g.
+  ``ext:memcached``, using the ``beaker.cache.*`` settings (default: none).
+
+'''
+import hashlib
+import threading
+
+from paste.deploy.converters import asbool
+from pylons import config
+import pylons.i18n
+
+import ckan.lib.caching as caching
+
+# The types of snippet arguments that are part of the key.
+_KEY_TYPES = (basestring, int, long, float, bool, type(None))
+
+_local = threading.local()
+_cache = caching.Cache('fragment', 'ckan.fragment_cache')
+
+
+def enabled():
+    return bool(_cache.max_size()) and not asbool(config.get('debug', False))
+
+
+def make_key(template_name, cache_key, extra_vars=None):
+    '''Return the key of a fragment of `template_name` for `cache_key`.
+
+    The string, number, boolean and None values in `extra_vars` are part of
+    the key, other values (e.g. the dataset dict the fragment shows) are
+    expected to be covered by `cache_key`.
+
+    '''
+    simple_vars = sorted((name, value)
+                         for name, value in (extra_vars or {}).items()
+                         if isinstance(value, _KEY_TYPES))
+    try:
+        lang = pylons.i18n.get_lang()
+    except TypeError:
+        # not in a request
+        lang = None
+    return hashlib.md5(repr((template_name, lang, cache_key,
+                             simple_vars))).hexdigest()
+
+
+def _recordings():
+    if not hasattr(_local, 'recordings'):
+        _local.recordings = []
+    return _local.recordings
+
+
+def resource_needed(resource):
+    '''Note that the fragments being rendered include the fanstatic
+    `resource`. Called by h.include_resource().'''
+    for recording in _recordings():
+        recording.append(resource)
+
+
+def get_fragment(key, render):
+    '''Return the fragment cached under `key`, or call `render` to render it
+    and cache it.
+
+    :param key: the fragment's key, see make_key()
+    :param render: a function that takes no arguments and returns the
+        fragment
+
+    :returns: the fragment, as a unicode string
+
+    '''
+    if not enabled():
+        return render()
+
+    fragment = _cache.get(key)
+    if fragment is None:
+        recording = []
+        _recordings().append(recording)
+        try:
+            html = render()
+        finally:
+            _recordings().pop()
+        fragment = (unicode(html), recording)
+        _cache.set(key, fragment)
+    else:
+        import ckan.lib.helpers as h
+        for resource in fragment[1]:
+            h.include_resource(resource)
+    return fragment[0]
+
+
+def clear():
+    '''Remove all the cached fragments.'''
+    _cache.clear()
+
+
+def stats():
+    '''Return this process's cache hit and miss counts.'''
+    return _cache.stats()
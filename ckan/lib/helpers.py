@@ -36,6 +36,7 @@ from pylons import c, g
 from pylons.i18n import _, ungettext
 
 import ckan.lib.fanstatic_resources as fanstatic_resources
+import ckan.lib.fragment_cache as fragment_cache
 import ckan.model as model
 import ckan.lib.formatters as formatters
 import ckan.lib.maintain as maintain
@@ -1144,6 +1145,7 @@ def remove_url_param(key, value=None, replace=None, controller=None,
 def include_resource(resource):
     r = getattr(fanstatic_resources, resource)
     r.need()
+    fragment_cache.resource_needed(resource)
 
 
 def urls_for_resource(resource):
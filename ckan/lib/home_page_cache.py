@@ -0,0 +1,80 @@
+'''
+A cache for the data shown on the site's front page.
+
+The front page runs a faceted package_search, a group_list with all fields and
+a group_show for each featured group, so it is expensive to build but is also
+the most visited page of the site. Its data is kept in a Beaker cache that
+expires after ``ckan.home_page_cache_expires`` seconds (default: 300, 0
+disables the cache) and is cleared whenever a dataset, group or organization
+is created, updated or deleted.
+
+The cache type is set by ``ckan.home_page_cache_type`` (default: ``dbm``).
+The default ``dbm`` type, like ``file`` or ``ext:memcached``, is shared by
+all the worker processes of a site so they all see the same, fresh data. The
+``memory`` type is per-process, clearing it only affects the process where
+the change was made and the other processes rely on the expiry time.
+
+'''
+import logging
+
+from pylons import config
+
+import ckan.lib.caching as caching
+import ckan.plugins as plugins
+
+log = logging.getLogger(__name__)
+
+
+def _expires():
+    return int(config.get('ckan.home_page_cache_expires', 300))
+
+
+def _get_cache():
+    # A shared type (the default) is shared by every worker process.
+    return caching.get_beaker_cache('home_page',
+            config.get('ckan.home_page_cache_type', 'dbm'), _expires())
+
+
+def get(key, createfunc):
+    '''Return the cached home page data for `key`.
+
+    If there's no cached value for `key` or it has expired, `createfunc` is
+    called to compute it. Only one process at a time will call `createfunc`
+    for a key, the others wait for it and use its value.
+
+    '''
+    if not _expires():
+        return createfunc()
+    return _get_cache().get_value(key=key, createfunc=createfunc)
+
+
+def clear():
+    '''Remove all the cached home page data.'''
+    if not _expires():
+        return
+    try:
+        _get_cache().clear()
+    except Exception, e:
+        # The cached data will still expire, so don't fail the write that
+        # triggered this.
+        log.exception(e)
+
+
+class HomePageCacheInvalidator(plugins.SingletonPlugin):
+    '''Clear the home page cache when datasets or groups change.'''
+
+    plugins.implements(plugins.IDomainObjectModification, inherit=True)
+    plugins.implements(plugins.IGroupController, inherit=True)
+    plugins.implements(plugins.IOrganizationController, inherit=True)
+
+    def notify(self, entity, operation):
+        clear()
+
+    def create(self, entity):
+        clear()
+
+    def edit(self, entity):
+        clear()
+
+    def delete(self, entity):
+        clear()
@@ -0,0 +1,221 @@
+'''
+Check the query plans of CKAN's most frequent queries for missing indexes.
+
+Run with ``paster db index-audit [{rows}]``. Each of the queries in
+STANDARD_QUERIES is run with EXPLAIN ANALYZE and the report shows how long it
+took and which tables it read with a sequential scan, along with the indexes
+in EXPECTED_INDEXES that the database doesn't have.
+
+Small sites will see sequential scans that don't matter, so ``rows`` fake
+users, datasets, group members, activities and tracking rows can be added
+first. They are added in a transaction that is rolled back at the end, so the
+database is left as it was. Run the audit before and after ``paster db
+upgrade`` to compare the timings.
+
+Only PostgreSQL is supported.
+
+'''
+import json
+import re
+import time
+
+import sqlalchemy
+
+import ckan.model as model
+
+# (name, query, query for the query's parameters)
+STANDARD_QUERIES = [
+    ('user by API key',
+     'SELECT * FROM "user" WHERE apikey = :apikey',
+     'SELECT apikey FROM "user" WHERE apikey IS NOT NULL LIMIT 1'),
+    ("group's datasets",
+     '''SELECT table_id FROM member
+        WHERE group_id = :group_id AND table_name = 'package'
+          AND state = 'active' ''',
+     '''SELECT group_id FROM member WHERE table_name = 'package'
+        GROUP BY group_id ORDER BY count(*) DESC LIMIT 1'''),
+    ('group membership check',
+     '''SELECT capacity FROM member
+        WHERE group_id = :group_id AND table_name = 'user'
+          AND table_id = :table_id AND state = 'active' ''',
+     '''SELECT group_id, table_id FROM member WHERE table_name = 'user'
+        LIMIT 1'''),
+    ("user's activity stream",
+     '''SELECT * FROM activity WHERE user_id = :user_id
+        ORDER BY timestamp DESC LIMIT 31''',
+     'SELECT user_id FROM activity LIMIT 1'),
+    ("dataset's activity stream",
+     '''SELECT * FROM activity WHERE object_id = :object_id
+        ORDER BY timestamp DESC LIMIT 31''',
+     'SELECT object_id FROM activity LIMIT 1'),
+    ('package_list',
+     '''SELECT name FROM package_revision
+        WHERE state = 'active' AND current = true''',
+     None),
+    ('package_list since',
+     '''SELECT name FROM package_revision
+        WHERE state = 'active' AND current = true
+          AND metadata_modified > :since''',
+     'SELECT max(metadata_modified) AS since FROM package'),
+    ('recent page views',
+     'SELECT count(*) FROM tracking_raw WHERE access_timestamp > :since',
+     'SELECT max(access_timestamp) AS since FROM tracking_raw'),
+    ("dataset's page views",
+     '''SELECT running_total, recent_views FROM tracking_summary
+        WHERE package_id = :package_id
+        ORDER BY tracking_date DESC LIMIT 1''',
+     '''SELECT package_id FROM tracking_summary
+        WHERE package_id IS NOT NULL LIMIT 1'''),
+]
+
+# (table, indexed columns) of the indexes the queries above need.
+EXPECTED_INDEXES = [
+    ('user', ['apikey']),
+    ('member', ['group_id', 'table_name', 'table_id']),
+    ('activity', ['user_id', 'timestamp']),
+    ('activity', ['object_id', 'timestamp']),
+    ('package_revision', ['current', 'state']),
+    ('package_revision', ['metadata_modified']),
+    ('tracking_raw', ['access_timestamp']),
+    ('tracking_summary', ['package_id', 'tracking_date']),
+]
+
+_FAKE_DATA_SQL = [
+    '''INSERT INTO revision (id, timestamp, author, message, state)
+       VALUES ('index-audit', now(), 'index-audit', '', 'active')''',
+    '''INSERT INTO "user" (id, name, apikey, created, sysadmin)
+       SELECT 'index-audit-' || n, 'index-audit-' || n, md5(n::text), now(),
+              false
+       FROM generate_series(1, :rows) AS n''',
+    '''INSERT INTO "group" (id, name, title, type, state, revision_id,
+                           is_organization, approval_status)
+       SELECT 'index-audit-' || n, 'index-audit-' || n, '', 'group',
+              'active', 'index-audit', false, 'approved'
+       FROM generate_series(1, 10) AS n''',
+    '''INSERT INTO package (id, name, type, state, private, revision_id,
+                           metadata_modified)
+       SELECT 'index-audit-' || n, 'index-audit-' || n, 'dataset', 'active',
+              false, 'index-audit', now() - n * interval '1 minute'
+       FROM generate_series(1, :rows) AS n''',
+    '''INSERT INTO package_revision (id, name, type, state, private,
+                                    revision_id, continuity_id,
+                                    metadata_modified, revision_timestamp,
+                                    expired_timestamp, current)
+       SELECT id, name, type, state, private, revision_id, id,
+              metadata_modified, metadata_modified, '9999-12-31', true
+       FROM package WHERE revision_id = 'index-audit' ''',
+    '''INSERT INTO member (id, table_id, table_name, capacity, group_id,
+                          state, revision_id)
+       SELECT 'index-audit-' || n, 'index-audit-' || n, 'package', 'public',
+              'index-audit-' || (n % 10 + 1), 'active', 'index-audit'
+       FROM generate_series(1, :rows) AS n''',
+    '''INSERT INTO activity (id, timestamp, user_id, object_id, revision_id,
+                            activity_type)
+       SELECT 'index-audit-' || n, now() - n * interval '1 minute',
+              'index-audit-' || (n % 100 + 1), 'index-audit-' || n,
+              'index-audit', 'new package'
+       FROM generate_series(1, :rows * 5) AS n''',
+    '''INSERT INTO tracking_raw (user_key, url, tracking_type,
+                                access_timestamp)
+       SELECT md5(n::text), '/dataset/index-audit-' || (n % 1000), 'page',
+              now() - n * interval '1 second'
+       FROM generate_series(1, :rows * 10) AS n''',
+    '''INSERT INTO tracking_summary (url, package_id, tracking_type, count,
+                                    running_total, recent_views,
+                                    tracking_date)
+       SELECT '/dataset/index-audit-' || (n % :rows),
+              'index-audit-' || (n % :rows), 'page', 1, n, 1,
+              now() - n * interval '1 day'
+       FROM generate_series(1, :rows * 5) AS n''',
+]
+
+
+def add_fake_data(connection, rows):
+    '''Add `rows` fake users, datasets etc., and update the planner's
+    statistics.'''
+    for statement in _FAKE_DATA_SQL:
+        connection.execute(sqlalchemy.text(statement), rows=rows)
+    for table in ('"user"', '"group"', 'package', 'package_revision', 'member',
+                  'activity', 'tracking_raw', 'tracking_summary'):
+        connection.execute('ANALYZE %s' % table)
+
+
+def seq_scans(plan):
+    '''Return the names of the tables that a JSON query plan reads with a
+    sequential scan.'''
+    tables = []
+    if plan.get('Node Type') == 'Seq Scan':
+        tables.append(plan.get('Relation Name'))
+    for child in plan.get('Plans', []):
+        tables.extend(seq_scans(child))
+    return tables
+
+
+def explain(connection, query, params):
+    '''Run `query` with EXPLAIN ANALYZE.
+
+    :returns: a tuple of the query's run time in milliseconds and the tables
+        it read with a sequential scan
+
+    '''
+    result = connection.execute(
+        sqlalchemy.text('EXPLAIN (ANALYZE, FORMAT JSON) ' + query), **params)
+    output = result.fetchone()[0]
+    if isinstance(output, basestring):
+        output = json.loads(output)
+    plan = output[0]
+    return plan.get('Total Runtime', plan.get('Execution Time')), \
+        seq_scans(plan['Plan'])
+
+
+def _index_columns(index_definition):
+    '''Return the columns of an index from its CREATE INDEX statement.'''
+    match = re.search(r'\(([^()]*)\)\s*(WHERE .*)?$', index_definition)
+    if not match:
+        return []
+    return [column.strip().strip('"').split(' ')[0]
+            for column in match.group(1).split(',')]
+
+
+def missing_indexes(connection):
+    '''Return the (table, columns) in EXPECTED_INDEXES that no index of the
+    database starts with.'''
+    indexes = {}
+    for table, definition in connection.execute(
+            'SELECT tablename, indexdef FROM pg_indexes '
+            'WHERE schemaname = current_schema()'):
+        indexes.setdefault(table, []).append(_index_columns(definition))
+    return [(table, columns) for table, columns in EXPECTED_INDEXES
+            if not any(index[:len(columns)] == columns
+                       for index in indexes.get(table, []))]
+
+
+def audit(rows=0):
+    '''Explain the standard queries and look for missing indexes.
+
+    :param rows: the number of fake rows to add before the queries are run
+    :returns: a tuple of the list of (name, milliseconds, seq scanned tables)
+        of each query run, and the list of missing (table, columns) indexes
+
+    '''
+    connection = model.Session.connection()
+    try:
+        if rows:
+            add_fake_data(connection, rows)
+        results = []
+        for name, query, params_query in STANDARD_QUERIES:
+            params = {}
+            if params_query:
+                row = connection.execute(params_query).fetchone()
+                if row is None or None in row.values():
+                    results.append((name, None, []))
+                    continue
+                params = dict(row.items())
+            start = time.time()
+            runtime, tables = explain(connection, query, params)
+            if runtime is None:
+                runtime = (time.time() - start) * 1000
+            results.append((name, runtime, tables))
+        return results, missing_indexes(connection)
+    finally:
+        model.Session.rollback()
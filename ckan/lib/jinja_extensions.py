@@ -1,6 +1,8 @@
 import re
+import os
 from os import path
 import logging
+import tempfile
 
 from jinja2 import nodes
 from jinja2 import loaders
@@ -9,8 +11,11 @@ from jinja2.exceptions import TemplateNotFound
 from jinja2.utils import open_if_exists, escape
 from jinja2.filters import do_truncate
 from jinja2 import Environment
+from jinja2 import Markup
+from jinja2.bccache import FileSystemBytecodeCache
 
 import ckan.lib.base as base
+import ckan.lib.fragment_cache as fragment_cache
 import ckan.lib.helpers as h
 
 
@@ -199,6 +204,56 @@ OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
         raise TemplateNotFound(template)
 
 
+class CkanBytecodeCache(FileSystemBytecodeCache):
+    ''' Keeps the compiled templates in a directory, usually in cache_dir,
+    so that they don't need compiling again by new processes. Each file is
+    written to a temporary file first so that other processes never load a
+    half written one. '''
+
+    def __init__(self, directory):
+        if not path.exists(directory):
+            os.makedirs(directory)
+        FileSystemBytecodeCache.__init__(self, directory)
+
+    def dump_bytecode(self, bucket):
+        fd, tmp_filename = tempfile.mkstemp(dir=self.directory)
+        f = os.fdopen(fd, 'wb')
+        try:
+            bucket.write_bytecode(f)
+        finally:
+            f.close()
+        os.rename(tmp_filename, self._get_cache_filename(bucket))
+
+
+class FragmentCacheExtension(ext.Extension):
+    ''' Custom cache tag
+
+    {% cache <key>[, <key>].. %}
+      ...
+    {% endcache %}
+
+    caches the rendered content of the tag until the keys change, see
+    lib.fragment_cache for more details. '''
+
+    tags = set(['cache'])
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        keys = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            keys.append(parser.parse_expression())
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        # the template name and line number tell apart the cache tags
+        args = [nodes.Const(parser.name), nodes.Const(lineno),
+                nodes.List(keys)]
+        return nodes.CallBlock(self.call_method('_cache', args),
+                               [], [], body).set_lineno(lineno)
+
+    def _cache(self, template_name, lineno, keys, caller):
+        key = fragment_cache.make_key((template_name, lineno), keys)
+        return Markup(fragment_cache.get_fragment(key, caller))
+
+
 class BaseExtension(ext.Extension):
     ''' Base class for creating custom jinja2 tags.
     parse expects a tag of the format
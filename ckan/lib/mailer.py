@@ -1,3 +1,4 @@
+import contextlib
 import smtplib
 import logging
 import uuid
@@ -23,7 +24,7 @@ def add_msg_niceties(recipient_name, body, sender_name, sender_url):
            + u"\r\n\r\n%s\r\n\r\n" % body \
            + u"--\r\n%s (%s)" % (sender_name, sender_url)
 
-def _mail_recipient(recipient_name, recipient_email,
+def _make_msg(recipient_name, recipient_email,
         sender_name, sender_url, subject,
         body, headers={}):
     mail_from = config.get('smtp.mail_from')
@@ -37,8 +38,21 @@ def _mail_recipient(recipient_name, recipient_email,
     msg['To'] = Header(recipient, 'utf-8')
     msg['Date'] = Utils.formatdate(time())
     msg['X-Mailer'] = "CKAN %s" % __version__
+    return msg
 
-    # Send the email using Python's smtplib.
+@contextlib.contextmanager
+def smtp_connection():
+    '''Connect to the configured SMTP server and yield the connection.
+
+    The connection is identified, put into TLS mode and logged in according
+    to the CKAN config, and closed again when the with block exits. Any
+    smtplib.SMTPException raised inside the block is re-raised as a
+    MailerException.
+
+    This doesn't use any request-local Pylons objects, so it can be used from
+    worker threads.
+
+    '''
     smtp_connection = smtplib.SMTP()
     if 'smtp.test_server' in config:
         # If 'smtp.test_server' is configured we assume we're running tests,
@@ -76,8 +90,7 @@ def _mail_recipient(recipient_name, recipient_email,
                     "smtp.password must be configured as well.")
             smtp_connection.login(smtp_user, smtp_password)
 
-        smtp_connection.sendmail(mail_from, [recipient_email], msg.as_string())
-        log.info("Sent email to {0}".format(recipient_email))
+        yield smtp_connection
 
     except smtplib.SMTPException, e:
         msg = '%r' % e
@@ -86,11 +99,37 @@ def _mail_recipient(recipient_name, recipient_email,
     finally:
         smtp_connection.quit()
 
+def send_msg(smtp_connection, recipient_email, msg):
+    '''Send a message made by make_msg() over an open SMTP connection.'''
+    mail_from = config.get('smtp.mail_from')
+    smtp_connection.sendmail(mail_from, [recipient_email], msg.as_string())
+    log.info("Sent email to {0}".format(recipient_email))
+
+def _mail_recipient(recipient_name, recipient_email,
+        sender_name, sender_url, subject,
+        body, headers={}):
+    msg = _make_msg(recipient_name, recipient_email, sender_name, sender_url,
+            subject, body, headers=headers)
+
+    # Send the email using Python's smtplib.
+    with smtp_connection() as connection:
+        send_msg(connection, recipient_email, msg)
+
 def mail_recipient(recipient_name, recipient_email, subject,
         body, headers={}):
     return _mail_recipient(recipient_name, recipient_email,
             g.site_title, g.site_url, subject, body, headers=headers)
 
+def make_msg(recipient_name, recipient_email, subject, body, headers={}):
+    '''Return an email message to the given recipient, ready for send_msg().
+
+    Use this together with smtp_connection() and send_msg() to send many
+    emails over a single SMTP connection.
+
+    '''
+    return _make_msg(recipient_name, recipient_email, g.site_title,
+            g.site_url, subject, body, headers=headers)
+
 def mail_user(recipient, subject, body, headers={}):
     if (recipient.email is None) or not len(recipient.email):
         raise MailerException(_("No recipient email address available!"))
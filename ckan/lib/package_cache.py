@@ -0,0 +1,179 @@
+'''
+A cache of the dataset dicts built by package_show.
+
+Dictizing a dataset takes about ten queries on the revision tables, and
+package_show is called a lot: by the dataset pages, by resource_show, by the
+search indexer and by package_update for its return value. This caches the
+dictized datasets in a bounded, in-process LRU cache and, optionally, in a
+shared Beaker cache (e.g. memcached) used by all the worker processes.
+
+Entries are keyed by the dataset's id and its current revision id, and the
+IDomainObjectModification notifications clear a dataset's entries whenever it
+or one of its resources, tags, extras etc. changes. Reads of old versions of a
+dataset (``revision_id`` or ``revision_date`` in the context) and reads inside
+a transaction with uncommitted changes always bypass the cache.
+
+Config settings:
+
+``ckan.package_show_cache.size``
+  The maximum number of dataset dicts kept in each process (default: 1000,
+  0 turns the cache off).
+
+``ckan.package_show_cache.expires``
+  How long, in seconds, a cached dataset dict is used for (default: 3600).
+  Tracking summaries don't make new revisions, so this bounds how out of date
+  their counts can be.
+
+``ckan.package_show_cache.shared_type``
+  The type of an optional Beaker cache shared by all processes, e.g.
+  ``ext:memcached``, using the ``beaker.cache.*`` settings (default: none).
+  Without a shared cache, changes made by one process are only seen by the
+  others through the dataset's revision id or the expiry time.
+
+'''
+import copy
+import logging
+import uuid
+
+import ckan.lib.caching as caching
+import ckan.plugins as plugins
+
+log = logging.getLogger(__name__)
+
+# Context keys that change what package_dictize() returns.
+_VARIANT_KEYS = ('for_edit', 'extras_as_string', 'active')
+
+# Context keys that ask for an old version of the dataset.
+_BYPASS_KEYS = ('revision_id', 'revision_date', 'pending')
+
+_cache = caching.Cache('package_show', 'ckan.package_show_cache')
+_cache.counts['bypassed'] = 0
+
+
+def _shared_token(shared_cache, package_id):
+    '''Return the dataset's current token in the shared cache.
+
+    The token is part of the shared cache keys and is changed to invalidate
+    all of the dataset's entries at once, in all processes.
+
+    '''
+    try:
+        return shared_cache.get_value('token:%s' % package_id)
+    except KeyError:
+        return ''
+
+
+def _bypass(context, session):
+    if any(context.get(key) for key in _BYPASS_KEYS):
+        return True
+    # Uncommitted changes in this session, for example while the search
+    # index is being updated or package_update is running, must be seen.
+    return hasattr(session, '_object_cache')
+
+
+def get_package_dict(pkg, context, dictize):
+    '''Return the dictized dataset, from the cache if possible.
+
+    :param pkg: the dataset to dictize
+    :type pkg: ckan.model.Package
+    :param context: the action context
+    :param dictize: the function that dictizes a dataset, e.g.
+        package_dictize, called with `pkg` and a copy of `context` on a cache
+        miss
+
+    :returns: a copy of the dataset dict that the caller can modify
+
+    '''
+    model = context['model']
+    if not _cache.max_size() or _bypass(context, model.Session()):
+        _cache.count('bypassed')
+        return dictize(pkg, context)
+
+    shared_cache = _cache.shared()
+    token = _shared_token(shared_cache, pkg.id) if shared_cache else ''
+    variant = tuple(context.get(key) for key in _VARIANT_KEYS)
+    key = (pkg.id, pkg.revision_id, token, variant)
+
+    package_dict = _cache.get(key)
+    if package_dict is None:
+        # IPackageController.before_view() is the last step of dictizing,
+        # so it's left out of the cached dict and done for each call.
+        dictize_context = dict(context)
+        dictize_context.pop('for_view', None)
+        package_dict = dictize(pkg, dictize_context)
+        _cache.set(key, package_dict)
+
+    package_dict = copy.deepcopy(package_dict)
+    if context.get('for_view'):
+        for item in plugins.PluginImplementations(plugins.IPackageController):
+            package_dict = item.before_view(package_dict)
+    return package_dict
+
+
+def invalidate(package_id):
+    '''Remove all the cached dicts of the given dataset.'''
+    _cache.delete_matching(lambda key: key[0] == package_id)
+    shared_cache = _cache.shared()
+    if shared_cache:
+        try:
+            shared_cache.set_value('token:%s' % package_id, uuid.uuid4().hex)
+        except Exception, e:
+            log.exception(e)
+
+
+def clear():
+    '''Remove all the cached dataset dicts.'''
+    _cache.clear()
+
+
+def stats():
+    '''Return this process's cache hit and miss counts.'''
+    return _cache.stats()
+
+
+class PackageCacheInvalidator(plugins.SingletonPlugin):
+    '''Invalidate the cached dicts of datasets that change.
+
+    Datasets are invalidated as soon as the change is notified, and again
+    after the commit in case another request cached the old version of the
+    dataset in the meantime.
+
+    '''
+    plugins.implements(plugins.IDomainObjectModification, inherit=True)
+    plugins.implements(plugins.ISession, inherit=True)
+    plugins.implements(plugins.IGroupController, inherit=True)
+    plugins.implements(plugins.IOrganizationController, inherit=True)
+
+    def notify(self, entity, operation):
+        import ckan.model as model
+        if isinstance(entity, model.Package):
+            package_ids = [entity.id]
+        else:
+            try:
+                package_ids = [pkg.id for pkg in entity.related_packages()
+                               if pkg]
+            except AttributeError:
+                return
+        session = model.Session()
+        if not hasattr(session, '_package_cache_invalidated'):
+            session._package_cache_invalidated = set()
+        for package_id in package_ids:
+            invalidate(package_id)
+            session._package_cache_invalidated.add(package_id)
+
+    def after_commit(self, session):
+        for package_id in getattr(session, '_package_cache_invalidated', []):
+            invalidate(package_id)
+        session._package_cache_invalidated = set()
+
+    def after_rollback(self, session):
+        session._package_cache_invalidated = set()
+
+    # The datasets' dicts include their groups' names and titles, so changes
+    # to groups clear the whole cache.
+
+    def edit(self, entity):
+        clear()
+
+    def delete(self, entity):
+        clear()
@@ -1,7 +1,12 @@
 import os
 import re
+import json
+import logging
 
 from pylons import config
+from paste.deploy.converters import asbool
+
+log = logging.getLogger(__name__)
 
 _template_info_cache = {}
 
@@ -54,3 +59,110 @@ def template_info(template_name):
                   'template_type' : t_type,}
         _template_info_cache[template_name] = t_data
     return template_path, t_type
+
+
+def _template_types_path():
+    ''' returns the path of the file the template types are saved in, or
+    None if there is no cache_dir '''
+    cache_dir = config.get('cache_dir')
+    if cache_dir:
+        return os.path.join(cache_dir, 'template_types.json')
+
+
+def list_templates():
+    ''' returns a dict of the names of all the templates in the template
+    paths and the full path that find_template() finds each one at. '''
+    templates = {}
+    for template_path in config['pylons.app_globals'].template_paths:
+        for root, dirs, files in os.walk(template_path):
+            for filename in files:
+                if filename.endswith(('.py', '.pyc')):
+                    continue
+                full_path = os.path.join(root, filename)
+                name = os.path.relpath(full_path, template_path)
+                templates.setdefault(name.replace(os.sep, '/'), full_path)
+    return templates
+
+
+def _load_template_types(template_paths):
+    ''' returns the template types saved by precompile_templates(), or {}
+    if they were saved for different template paths '''
+    path = _template_types_path()
+    if not path or not os.path.exists(path):
+        return {}
+    try:
+        with open(path) as f:
+            saved = json.load(f)
+    except (IOError, ValueError), e:
+        log.warning('Could not read the template types from %s: %s', path, e)
+        return {}
+    if saved.get('template_paths') != template_paths:
+        return {}
+    return saved.get('templates', {})
+
+
+def _save_template_types(template_paths, templates):
+    path = _template_types_path()
+    if not path:
+        return
+    # write to a temporary file first so that other processes never read
+    # half of it
+    tmp_path = '%s.%i' % (path, os.getpid())
+    try:
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(tmp_path, 'w') as f:
+            json.dump({'template_paths': template_paths,
+                       'templates': templates}, f)
+        os.rename(tmp_path, path)
+    except (IOError, OSError), e:
+        log.warning('Could not save the template types to %s: %s', path, e)
+
+
+def precompile_templates():
+    ''' works out the type of every template and compiles the jinja2 ones,
+    which puts them in the jinja2 bytecode cache (if there is one) and in
+    the environment's own cache, so that the first requests for them are
+    quick.
+
+    The types are saved in cache_dir and only worked out again for the
+    templates that have changed since. Unless in debug mode they are also
+    put in the template info cache so that template_info() doesn't need to
+    look for them.
+
+    returns a list of (template name, error) for the templates that could
+    not be compiled '''
+    import jinja2
+
+    template_paths = list(config['pylons.app_globals'].template_paths)
+    saved = _load_template_types(template_paths)
+    templates = {}
+    for name, template_path in list_templates().items():
+        mtime = os.path.getmtime(template_path)
+        t_data = saved.get(name)
+        if not t_data or t_data['template_path'] != template_path \
+                or t_data['mtime'] != mtime:
+            t_data = {'template_path': template_path,
+                      'template_type': template_type(template_path),
+                      'mtime': mtime}
+        templates[name] = t_data
+    if templates != saved:
+        _save_template_types(template_paths, templates)
+
+    if not asbool(config.get('debug', False)):
+        for name, t_data in templates.items():
+            _template_info_cache[name] = {
+                'template_path': t_data['template_path'],
+                'template_type': t_data['template_type']}
+
+    env = config['pylons.app_globals'].jinja_env
+    errors = []
+    for name, t_data in sorted(templates.items()):
+        if t_data['template_type'] != 'jinja2' or \
+                not name.endswith('.html'):
+            continue
+        try:
+            env.get_template(name)
+        except jinja2.TemplateError, e:
+            errors.append((name, e))
+    return errors
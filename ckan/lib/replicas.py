@@ -0,0 +1,264 @@
+'''
+Routing of reads to replicas of the database.
+
+The side-effect-free actions (those in ckan/logic/action/get.py, and the
+ones marked with ckan.logic.side_effect_free, which are also the ones the
+action API allows GET requests for) send their queries to a read replica of
+the database, so that read traffic can be spread over as many replicas as
+needed. Everything else uses the primary database.
+
+Each process checks its replicas every ``check_interval`` seconds, and
+doesn't use a replica that can't be reached or whose replication lag is more
+than ``max_lag`` seconds. When no replica is usable the primary is used. A
+user's reads go to the primary for ``stickiness`` seconds after they write
+something, so that they see their own changes, and so do the reads of a
+request that has written something.
+
+Config settings:
+
+``ckan.db.replica_urls``
+  Space-separated SQLAlchemy URLs of the read replicas (default: none, all
+  queries use ``sqlalchemy.url``).
+
+``ckan.db.replica_max_lag``
+  The replication lag, in seconds, above which a replica isn't used
+  (default: 30).
+
+``ckan.db.replica_check_interval``
+  How often, in seconds, each process checks the health and lag of the
+  replicas (default: 10).
+
+``ckan.db.replica_stickiness``
+  How long, in seconds, a user's reads go to the primary after they write
+  (default: 60).
+
+``ckan.db.replica_stickiness_type``
+  The type of the Beaker cache that remembers which users wrote recently,
+  e.g. ``ext:memcached``, using the ``beaker.cache.*`` settings (default:
+  ``memory``). A ``memory`` cache only knows about the writes made through
+  the same process.
+
+'''
+import contextlib
+import logging
+import random
+import threading
+import time
+
+import sqlalchemy
+import sqlalchemy.exc
+from pylons import config
+
+import ckan.lib.caching as caching
+import ckan.lib.engines as engines
+import ckan.model.meta as meta
+
+log = logging.getLogger(__name__)
+
+# The replication lag, or 0 for a replica that has replayed everything it
+# received (the last replayed transaction's time doesn't change while the
+# primary is idle) or that isn't a replica at all.
+_LAG_SQL = '''
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_xlog_receive_location() =
+             pg_last_xlog_replay_location() THEN 0
+        ELSE extract(epoch FROM now() - pg_last_xact_replay_timestamp())
+    END'''
+
+_replicas = None
+_stickiness_cache = None
+_lock = threading.Lock()
+
+
+class Replica(object):
+    '''A read replica of the database, and the results of its last health
+    check.'''
+
+    def __init__(self, url):
+        url = sqlalchemy.engine.url.make_url(url)
+        extras = {}
+        if url.drivername.startswith('postgres'):
+            # don't hang a request on a replica that has gone away
+            extras = {'client_encoding': 'utf8',
+                      'connect_args': {'connect_timeout': 5}}
+        self.engine = engines.get_engine('replica', url, **extras)
+        self.name = '%s/%s' % (url.host or 'localhost', url.database)
+        self.lag = None
+        self.error = None
+        self.checked = 0
+        self.reads = 0
+        self._lock = threading.Lock()
+
+    def check(self):
+        '''Update the replica's lag, or error if it can't be reached.'''
+        try:
+            connection = self.engine.connect()
+            try:
+                lag = connection.execute(_LAG_SQL).scalar()
+            finally:
+                connection.close()
+        except sqlalchemy.exc.SQLAlchemyError, e:
+            log.warning('Read replica %s failed its check: %s',
+                        self.name, e)
+            self.lag, self.error = None, str(e)
+        else:
+            self.lag = float(lag) if lag is not None else None
+            self.error = None if lag is not None else 'lag unknown'
+
+    def is_healthy(self):
+        '''Return whether the replica can be used, checking it first if its
+        last check is older than the check interval.'''
+        now = time.time()
+        # only one request per process waits for the check
+        if now - self.checked > _check_interval() and \
+                self._lock.acquire(False):
+            try:
+                self.checked = now
+                self.check()
+            finally:
+                self._lock.release()
+        return self.lag is not None and self.lag <= _max_lag()
+
+
+def _check_interval():
+    return int(config.get('ckan.db.replica_check_interval', 10))
+
+
+def _max_lag():
+    return int(config.get('ckan.db.replica_max_lag', 30))
+
+
+def _stickiness():
+    return int(config.get('ckan.db.replica_stickiness', 60))
+
+
+def _get_replicas():
+    global _replicas
+    if _replicas is None:
+        with _lock:
+            if _replicas is None:
+                _replicas = [Replica(url) for url in
+                             config.get('ckan.db.replica_urls', '').split()]
+    return _replicas
+
+
+def _get_stickiness_cache():
+    global _stickiness_cache
+    if _stickiness_cache is None:
+        _stickiness_cache = caching.get_beaker_cache('replica_stickiness',
+                config.get('ckan.db.replica_stickiness_type', 'memory'),
+                _stickiness())
+    return _stickiness_cache
+
+
+def reset():
+    '''Forget the replicas and who wrote recently, e.g. after the config
+    has changed.'''
+    global _replicas, _stickiness_cache
+    with _lock:
+        for replica in _replicas or []:
+            replica.engine.dispose()
+            engines.forget(replica.engine)
+        if _stickiness_cache is not None:
+            _stickiness_cache.clear()
+        _replicas = None
+        _stickiness_cache = None
+
+
+def choose_replica():
+    '''Return a healthy replica, or None if there isn't one.'''
+    healthy = [replica for replica in _get_replicas() if replica.is_healthy()]
+    if not healthy:
+        return None
+    return random.choice(healthy)
+
+
+def wrote_recently(user):
+    '''Return whether `user` has written to the database in the last
+    ckan.db.replica_stickiness seconds.'''
+    if not user or not _stickiness():
+        return False
+    try:
+        _get_stickiness_cache().get_value(user)
+        return True
+    except KeyError:
+        return False
+    except Exception, e:
+        log.exception(e)
+        return True
+
+
+def mark_written(user):
+    '''Send the reads of `user` to the primary database for
+    ckan.db.replica_stickiness seconds.'''
+    if not user or not _stickiness():
+        return
+    try:
+        _get_stickiness_cache().set_value(user, time.time())
+    except Exception, e:
+        log.exception(e)
+
+
+@contextlib.contextmanager
+def route(action, context):
+    '''Send the queries made while calling `action` to a replica if it's
+    side-effect-free, or to the primary database if it isn't.
+
+    Reads stay on the primary when the session has written or has changes
+    pending, when `action` is called by one that isn't side-effect-free, and
+    when the user has written recently.'''
+    if not _get_replicas() or context.get('session') is not meta.Session:
+        yield
+        return
+    session = meta.Session()
+    user = context.get('user')
+
+    if not getattr(action, 'side_effect_free', False):
+        replica_engine = session.replica_engine
+        session.replica_engine = None
+        if session.read_replica and replica_engine is None and \
+                not session.dirty:
+            # objects read from a replica may be out of date
+            session.expire_all()
+            session.read_replica = False
+        session.writing += 1
+        try:
+            yield
+        finally:
+            session.writing -= 1
+            session.replica_engine = replica_engine
+        session.wrote = True
+        mark_written(user)
+        return
+
+    if session.replica_engine is not None or session.writing or \
+            session.wrote or session.new or session.deleted or session.dirty or \
+            wrote_recently(user):
+        yield
+        return
+    replica = choose_replica()
+    if replica is None:
+        yield
+        return
+    replica.reads += 1
+    session.replica_engine = replica.engine
+    try:
+        yield
+    finally:
+        session.replica_engine = None
+    # an action that's marked side-effect-free but wrote anyway, which the
+    # session sent to the primary
+    if session.wrote:
+        mark_written(user)
+
+
+def stats():
+    '''Return the health, lag and number of reads of each replica in this
+    process.'''
+    return [{'name': replica.name,
+             'healthy': replica.lag is not None and replica.lag <= _max_lag(),
+             'lag': replica.lag,
+             'error': replica.error,
+             'reads': replica.reads}
+            for replica in _get_replicas()]
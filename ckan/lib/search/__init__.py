@@ -9,7 +9,7 @@ import ckan.model.domain_object as domain_object
 
 from common import (SearchIndexError, SearchError, SearchQueryError,
                     make_connection, is_available, SolrSettings)
-from index import PackageSearchIndex, NoopSearchIndex
+from index import PackageSearchIndex, NoopSearchIndex, reconcile_tags
 from query import (TagSearchQuery, ResourceSearchQuery, PackageSearchQuery,
                    QueryOptions, convert_legacy_parameters_to_solr)
 
@@ -60,6 +60,8 @@ if SIMPLE_SEARCH:
     import sql as sql
     _INDICES['package'] = NoopSearchIndex
     _QUERIES['package'] = sql.PackageSearchQuery
+    _QUERIES['tag'] = sql.TagSearchQuery
+    _QUERIES['resource'] = sql.ResourceSearchQuery
 
 
 def _normalize_type(_type):
@@ -192,6 +194,8 @@ def rebuild(package_id=None, only_missing=False, force=False, refresh=False, def
                     continue
                 else:
                     raise
+        if not SIMPLE_SEARCH:
+            reconcile_tags(commit=not defer_commit)
 
     model.Session.commit()
     log.info('Finished rebuilding search index.')
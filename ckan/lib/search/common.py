@@ -1,5 +1,7 @@
 from pylons import config
 import logging
+
+import ckan.lib.timing as timing
 log = logging.getLogger(__name__)
 
 
@@ -59,12 +61,29 @@ def is_available():
     return True
 
 
+class _TimedConnection(object):
+    '''Wraps a SolrConnection so that its requests are timed.'''
+
+    _timed = frozenset(['query', 'raw_query', 'add', 'add_many', 'delete',
+                        'delete_many', 'delete_query', 'commit', 'optimize'])
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def __getattr__(self, name):
+        attr = getattr(self._conn, name)
+        if name in self._timed:
+            return timing.timed('solr', attr)
+        return attr
+
+
 def make_connection():
     from solr import SolrConnection
     solr_url, solr_user, solr_password = SolrSettings.get()
     assert solr_url is not None
     if solr_user is not None and solr_password is not None:
-        return SolrConnection(solr_url, http_user=solr_user,
+        conn = SolrConnection(solr_url, http_user=solr_user,
                               http_pass=solr_password)
     else:
-        return SolrConnection(solr_url)
+        conn = SolrConnection(solr_url)
+    return _TimedConnection(conn)
@@ -3,6 +3,7 @@ import string
 import logging
 import collections
 import json
+import hashlib
 
 import re
 
@@ -20,12 +21,21 @@ log = logging.getLogger(__name__)
 
 TYPE_FIELD = "entity_type"
 PACKAGE_TYPE = "package"
+RESOURCE_TYPE = "resource"
+TAG_TYPE = "tag"
 KEY_CHARS = string.digits + string.letters + "_-"
 SOLR_FIELDS = [TYPE_FIELD, "res_url", "text", "urls", "indexed_ts", "site_id"]
 RESERVED_FIELDS = SOLR_FIELDS + ["tags", "groups", "res_description",
                                  "res_format", "res_url"]
 RELATIONSHIP_TYPES = PackageRelationship.types
 
+# The lower-cased tag name that tag searches match against.
+TAG_NAME_FIELD = "name_ci"
+
+# Resource field values longer than this aren't indexed in full, as Solr
+# can't index very long terms in string fields.
+MAX_RESOURCE_FIELD_LENGTH = 8000
+
 # Regular expression used to strip invalid XML characters
 _illegal_xml_chars_re = re.compile(u'[\x00-\x08\x0b\x0c\x0e-\x1F\uD800-\uDFFF\uFFFE\uFFFF]')
 
@@ -38,6 +48,130 @@ def escape_xml_illegal_chars(val, replacement=''):
     return _illegal_xml_chars_re.sub(replacement, val)
 
 
+def resource_field_name(field):
+    '''Return the name of the index field that a resource field is
+    searched and sorted by.
+
+    These are string fields of the lower-cased value (see
+    resource_field_value()), so that searches can match substrings
+    ignoring case.
+
+    '''
+    return 'res_field_%s_ci' % ''.join([c for c in field if c in KEY_CHARS])
+
+
+def resource_field_value(value):
+    '''Return the value indexed for a resource field.'''
+    if isinstance(value, bool):
+        return unicode(value).lower()
+    if isinstance(value, (int, long)):
+        # Zero-pad numbers so that they sort as numbers.
+        return u'%020d' % value
+    value = escape_xml_illegal_chars(unicode(value))
+    return value[:MAX_RESOURCE_FIELD_LENGTH].lower()
+
+
+def _index_id(entity_type, entity_id):
+    '''Return the unique index_id of a document in the index.'''
+    return hashlib.md5('%s%s%s' % (entity_type, entity_id,
+                                   config.get('ckan.site_id'))).hexdigest()
+
+
+def _resource_docs(package_id, resources):
+    '''Return the index documents of a dataset's resources.'''
+    docs = []
+    for resource in resources:
+        if resource.get('state', 'active') != 'active':
+            continue
+        doc = {
+            TYPE_FIELD: RESOURCE_TYPE,
+            'index_id': _index_id(RESOURCE_TYPE, resource['id']),
+            'site_id': config.get('ckan.site_id'),
+            'id': resource['id'],
+            'package_id': package_id,
+        }
+        for field, value in resource.items():
+            if value is None or isinstance(value, (dict, list)):
+                continue
+            doc[resource_field_name(field)] = resource_field_value(value)
+        docs.append(doc)
+    return docs
+
+
+def _resources_query(package_id):
+    '''Return the query for the index documents of a dataset's resources.'''
+    return '+%s:%s +package_id:"%s" +site_id:"%s"' % (
+        TYPE_FIELD, RESOURCE_TYPE, package_id, config.get('ckan.site_id'))
+
+
+def _tag_docs(tags):
+    '''Return the index documents of a dataset's free tags.'''
+    return [{
+        TYPE_FIELD: TAG_TYPE,
+        'index_id': _index_id(TAG_TYPE, tag['id']),
+        'site_id': config.get('ckan.site_id'),
+        'id': tag['id'],
+        'name': tag['name'],
+        TAG_NAME_FIELD: tag['name'].lower(),
+    } for tag in tags if not tag.get('vocabulary_id') and tag.get('id')]
+
+
+def _facet_values(conn, q, field):
+    '''Return all the values of `field` in the documents matching `q`.'''
+    response = json.loads(conn.raw_query(q=q, rows=0, wt='json',
+                                         facet='true', **{
+                                             'facet.field': field,
+                                             'facet.limit': -1,
+                                             'facet.mincount': 1,
+                                             'json.nl': 'map'}))
+    return set(response['facet_counts']['facet_fields'][field])
+
+
+def reconcile_tags(commit=True):
+    '''Make the index's free tag documents match the datasets' tags.
+
+    Indexing a dataset adds the documents of its tags, but doesn't delete
+    the ones of the tags it no longer has, as whether another dataset has
+    them can't be known without a query, and concurrent edits could both
+    decide that the other one still has a tag. Instead this deletes, in one
+    go, the documents of the tags that no indexed dataset has, and adds any
+    that are missing. It's run at the end of a full rebuild, and by
+    ``paster search-index reconcile-tags``, e.g. from cron.
+
+    '''
+    conn = make_connection()
+    site = '+site_id:"%s"' % config.get('ckan.site_id')
+    try:
+        used = _facet_values(conn, '+%s:%s %s' % (TYPE_FIELD, PACKAGE_TYPE,
+                                                   site), 'tags')
+        indexed = _facet_values(conn, '+%s:%s %s' % (TYPE_FIELD, TAG_TYPE,
+                                                      site), 'name')
+        missing = list(used - indexed)
+        orphans = list(indexed - used)
+        for i in range(0, len(missing), 500):
+            tags = model.Session.query(model.Tag.id, model.Tag.name) \
+                .filter(model.Tag.name.in_(missing[i:i + 500])) \
+                .filter(model.Tag.vocabulary_id == None)
+            conn.add_many(_tag_docs([{'id': tag_id, 'name': name}
+                                     for tag_id, name in tags]),
+                          _commit=False)
+        for i in range(0, len(orphans), 500):
+            names = ' OR '.join(['"%s"' % name.replace('"', '\\"')
+                                 for name in orphans[i:i + 500]])
+            conn.delete_query('+%s:%s %s +name:(%s)' % (TYPE_FIELD, TAG_TYPE,
+                                                        site, names))
+        if commit and (missing or orphans):
+            conn.commit()
+    except Exception, e:
+        log.exception(e)
+        raise SearchIndexError(e)
+    finally:
+        conn.close()
+    log.debug('Reconciled the tag index: %i added, %i deleted',
+              len(missing), len(orphans))
+    return len(missing), len(orphans)
+
+
 def clear_index():
     import solr.core
     conn = make_connection()
@@ -101,6 +235,11 @@ class PackageSearchIndex(SearchIndex):
             return
         pkg_dict['data_dict'] = json.dumps(pkg_dict)
 
+        # The resources and free tags are also indexed as documents of their
+        # own.
+        resources = pkg_dict.get('resources', [])
+        tag_docs = _tag_docs(pkg_dict.get('tags', []))
+
         # add to string field for sorting
         title = pkg_dict.get('title')
         if title:
@@ -219,7 +358,6 @@ class PackageSearchIndex(SearchIndex):
                 pass
 
         # add a unique index_id to avoid conflicts
-        import hashlib
         pkg_dict['index_id'] = hashlib.md5('%s%s' % (pkg_dict['id'],config.get('ckan.site_id'))).hexdigest()
 
         for item in PluginImplementations(IPackageController):
@@ -233,7 +371,13 @@ class PackageSearchIndex(SearchIndex):
             commit = not defer_commit
             if not asbool(config.get('ckan.search.solr_commit', 'true')):
                 commit = False
-            conn.add_many([pkg_dict], _commit=commit)
+            # tags the dataset no longer has are left to reconcile_tags()
+            conn.delete_query(_resources_query(pkg_dict['id']))
+            conn.add_many([pkg_dict] +
+                          _resource_docs(pkg_dict['id'], resources) +
+                          tag_docs, _commit=False)
+            if commit:
+                conn.commit()
         except Exception, e:
             log.exception(e)
             raise SearchIndexError(e)
@@ -256,9 +400,13 @@ class PackageSearchIndex(SearchIndex):
 
     def delete_package(self, pkg_dict):
         conn = make_connection()
-        query = "+%s:%s (+id:\"%s\" OR +name:\"%s\") +site_id:\"%s\"" % (TYPE_FIELD, PACKAGE_TYPE,
-                                                       pkg_dict.get('id'), pkg_dict.get('id'),
-                                                       config.get('ckan.site_id'))
+        # the dataset's document and its resources' ones, its tags' are left
+        # to reconcile_tags()
+        query = '+site_id:"%s" +((+%s:%s +(id:"%s" OR name:"%s")) OR ' \
+            '(+%s:%s +package_id:"%s"))' % (
+                config.get('ckan.site_id'), TYPE_FIELD, PACKAGE_TYPE,
+                pkg_dict.get('id'), pkg_dict.get('id'), TYPE_FIELD,
+                RESOURCE_TYPE, pkg_dict.get('id'))
         try:
             conn.delete_query(query)
             if asbool(config.get('ckan.search.solr_commit', 'true')):
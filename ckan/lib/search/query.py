@@ -1,12 +1,14 @@
+import base64
 import re
 from pylons import config
 from solr import SolrException
 from paste.deploy.converters import asbool
 from paste.util.multidict import MultiDict
 from ckan import model
-from ckan.logic import get_action
 from ckan.lib.helpers import json
 from common import make_connection, SearchError, SearchQueryError
+from index import (TYPE_FIELD, PACKAGE_TYPE, RESOURCE_TYPE, TAG_TYPE,
+                   TAG_NAME_FIELD, resource_field_name)
 import logging
 log = logging.getLogger(__name__)
 
@@ -15,9 +17,13 @@ _open_licenses = None
 VALID_SOLR_PARAMETERS = set([
     'q', 'fl', 'fq', 'rows', 'sort', 'start', 'wt', 'qf',
     'facet', 'facet.mincount', 'facet.limit', 'facet.field',
-    'extras' # Not used by Solr, but useful for extensions
+    'extras', # Not used by Solr, but useful for extensions
+    'cursor', # Not used by Solr, see PackageSearchQuery.run()
 ])
 
+# the sorts that cursor paging works with, on fields unique to each dataset
+CURSOR_SORTS = ('id asc', 'id desc', 'name asc', 'name desc')
+
 # for (solr) package searches, this specifies the fields that are searched
 # and their relative weighting
 QUERY_FIELDS = "name^4 title^4 tags^2 groups^2 text"
@@ -157,8 +163,54 @@ class SearchQuery(object):
     __call__ = run
 
 
+def escape_wildcard_term(term):
+    '''Escape a term so that it can be used in a wildcard query.'''
+    return escape_legacy_argument(term).replace(' ', '\\ ')
+
+
+def _run_entity_query(q, fq, sort, fl, offset=None, limit=None):
+    '''Run a query for tag or resource documents.
+
+    :returns: a tuple of the number of documents found and the list of the
+        returned documents, all of them if `limit` is None
+
+    '''
+    query = {'q': q, 'fq': fq, 'sort': sort, 'fl': fl, 'wt': 'json',
+             'start': int(offset or 0)}
+    conn = make_connection()
+    try:
+        if limit is None:
+            query['rows'] = 0
+            data = json.loads(conn.raw_query(**query))
+            limit = data['response']['numFound']
+        query['rows'] = int(limit)
+        log.debug('Entity query: %r' % query)
+        data = json.loads(conn.raw_query(**query))
+    except SolrException, e:
+        raise SearchError('SOLR returned an error running query: %r Error: %r' %
+                          (query, e.reason))
+    finally:
+        conn.close()
+    return data['response']['numFound'], data['response']['docs']
+
+
+def _objects_by_id(domain_class, ids):
+    '''Return the domain objects with the given ids, in the same order.'''
+    if not ids:
+        return []
+    objects = dict((obj.id, obj) for obj in model.Session.query(domain_class)
+                   .filter(domain_class.id.in_(ids)))
+    return [objects[id] for id in ids if id in objects]
+
+
 class TagSearchQuery(SearchQuery):
-    """Search for tags."""
+    """Search for free tags in the search index.
+
+    A tag matches if each of the query terms is a substring of its name,
+    ignoring case. Only tags that are applied to at least one active dataset
+    are indexed, as of the last reconcile_tags(), see
+    ckan.lib.search.index.
+    """
     def run(self, query=None, fields=None, options=None, **kwargs):
         query = [] if query is None else query
         fields = {} if fields is None else fields
@@ -175,70 +227,120 @@ class TagSearchQuery(SearchQuery):
         for field, value in fields.items():
             if field in ('tag', 'tags'):
                 query.append(value)
+        terms = [term.strip() for term in query if term.strip()]
 
-        context = {'model': model, 'session': model.Session}
-        data_dict = {
-            'query': query,
-            'offset': options.get('offset'),
-            'limit': options.get('limit')
-        }
-        results = get_action('tag_search')(context, data_dict)
-
-        if not options.return_objects:
-            # if options.all_fields is set, return a dict
-            # if not, return a list of resource IDs
-            if options.all_fields:
-                results['results'] = [r.as_dict() for r in results['results']]
-            else:
-                results['results'] = [r['name'] for r in results['results']]
-
-        self.count = results['count']
-        self.results = results['results']
-        return results
+        if not terms:
+            self.count, docs = 0, []
+        else:
+            q = ' AND '.join(['%s:*%s*' % (TAG_NAME_FIELD,
+                                           escape_wildcard_term(term.lower()))
+                              for term in terms])
+            fq = '+%s:%s +site_id:"%s"' % (TYPE_FIELD, TAG_TYPE,
+                                           config.get('ckan.site_id'))
+            self.count, docs = _run_entity_query(q, fq, 'name asc', 'id,name',
+                options.get('offset'), options.get('limit'))
+
+        if options.return_objects:
+            self.results = _objects_by_id(model.Tag, [d['id'] for d in docs])
+        elif options.all_fields:
+            self.results = [tag.as_dict() for tag in _objects_by_id(
+                model.Tag, [d['id'] for d in docs])]
+        else:
+            self.results = [d['name'] for d in docs]
+        return {'results': self.results, 'count': self.count}
 
 
 class ResourceSearchQuery(SearchQuery):
-    """Search for resources."""
+    """Search for resources in the search index.
+
+    `fields` maps resource fields to search terms, see the resource_search
+    action for how they are matched. Only the resources of active datasets
+    are indexed, see ckan.lib.search.index.
+    """
     def run(self, fields={}, options=None, **kwargs):
         if options is None:
             options = QueryOptions(**kwargs)
         else:
             options.update(kwargs)
 
-        context = {
-            'model':model,
-            'session': model.Session,
-            'search_query': True,
-        }
-
-        # Transform fields into structure required by the resource_search
-        # action.
-        query = []
+        resource_fields = model.Resource.get_columns()
+        clauses = []
         for field, terms in fields.items():
+            if field not in resource_fields:
+                raise SearchQueryError(
+                    'Field "%s" not recognised in resource_search.' % field)
             if isinstance(terms, basestring):
                 terms = terms.split()
+            index_field = resource_field_name(field)
             for term in terms:
-                query.append(':'.join([field, term]))
-
-        data_dict = {
-            'query': query,
-            'offset': options.get('offset'),
-            'limit': options.get('limit'),
-            'order_by': options.get('order_by')
-        }
-        results = get_action('resource_search')(context, data_dict)
-
-        if not options.return_objects:
-            # if options.all_fields is set, return a dict
-            # if not, return a list of resource IDs
-            if options.all_fields:
-                results['results'] = [r.as_dict() for r in results['results']]
-            else:
-                results['results'] = [r.id for r in results['results']]
+                term = escape_wildcard_term(term.lower())
+                if not term:
+                    clauses.append('%s:[* TO *]' % index_field)
+                elif field == 'hash':
+                    # the hash is matched as a prefix
+                    clauses.append('%s:%s*' % (index_field, term))
+                else:
+                    clauses.append('%s:*%s*' % (index_field, term))
+
+        order_by = options.get('order_by')
+        if order_by in resource_fields:
+            sort = '%s asc, id asc' % resource_field_name(order_by)
+        else:
+            sort = 'id asc'
+
+        fq = '+%s:%s +site_id:"%s"' % (TYPE_FIELD, RESOURCE_TYPE,
+                                       config.get('ckan.site_id'))
+        self.count, docs = _run_entity_query(' AND '.join(clauses) or '*:*',
+            fq, sort, 'id', options.get('offset'), options.get('limit'))
+
+        ids = [d['id'] for d in docs]
+        if options.return_objects:
+            self.results = _objects_by_id(model.Resource, ids)
+        elif options.all_fields:
+            self.results = [resource.as_dict() for resource in
+                            _objects_by_id(model.Resource, ids)]
+        else:
+            self.results = ids
+        return {'results': self.results, 'count': self.count}
+
 
-        self.count = results['count']
-        self.results = results['results']
-        return results
+def _cursor_sort_and_filter(cursor, sort):
+    '''Return the sort of a page of a cursor search, and the filter query
+    that leaves out the results before `cursor` (None for the first page).'''
+    if sort in (None, 'rank'):
+        sort = None
+    else:
+        sort = ' '.join(sort.split())
+    if cursor == '*':
+        sort = sort or CURSOR_SORTS[0]
+        if sort not in CURSOR_SORTS:
+            raise SearchQueryError('A cursor only works with a sort of: %s'
+                                   % ', '.join(CURSOR_SORTS))
+        return sort, None
+
+    try:
+        cursor_sort, last = json.loads(base64.urlsafe_b64decode(str(cursor)))
+    except (TypeError, ValueError, UnicodeEncodeError):
+        raise SearchQueryError('Invalid cursor: %r' % cursor)
+    if cursor_sort not in CURSOR_SORTS or sort not in (None, cursor_sort) \
+            or not isinstance(last, basestring):
+        raise SearchQueryError('Invalid cursor for sort %r: %r'
+                               % (sort, cursor))
+    field, direction = cursor_sort.split()
+    last = '"%s"' % last.replace('\\', '\\\\').replace('"', '\\"')
+    if direction == 'asc':
+        return cursor_sort, '+%s:{%s TO *}' % (field, last)
+    return cursor_sort, '+%s:{* TO %s}' % (field, last)
+
+
+def _encode_cursor(sort, last):
+    return base64.urlsafe_b64encode(json.dumps([sort, last]))
+
+
+def _has_extras(fl):
+    '''Return whether the field list `fl` can return any extras_* fields.'''
+    return any(field == '*' or field.startswith('extras_')
+               for field in re.split(r'[\s,]+', fl))
 
 
 class PackageSearchQuery(SearchQuery):
@@ -249,6 +351,7 @@ class PackageSearchQuery(SearchQuery):
         query = "*:*"
         fq = "+site_id:\"%s\" " % config.get('ckan.site_id')
         fq += "+state:active "
+        fq += "+%s:%s " % (TYPE_FIELD, PACKAGE_TYPE)
 
         conn = make_connection()
         try:
@@ -263,7 +366,8 @@ class PackageSearchQuery(SearchQuery):
             'rows': 1,
             'q': 'name:%s OR id:%s' % (reference,reference),
             'wt': 'json',
-            'fq': 'site_id:"%s"' % config.get('ckan.site_id')}
+            'fq': '+site_id:"%s" +%s:%s' % (config.get('ckan.site_id'),
+                                            TYPE_FIELD, PACKAGE_TYPE)}
 
         conn = make_connection()
         log.debug('Package query: %r' % query)
@@ -293,6 +397,13 @@ class PackageSearchQuery(SearchQuery):
         @param query - dictionary with keys like: q, fq, sort, rows, facet
         @return - dictionary with keys results and count
 
+        If query has a cursor, '*' for the first page, the results are paged
+        by filtering out the ones before it rather than with start, which
+        Solr makes slower the further it is. The sort must be one of
+        CURSOR_SORTS (default: 'id asc'), count is the number of results
+        from the cursor on, and next_cursor is returned for the next page,
+        or None after the last one.
+
         May raise SearchQueryError or SearchError.
         '''
         assert isinstance(query, (dict, MultiDict))
@@ -306,9 +417,21 @@ class PackageSearchQuery(SearchQuery):
         if not q or q == '""' or q == "''":
             query['q'] = "*:*"
 
+        # cursor paging
+        cursor = query.pop('cursor', None)
+        if cursor is not None:
+            if int(query.get('start', 0)):
+                raise SearchQueryError('start can not be used with a cursor')
+            query['sort'], after_cursor = _cursor_sort_and_filter(
+                cursor, query.get('sort'))
+            if after_cursor:
+                query['fq'] = query.get('fq', '') + ' ' + after_cursor
+        self.next_cursor = None
+
         # number of results
         rows_to_return = min(1000, int(query.get('rows', 10)))
-        if rows_to_return > 0:
+        if rows_to_return > 0 and asbool(
+                config.get('search.extra_row_workaround', True)):
             # #1683 Work around problem of last result being out of order
             #       in SOLR 1.4
             rows_to_query = rows_to_return + 1
@@ -329,6 +452,10 @@ class PackageSearchQuery(SearchQuery):
         # filter for package status
         if not '+state:' in fq:
             fq += " +state:active"
+
+        # only return datasets, not the other types of documents
+        if not '+%s:' % TYPE_FIELD in fq:
+            fq += ' +%s:%s' % (TYPE_FIELD, PACKAGE_TYPE)
         query['fq'] = fq
 
         # faceting
@@ -337,10 +464,19 @@ class PackageSearchQuery(SearchQuery):
         query['facet.mincount'] = query.get('facet.mincount', 1)
 
         # return the package ID and search scores
-        query['fl'] = query.get('fl', 'name')
-
-        # return results as json encoded string
+        query['fl'] = fl = query.get('fl', 'name')
+        if cursor is not None:
+            # the next cursor is the sort field's value in the last result
+            cursor_field = query['sort'].split()[0]
+            fields = re.split(r'[\s,]+', fl)
+            if cursor_field not in fields and '*' not in fields:
+                query['fl'] = '%s %s' % (fl, cursor_field)
+
+        # return results as json encoded string, with the facet counts as
+        # maps of value to count and without the response header
         query['wt'] = query.get('wt', 'json')
+        query['json.nl'] = 'map'
+        query['omitHeader'] = 'true'
 
         # If the query has a colon in it then consider it a fielded search and do use dismax.
         if ':' not in query['q']:
@@ -367,28 +503,33 @@ class PackageSearchQuery(SearchQuery):
             # #1683 Filter out the last row that is sometimes out of order
             self.results = self.results[:rows_to_return]
 
-            # get any extras and add to 'extras' dict
-            for result in self.results:
-                extra_keys = filter(lambda x: x.startswith('extras_'), result.keys())
-                extras = {}
-                for extra_key in extra_keys:
-                    value = result.pop(extra_key)
-                    extras[extra_key[len('extras_'):]] = value
-                if extra_keys:
-                    result['extras'] = extras
+            # the results after this page are counted in numFound
+            if cursor is not None and 0 < rows_to_return < self.count:
+                self.next_cursor = _encode_cursor(
+                    query['sort'], self.results[-1][cursor_field])
 
             # if just fetching the id or name, return a list instead of a dict
-            if query.get('fl') in ['id', 'name']:
-                self.results = [r.get(query.get('fl')) for r in self.results]
-
-            # get facets and convert facets list to a dict
+            if fl in ['id', 'name']:
+                self.results = [r.get(fl) for r in self.results]
+            elif _has_extras(fl):
+                # get any extras and add to 'extras' dict
+                for result in self.results:
+                    extras = None
+                    for key in result.keys():
+                        if key.startswith('extras_'):
+                            if extras is None:
+                                extras = result['extras'] = {}
+                            extras[key[len('extras_'):]] = result.pop(key)
+
+            # the facets are dicts of value to count, thanks to json.nl=map
             self.facets = data.get('facet_counts', {}).get('facet_fields', {})
-            for field, values in self.facets.iteritems():
-                self.facets[field] = dict(zip(values[0::2], values[1::2]))
         except Exception, e:
             log.exception(e)
             raise SearchError(e)
         finally:
             conn.close()
 
+        if cursor is not None:
+            return {'results': self.results, 'count': self.count,
+                    'next_cursor': self.next_cursor}
         return {'results': self.results, 'count': self.count}
@@ -1,7 +1,92 @@
 from sqlalchemy import or_
-from ckan.lib.search.query import SearchQuery
+from ckan.lib.search.query import SearchQuery, QueryOptions
+from ckan.logic import get_action
 import ckan.model as model
 
+class TagSearchQuery(SearchQuery):
+    """Search for tags in the database."""
+    def run(self, query=None, fields=None, options=None, **kwargs):
+        query = [] if query is None else query
+        fields = {} if fields is None else fields
+
+        if options is None:
+            options = QueryOptions(**kwargs)
+        else:
+            options.update(kwargs)
+
+        if isinstance(query, basestring):
+            query = [query]
+
+        query = query[:] # don't alter caller's query list.
+        for field, value in fields.items():
+            if field in ('tag', 'tags'):
+                query.append(value)
+
+        context = {'model': model, 'session': model.Session}
+        data_dict = {
+            'query': query,
+            'offset': options.get('offset'),
+            'limit': options.get('limit')
+        }
+        results = get_action('tag_search')(context, data_dict)
+
+        if not options.return_objects:
+            # if options.all_fields is set, return a dict
+            # if not, return a list of resource IDs
+            if options.all_fields:
+                results['results'] = [r.as_dict() for r in results['results']]
+            else:
+                results['results'] = [r['name'] for r in results['results']]
+
+        self.count = results['count']
+        self.results = results['results']
+        return results
+
+
+class ResourceSearchQuery(SearchQuery):
+    """Search for resources in the database."""
+    def run(self, fields={}, options=None, **kwargs):
+        if options is None:
+            options = QueryOptions(**kwargs)
+        else:
+            options.update(kwargs)
+
+        context = {
+            'model':model,
+            'session': model.Session,
+            'search_query': True,
+        }
+
+        # Transform fields into structure required by the resource_search
+        # action.
+        query = []
+        for field, terms in fields.items():
+            if isinstance(terms, basestring):
+                terms = terms.split()
+            for term in terms:
+                query.append(':'.join([field, term]))
+
+        data_dict = {
+            'query': query,
+            'offset': options.get('offset'),
+            'limit': options.get('limit'),
+            'order_by': options.get('order_by')
+        }
+        results = get_action('resource_search')(context, data_dict)
+
+        if not options.return_objects:
+            # if options.all_fields is set, return a dict
+            # if not, return a list of resource IDs
+            if options.all_fields:
+                results['results'] = [r.as_dict() for r in results['results']]
+            else:
+                results['results'] = [r.id for r in results['results']]
+
+        self.count = results['count']
+        self.results = results['results']
+        return results
+
+
 class PackageSearchQuery(SearchQuery):
     def get_all_entity_ids(self, max_results=100):
         """
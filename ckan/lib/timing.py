@@ -0,0 +1,179 @@
+'''
+Per-request timers and counters.
+
+When ``ckan.timing.enabled`` is true, TimingMiddleware starts a
+RequestTimings for each request. While it runs, the time taken by and the
+number of SQL statements, Solr requests, template renders, action functions
+and authorization checks are added to it. The RequestTimings is put in the
+request's environ as ``ckan.timings`` and, at the end of the request:
+
+* with ``debug`` on, it's sent in the ``X-CKAN-Timing`` response header,
+  e.g. ``total=212.3ms; sql=14/35.1ms; solr=1/8.4ms; render=3/120.2ms``
+* a ``ckan.timing.log_sample_rate`` fraction of requests (default: 0) are
+  logged at INFO level
+* if ``ckan.timing.statsd_host`` is set, the timers are sent to that statsd
+  server (``ckan.timing.statsd_port``, default 8125) with the prefix
+  ``ckan.timing.statsd_prefix`` (default ``ckan``)
+
+Nested timers of the same kind (e.g. package_show called by package_update)
+are counted but only the outermost one is timed, so the times don't add up to
+more than the request took. Outside of a request, e.g. in paster commands,
+timers do nothing.
+
+'''
+import functools
+import logging
+import socket
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+_local = threading.local()
+
+# The order of the timers in the header and log messages.
+TIMERS = ('sql', 'solr', 'render', 'action', 'auth')
+
+
+class RequestTimings(object):
+    '''The timers and counters of one request.'''
+
+    def __init__(self):
+        self.start = time.time()
+        self.end = None
+        # name -> [count, seconds]
+        self.timers = {}
+        self._depth = {}
+
+    def enter(self, name):
+        '''Count a `name` call, and return whether it's the outermost one.'''
+        timer = self.timers.setdefault(name, [0, 0.0])
+        timer[0] += 1
+        depth = self._depth.get(name, 0)
+        self._depth[name] = depth + 1
+        return depth == 0
+
+    def exit(self, name, seconds):
+        '''Add `seconds` to `name` if it's the outermost call.'''
+        self._depth[name] -= 1
+        if not self._depth[name]:
+            self.timers[name][1] += seconds
+
+    def add(self, name, seconds):
+        '''Add one call that took `seconds` to `name`.'''
+        timer = self.timers.setdefault(name, [0, 0.0])
+        timer[0] += 1
+        timer[1] += seconds
+
+    @property
+    def total(self):
+        return (self.end or time.time()) - self.start
+
+    def _names(self):
+        return [name for name in TIMERS if name in self.timers] + \
+            sorted(name for name in self.timers if name not in TIMERS)
+
+    def header(self):
+        '''Return the timers formatted for the X-CKAN-Timing header.'''
+        parts = ['total=%.1fms' % (self.total * 1000)]
+        for name in self._names():
+            count, seconds = self.timers[name]
+            parts.append('%s=%i/%.1fms' % (name, count, seconds * 1000))
+        return '; '.join(parts)
+
+    def as_dict(self):
+        '''Return the timers as a dict of name to (count, milliseconds).'''
+        timers = dict((name, (count, seconds * 1000))
+                      for name, (count, seconds) in self.timers.items())
+        timers['total'] = (1, self.total * 1000)
+        return timers
+
+
+def start():
+    '''Start timing a request in this thread, and return its
+    RequestTimings.'''
+    _local.timings = RequestTimings()
+    return _local.timings
+
+
+def stop():
+    '''Stop timing the request in this thread, and return its
+    RequestTimings.'''
+    timings = current()
+    _local.timings = None
+    if timings is not None:
+        timings.end = time.time()
+    return timings
+
+
+def current():
+    '''Return the RequestTimings of the request in this thread, or None.'''
+    return getattr(_local, 'timings', None)
+
+
+class timer(object):
+    '''Context manager that times its block as a call to `name`.'''
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.timings = current()
+        if self.timings is not None:
+            self.timings.enter(self.name)
+            self.start = time.time()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.timings is not None:
+            self.timings.exit(self.name, time.time() - self.start)
+
+
+def timed(name, func):
+    '''Return `func` wrapped so that its calls are timed as `name`.'''
+    @functools.wraps(func)
+    def wrapped(*args, **kwargs):
+        with timer(name):
+            return func(*args, **kwargs)
+    return wrapped
+
+
+def instrument_engine(engine):
+    '''Time the SQL statements run by a SQLAlchemy engine.'''
+    import sqlalchemy.event
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context,
+                              executemany):
+        timings = current()
+        if timings is not None:
+            timings._sql_start = time.time()
+
+    def after_cursor_execute(conn, cursor, statement, parameters, context,
+                             executemany):
+        timings = current()
+        if timings is not None and hasattr(timings, '_sql_start'):
+            timings.add('sql', time.time() - timings._sql_start)
+
+    sqlalchemy.event.listen(engine, 'before_cursor_execute',
+                            before_cursor_execute)
+    sqlalchemy.event.listen(engine, 'after_cursor_execute',
+                            after_cursor_execute)
+
+
+class StatsdSink(object):
+    '''Sends the timers of requests to a statsd server over UDP.'''
+
+    def __init__(self, host, port=8125, prefix='ckan'):
+        self.address = (host, int(port))
+        self.prefix = prefix
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def send(self, timings):
+        lines = []
+        for name, (count, milliseconds) in timings.as_dict().items():
+            lines.append('%s.%s:%i|ms' % (self.prefix, name, milliseconds))
+            if name != 'total':
+                lines.append('%s.%s.count:%i|c' % (self.prefix, name, count))
+        try:
+            self.socket.sendto('\n'.join(lines), self.address)
+        except socket.error, e:
+            log.debug('Could not send timings to statsd: %s', e)
@@ -6,6 +6,9 @@ import re
 from pylons.i18n import _
 
 import ckan.lib.base as base
+import ckan.lib.engines as engines
+import ckan.lib.replicas as replicas
+import ckan.lib.timing as timing
 import ckan.model as model
 from ckan.new_authz import is_authorized
 from ckan.lib.navl.dictization_functions import flatten_dict, DataError
@@ -320,7 +323,10 @@ def get_action(action):
                 except TypeError:
                     # c not registered
                     pass
-                return _action(context, data_dict, **kw)
+                with timing.timer('action'):
+                    with replicas.route(_action, context):
+                        with engines.statement_timeout(_action, context):
+                            return _action(context, data_dict, **kw)
             return wrapped
 
         fn = make_wrapped(_action, action_name)
@@ -7,6 +7,7 @@ from pylons import config
 from pylons.i18n import _
 from pylons import c
 import sqlalchemy
+import paste.deploy.converters
 
 import ckan.lib.dictization
 import ckan.logic as logic
@@ -18,6 +19,12 @@ import ckan.plugins as plugins
 import ckan.lib.search as search
 import ckan.lib.plugins as lib_plugins
 import ckan.lib.activity_streams as activity_streams
+import ckan.lib.helpers
+import ckan.lib.package_cache as package_cache
+import ckan.lib.fragment_cache as fragment_cache
+import ckan.lib.api_metrics as api_metrics
+import ckan.lib.engines as engines
+import ckan.lib.replicas as replicas
 import ckan.new_authz as new_authz
 
 log = logging.getLogger('ckan.logic')
@@ -41,14 +48,6 @@ _desc = sqlalchemy.desc
 _case = sqlalchemy.case
 _text = sqlalchemy.text
 
-def _package_list_with_resources(context, package_revision_list):
-    package_list = []
-    model = context["model"]
-    for package in package_revision_list:
-        result_dict = model_dictize.package_dictize(package,context)
-        package_list.append(result_dict)
-    return package_list
-
 
 def site_read(context,data_dict=None):
     '''Return ``True``.
@@ -62,6 +61,21 @@ def site_read(context,data_dict=None):
 def package_list(context, data_dict):
     '''Return a list of the names of the site's datasets (packages).
 
+    Only the dataset names (or ids, in version 2 of the API) are read from the
+    database, not whole datasets, so this is fast even for large sites.
+
+    :param limit: if given, the list of datasets will be broken into pages of
+        at most ``limit`` datasets per page and only one page will be returned
+        at a time (optional)
+    :type limit: int
+    :param offset: when ``limit`` is given, the offset to start returning
+        datasets from (optional, default: 0)
+    :type offset: int
+    :param since: only return the datasets that have been modified (their
+        ``metadata_modified``) since this date and time, in ISO format, e.g.
+        ``2013-02-25T14:05:00`` (optional)
+    :type since: string
+
     :rtype: list of strings
 
     '''
@@ -69,14 +83,45 @@ def package_list(context, data_dict):
     api = context.get("api_version", 1)
     ref_package_by = 'id' if api == 2 else 'name'
 
-    _check_access('package_list', context, data_dict)
+    limit = _get_int_param(data_dict, 'limit')
+    offset = _get_int_param(data_dict, 'offset')
+    since = data_dict.get('since')
+    if since:
+        try:
+            since = ckan.lib.helpers.date_str_to_datetime(since)
+        except (ValueError, TypeError):
+            raise logic.ParameterError("'since' should be an ISO date")
 
-    query = model.Session.query(model.PackageRevision)
-    query = query.filter(model.PackageRevision.state=='active')
-    query = query.filter(model.PackageRevision.current==True)
+    _check_access('package_list', context, data_dict)
 
-    packages = query.all()
-    return [getattr(p, ref_package_by) for p in packages]
+    package_revision_table = model.package_revision_table
+    col = getattr(package_revision_table.c, ref_package_by)
+    query = _select([col])
+    query = query.where(package_revision_table.c.state == 'active')
+    query = query.where(package_revision_table.c.current == True)
+    if since:
+        query = query.where(
+            package_revision_table.c.metadata_modified > since)
+
+    if limit is not None or offset:
+        # Paging needs a stable order.
+        query = query.order_by(col)
+        if limit is not None:
+            query = query.limit(limit)
+        if offset:
+            query = query.offset(offset)
+
+    return [row[0] for row in model.Session.execute(query)]
+
+def _get_int_param(data_dict, key):
+    '''Return the value of an optional non-negative int parameter, or None.'''
+    if not data_dict.has_key(key):
+        return None
+    try:
+        value = int(data_dict[key])
+    except (ValueError, TypeError):
+        raise logic.ParameterError("'%s' should be an int" % key)
+    return max(value, 0)
 
 def current_package_list_with_resources(context, data_dict):
     '''Return a list of the site's datasets (packages) and their resources.
@@ -94,29 +139,24 @@ def current_package_list_with_resources(context, data_dict):
 
     '''
     model = context["model"]
-    if data_dict.has_key('limit'):
-        try:
-            limit = int(data_dict['limit'])
-            if limit < 0:
-                limit = 0
-        except ValueError, e:
-            raise logic.ParameterError("'limit' should be an int")
-    else:
-        limit = None
+    limit = _get_int_param(data_dict, 'limit')
     page = int(data_dict.get('page', 1))
 
     _check_access('current_package_list_with_resources', context, data_dict)
 
-    query = model.Session.query(model.PackageRevision)
-    query = query.filter(model.PackageRevision.state=='active')
-    query = query.filter(model.PackageRevision.current==True)
+    package_revision_table = model.package_revision_table
+    query = _select([package_revision_table])
+    query = query.where(package_revision_table.c.state == 'active')
+    query = query.where(package_revision_table.c.current == True)
 
-    query = query.order_by(model.package_revision_table.c.revision_timestamp.desc())
+    query = query.order_by(package_revision_table.c.metadata_modified.desc())
     if limit is not None:
         query = query.limit(limit)
         query = query.offset((page-1)*limit)
-    pack_rev = query.all()
-    return _package_list_with_resources(context, pack_rev)
+    pack_rev = model.Session.execute(query).fetchall()
+    # The whole page is dictized with a fixed number of queries, rather than
+    # with package_dictize()'s ten or so queries per dataset.
+    return model_dictize.package_list_dictize(pack_rev, context)
 
 def revision_list(context, data_dict):
     '''Return a list of the IDs of the site's revisions.
@@ -716,7 +756,8 @@ def package_show(context, data_dict):
 
     _check_access('package_show', context, data_dict)
 
-    package_dict = model_dictize.package_dictize(pkg, context)
+    package_dict = package_cache.get_package_dict(pkg, context,
+                                                  model_dictize.package_dictize)
 
     for item in plugins.PluginImplementations(plugins.IPackageController):
         item.read(pkg)
@@ -824,7 +865,17 @@ def _group_or_org_show(context, data_dict, is_org=False):
         _check_access('organization_show',context, data_dict)
     else:
         _check_access('group_show',context, data_dict)
-    
+
+    packages_limit = _get_int_param(data_dict, 'packages_limit')
+    packages_offset = _get_int_param(data_dict, 'packages_offset')
+    if packages_limit is not None:
+        context['limits'] = dict(context.get('limits', {}),
+                                 packages=packages_limit)
+    if packages_offset:
+        context['offsets'] = dict(context.get('offsets', {}),
+                                  packages=packages_offset)
+    context['include_users'] = paste.deploy.converters.asbool(
+        data_dict.get('include_users', True))
 
     group_dict = model_dictize.group_dictize(group, context)
 
@@ -859,6 +910,17 @@ def group_show(context, data_dict):
 
     :param id: the id or name of the group
     :type id: string
+    :param packages_limit: the maximum number of the group's datasets to
+        return in ``packages`` (optional, default: all of them); the total
+        number of public datasets is always given in ``package_count``
+    :type packages_limit: int
+    :param packages_offset: when ``packages_limit`` is given, the offset to
+        start returning datasets from, the datasets are sorted by name
+        (optional)
+    :type packages_offset: int
+    :param include_users: whether to include the group's ``users``
+        (optional, default: ``True``), leave them out of large groups
+    :type include_users: boolean
 
     :rtype: dictionary
 
@@ -870,6 +932,17 @@ def organization_show(context, data_dict):
 
     :param id: the id or name of the organization
     :type id: string
+    :param packages_limit: the maximum number of the organization's datasets
+        to return in ``packages`` (optional, default: all of them); the total
+        number of public datasets is always given in ``package_count``
+    :type packages_limit: int
+    :param packages_offset: when ``packages_limit`` is given, the offset to
+        start returning datasets from, the datasets are sorted by name
+        (optional)
+    :type packages_offset: int
+    :param include_users: whether to include the organization's ``users``
+        (optional, default: ``True``), leave them out of large organizations
+    :type include_users: boolean
 
     :rtype: dictionary
 
@@ -1168,6 +1241,13 @@ def package_search(context, data_dict):
     :param start: the offset in the complete result for where the set of
         returned datasets should begin.
     :type start: int
+    :param cursor: page through the results with cursors rather than with
+        ``start``, which gets slower the further into the results it is.
+        Give ``"*"`` for the first page and the ``next_cursor`` of the
+        results for the pages after it. The sort must be one of
+        ``"id asc"`` (the default), ``"id desc"``, ``"name asc"`` or
+        ``"name desc"``.  Optional.
+    :type cursor: string
     :param qf: the dismax query fields to search within, including boosts.  See
         the `Solr Dismax Documentation
         <http://wiki.apache.org/solr/DisMaxQParserPlugin#qf_.28Query_Fields.29>`_
@@ -1194,6 +1274,10 @@ def package_search(context, data_dict):
         of results found, not the total number of results returned (which is
         affected by limit and row parameters used in the input).
     :type count: int
+    :param next_cursor: only with a ``cursor``, the cursor of the next page of
+        results, or ``None`` if this is the last one.  With a cursor,
+        ``count`` is the number of results from this page on.
+    :type next_cursor: string
     :param results: ordered list of datasets matching the query, where the
         ordering defined by the sort parameter used in the query.
     :type results: list of dictized datasets.
@@ -1245,6 +1329,8 @@ def package_search(context, data_dict):
     abort = data_dict.get('abort_search',False)
 
     results = []
+    cursor = data_dict.get('cursor')
+    next_cursor = None
     if not abort:
         # return a list of package ids
         data_dict['fl'] = 'id data_dict'
@@ -1291,6 +1377,7 @@ def package_search(context, data_dict):
 
         count = query.count
         facets = query.facets
+        next_cursor = query.next_cursor
     else:
         count = 0
         facets = {}
@@ -1301,6 +1388,8 @@ def package_search(context, data_dict):
         'facets': facets,
         'results': results
     }
+    if cursor is not None:
+        search_results['next_cursor'] = next_cursor
 
     # Transform facets into a more useful data structure.
     restructured_facets = {}
@@ -1337,6 +1426,58 @@ def package_search(context, data_dict):
 
     return search_results
 
+def _resource_search_sql(model, fields, order_by, offset, limit):
+    '''Search for resources in the database, for when there is no search
+    index (``ckan.simple_search``).
+
+    :returns: a tuple of the list of matching resources and their number
+
+    '''
+    q = model.Session.query(model.Resource)
+    for field, terms in fields.items():
+        for term in terms:
+
+            # prevent pattern injection
+            term = misc.escape_sql_like_special_characters(term)
+
+            model_attr = getattr(model.Resource, field)
+
+            # Treat the has field separately, see docstring.
+            if field == 'hash':
+                q = q.filter(model_attr.ilike(unicode(term) + '%'))
+
+            # Resource extras are stored in a json blob.  So searching for
+            # matching fields is a bit trickier.  See the docstring.
+            elif field in model.Resource.get_extra_columns():
+                model_attr = getattr(model.Resource, 'extras')
+
+                like = _or_(
+                    model_attr.ilike(u'''%%"%s": "%%%s%%",%%''' % (field, term)),
+                    model_attr.ilike(u'''%%"%s": "%%%s%%"}''' % (field, term))
+                )
+                q = q.filter(like)
+
+            # Just a regular field
+            else:
+                q = q.filter(model_attr.ilike('%' + unicode(term) + '%'))
+
+    if order_by is not None:
+        if hasattr(model.Resource, order_by):
+            q = q.order_by(getattr(model.Resource, order_by))
+
+    count = q.count()
+    q = q.offset(offset)
+    q = q.limit(limit)
+
+    results = []
+    for result in q:
+        if isinstance(result, tuple) and isinstance(result[0], model.DomainObject):
+            # This is the case for order_by rank due to the add_column.
+            results.append(result[0])
+        else:
+            results.append(result)
+    return results, count
+
 def resource_search(context, data_dict):
     '''
     Searches for resources satisfying a given search criteria.
@@ -1360,9 +1501,12 @@ def resource_search(context, data_dict):
     Note: The search is limited to search against extra fields declared in
     the config setting ``ckan.extra_resource_fields``.
 
-    Note: Due to a Resource's extra fields being stored as a json blob, the
-    match is made against the json string representation.  As such, false
-    positives may occur:
+    Resources are searched in the search index, where each of their fields
+    and extra fields is indexed separately, and only the active resources of
+    active datasets are found.  When ``ckan.simple_search`` is on they are
+    searched in the database instead, where a Resource's extra fields are
+    stored as a json blob and the match is made against the json string
+    representation.  As such, false positives may occur:
 
     If the search criteria is: ::
 
@@ -1372,8 +1516,7 @@ def resource_search(context, data_dict):
 
         {"field1": "foo", "field2": "term1"}
 
-    will match the search criteria!  This is a known short-coming of this
-    approach.
+    will match the search criteria!
 
     All matches are made ignoring case; and apart from the ``"hash"`` field,
     a term matches if it is a substring of the field's value.
@@ -1452,12 +1595,11 @@ def resource_search(context, data_dict):
     limit = data_dict.get('limit')
 
     # TODO: should we check for user authentication first?
-    q = model.Session.query(model.Resource)
     resource_fields = model.Resource.get_columns()
     for field, terms in fields.items():
 
         if isinstance(terms, basestring):
-            terms = [terms]
+            fields[field] = [terms]
 
         if field not in resource_fields:
             msg = _('Field "{field}" not recognised in resource_search.')\
@@ -1471,47 +1613,15 @@ def resource_search(context, data_dict):
             # and need to provide meaningful external error messages.
             raise ValidationError({'query': msg})
 
-        for term in terms:
-
-            # prevent pattern injection
-            term = misc.escape_sql_like_special_characters(term)
-
-            model_attr = getattr(model.Resource, field)
-
-            # Treat the has field separately, see docstring.
-            if field == 'hash':
-                q = q.filter(model_attr.ilike(unicode(term) + '%'))
-
-            # Resource extras are stored in a json blob.  So searching for
-            # matching fields is a bit trickier.  See the docstring.
-            elif field in model.Resource.get_extra_columns():
-                model_attr = getattr(model.Resource, 'extras')
-
-                like = _or_(
-                    model_attr.ilike(u'''%%"%s": "%%%s%%",%%''' % (field, term)),
-                    model_attr.ilike(u'''%%"%s": "%%%s%%"}''' % (field, term))
-                )
-                q = q.filter(like)
-
-            # Just a regular field
-            else:
-                q = q.filter(model_attr.ilike('%' + unicode(term) + '%'))
-
-    if order_by is not None:
-        if hasattr(model.Resource, order_by):
-            q = q.order_by(getattr(model.Resource, order_by))
-
-    count = q.count()
-    q = q.offset(offset)
-    q = q.limit(limit)
-
-    results = []
-    for result in q:
-        if isinstance(result, tuple) and isinstance(result[0], model.DomainObject):
-            # This is the case for order_by rank due to the add_column.
-            results.append(result[0])
-        else:
-            results.append(result)
+    if search.SIMPLE_SEARCH:
+        results, count = _resource_search_sql(model, fields, order_by,
+                                              offset, limit)
+    else:
+        resource_query = search.query_for(model.Resource)
+        resource_query.run(fields=fields, options=search.QueryOptions(
+            offset=offset, limit=limit, order_by=order_by,
+            return_objects=True))
+        results, count = resource_query.results, resource_query.count
 
     # If run in the context of a search query, then don't dictize the results.
     if not context.get('search_query', False):
@@ -1559,6 +1669,14 @@ def _tag_search(context, data_dict):
     if not len(terms):
         return [], 0
 
+    if not data_dict.has_key('vocabulary_id') and not search.SIMPLE_SEARCH:
+        # Free tags are in the search index, vocabularies are small enough to
+        # be searched in the database.
+        tag_query = search.query_for(model.Tag)
+        tag_query.run(query=terms, options=search.QueryOptions(
+            offset=offset, limit=limit, return_objects=True))
+        return tag_query.results, tag_query.count
+
     for term in terms:
         escaped_term = misc.escape_sql_like_special_characters(term, escape='\\')
         q = q.filter(model.Tag.name.ilike('%' + escaped_term + '%'))
@@ -1746,6 +1864,8 @@ def get_site_user(context, data_dict):
             model.Session.commit()
     return {'name': user.name,
             'apikey': user.apikey}
+# it creates the site user if it doesn't exist yet
+get_site_user.side_effect_free = False
 
 def roles_show(context, data_dict):
     '''Return the roles of all users and authorization groups for an object.
@@ -1797,8 +1917,13 @@ def roles_show(context, data_dict):
     return result
 
 def status_show(context, data_dict):
-    '''Return a dictionary with information about the site's configuration.'''
-    return {
+    '''Return a dictionary with information about the site's configuration.
+
+    The state of the database replicas and connection pools, which names
+    internal hosts, is only included for sysadmins.
+
+    '''
+    status = {
         'site_title': config.get('ckan.site_title'),
         'site_description': config.get('ckan.site_description'),
         'site_url': config.get('ckan.site_url'),
@@ -1806,7 +1931,14 @@ def status_show(context, data_dict):
         'error_emails_to': config.get('email_to'),
         'locale_default': config.get('ckan.locale_default'),
         'extensions': config.get('ckan.plugins').split(),
+        'package_show_cache': package_cache.stats(),
+        'fragment_cache': fragment_cache.stats(),
+        'api_metrics': api_metrics.stats(),
         }
+    if new_authz.is_sysadmin(context.get('user')):
+        status['read_replicas'] = replicas.stats()
+        status['db_pools'] = engines.stats()
+    return status
 
 def vocabulary_list(context, data_dict):
     '''Return a list of all the site's tag vocabularies.
@@ -2501,6 +2633,8 @@ def dashboard_activity_list(context, data_dict):
                     > last_viewed)
 
     return activity_dicts
+# it creates the user's dashboard if it doesn't exist yet
+dashboard_activity_list.side_effect_free = False
 
 
 def dashboard_activity_list_html(context, data_dict):
@@ -2530,6 +2664,8 @@ def dashboard_activity_list_html(context, data_dict):
         }
     return activity_streams.activity_list_to_html(context, activity_stream,
             extra_vars)
+# it calls dashboard_activity_list
+dashboard_activity_list_html.side_effect_free = False
 
 
 def dashboard_new_activities_count(context, data_dict):
@@ -2549,6 +2685,8 @@ def dashboard_new_activities_count(context, data_dict):
     activities = logic.get_action('dashboard_activity_list')(
             context, data_dict)
     return len([activity for activity in activities if activity['is_new']])
+# it calls dashboard_activity_list
+dashboard_new_activities_count.side_effect_free = False
 
 
 def _unpick_search(sort, allowed_fields=None, total=None):
@@ -210,6 +210,10 @@ def package_update(context, data_dict):
 
     For further parameters see ``package_create()``.
 
+    If ``skip_unchanged`` is True in the context (or the
+    ``ckan.skip_unchanged_package_updates`` config option is true) and the
+    update doesn't change the dataset, no new revision is made.
+
     :param id: the name or id of the dataset to update
     :type id: string
 
@@ -258,6 +262,7 @@ def package_update(context, data_dict):
         model.Session.rollback()
         raise ValidationError(errors)
 
+    previous_rev = SQLAlchemySession.get_revision(model.Session)
     rev = model.repo.new_revision()
     rev.author = user
     if 'message' in context:
@@ -265,8 +270,23 @@ def package_update(context, data_dict):
     else:
         rev.message = _(u'REST API: Update object %s') % data.get("name")
 
+    if 'skip_unchanged' not in context:
+        context['skip_unchanged'] = paste.deploy.converters.asbool(
+            config.get('ckan.skip_unchanged_package_updates', False))
+
     pkg = model_save.package_dict_save(data, context)
 
+    if context.get('package_unchanged'):
+        # Don't make an empty revision, activity or search index update.
+        log.debug('Package %s unchanged, not updated' % pkg.name)
+        # Only drop the revision made here, the caller may have other
+        # changes pending in the session.
+        if rev in model.Session:
+            model.Session.expunge(rev)
+        SQLAlchemySession.set_revision(model.Session, previous_rev)
+        return data_dict['id'] if context.get('return_id_only', False) \
+            else _get_action('package_show')(context, {'id': data_dict['id']})
+
     context_org_update = context.copy()
     context_org_update['ignore_auth'] = True
     context_org_update['defer_commit'] = True
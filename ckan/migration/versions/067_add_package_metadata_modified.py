@@ -0,0 +1,56 @@
+
+def upgrade(migrate_engine):
+    '''Add a metadata_modified column to package and fill it in.
+
+    It's the latest revision timestamp of the package and its extras, tags,
+    resource groups, resources and relationships, which used to be worked
+    out with a UNION of all those tables each time it was read.
+
+    '''
+    migrate_engine.execute('''
+BEGIN;
+
+ALTER TABLE package
+    ADD COLUMN metadata_modified timestamp without time zone;
+ALTER TABLE package_revision
+    ADD COLUMN metadata_modified timestamp without time zone;
+
+UPDATE package SET metadata_modified = modified.timestamp
+FROM (
+    SELECT package_id, max(timestamp) AS timestamp
+    FROM (
+        SELECT id AS package_id, revision_timestamp AS timestamp
+        FROM package_revision
+      UNION ALL
+        SELECT package_id, revision_timestamp FROM package_extra_revision
+      UNION ALL
+        SELECT package_id, revision_timestamp FROM package_tag_revision
+      UNION ALL
+        SELECT package_id, revision_timestamp FROM resource_group_revision
+      UNION ALL
+        SELECT resource_group.package_id, resource_revision.revision_timestamp
+        FROM resource_revision
+        JOIN resource_group
+          ON resource_group.id = resource_revision.resource_group_id
+      UNION ALL
+        SELECT subject_package_id, revision_timestamp
+        FROM package_relationship_revision
+      UNION ALL
+        SELECT object_package_id, revision_timestamp
+        FROM package_relationship_revision
+    ) AS timestamps
+    GROUP BY package_id
+) AS modified
+WHERE package.id = modified.package_id;
+
+UPDATE package_revision SET metadata_modified = package.metadata_modified
+FROM package
+WHERE package_revision.id = package.id
+  AND package_revision.current = true;
+
+CREATE INDEX idx_package_metadata_modified ON package (metadata_modified);
+CREATE INDEX idx_package_revision_metadata_modified
+    ON package_revision (metadata_modified);
+
+COMMIT;
+''')
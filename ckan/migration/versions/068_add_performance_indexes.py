@@ -0,0 +1,27 @@
+
+def upgrade(migrate_engine):
+    '''Add the indexes that ``paster db index-audit`` finds missing.
+
+    They're for looking users up by API key, checking group memberships,
+    activity streams, package_list and the tracking summaries of datasets.
+    tracking_raw(access_timestamp) was already indexed by migration 057.
+    Compare the timings of ``paster db index-audit 100000`` before and
+    after upgrading to see the difference.
+
+    '''
+    migrate_engine.execute('''
+BEGIN;
+
+CREATE INDEX idx_user_apikey ON "user" (apikey);
+CREATE INDEX idx_member_group_id_table_name_table_id
+    ON member (group_id, table_name, table_id);
+CREATE INDEX idx_activity_user_id_timestamp ON activity (user_id, timestamp);
+CREATE INDEX idx_activity_object_id_timestamp
+    ON activity (object_id, timestamp);
+CREATE INDEX idx_package_revision_current_state
+    ON package_revision (current, state);
+CREATE INDEX idx_tracking_summary_package_id_date
+    ON tracking_summary (package_id, tracking_date);
+
+COMMIT;
+''')
@@ -6,7 +6,7 @@ from datetime import datetime
 
 import vdm.sqlalchemy
 from vdm.sqlalchemy.base import SQLAlchemySession
-from sqlalchemy import MetaData, __version__ as sqav, Table
+from sqlalchemy import MetaData, __version__ as sqav, Table, orm
 from sqlalchemy.util import OrderedDict
 
 import meta
@@ -353,56 +353,161 @@ class Repository(vdm.sqlalchemy.Repository):
         change message to "PURGED: {date-time-of-purge}". If false
         delete revision object as well.
 
-        Summary of the Algorithm
-        ------------------------
+        See purge_revisions().
+        '''
+        self.purge_revisions([revision.id], leave_record=leave_record)
+
+    def purge_revisions(self, revision_ids, leave_record=False):
+        '''Purge all changes associated with a set of revisions.
+
+        The work is done with a few SQL statements for each revisioned table,
+        in one transaction, rather than object by object:
 
-        1. list all RevisionObjects affected by this revision
-        2. check continuity objects and cascade on everything else ?
-        3. crudely get all object revisions associated with this
-        4. then check whether this is the only revision and delete
-           the continuity object
+        1. find the objects whose current version is from a purged revision
+        2. find the latest version of each of those objects that isn't from a
+           purged revision, revert the object to it and make it current
+        3. delete the object revisions of the purged revisions
+        4. delete the objects that have no versions left, i.e. were created
+           in the purged revisions
 
-        5. ALTERNATIVELY delete all associated object revisions then
-           do a select on continutity to check which have zero
-           associated revisions (should only be these ...) '''
+        Datasets that were reverted are then reindexed.
 
-        to_purge = []
+        @param revision_ids: the ids of the revisions to purge
+        @param leave_record: if True leave the revisions in existence but
+        change their message to "PURGED: {date-time-of-purge}". If false
+        delete the revisions as well.
+        '''
+        import sqlalchemy
+        import modification
+
+        if not revision_ids:
+            return
         SQLAlchemySession.setattr(self.session, 'revisioning_disabled', True)
         self.session.autoflush = False
+        execute = self.session.execute
+        execute('CREATE TEMPORARY TABLE purged_revision (id text PRIMARY KEY)'
+                ' ON COMMIT DROP')
+        execute(sqlalchemy.text('INSERT INTO purged_revision VALUES (:id)'),
+                [{'id': id} for id in set(revision_ids)])
+
+        to_purge = {}
+        reverted = {}
         for o in self.versioned_objects:
-            revobj = o.__revision_class__
-            items = self.session.query(revobj). \
-                    filter_by(revision=revision).all()
-            for item in items:
-                continuity = item.continuity
-
-                if continuity.revision == revision:  # must change continuity
-                    trevobjs = self.session.query(revobj).join('revision'). \
-                            filter(revobj.continuity == continuity). \
-                            order_by(Revision.timestamp.desc()).all()
-                    if len(trevobjs) == 0:
-                        raise Exception('Should have at least one revision.')
-                    if len(trevobjs) == 1:
-                        to_purge.append(continuity)
-                    else:
-                        self.revert(continuity, trevobjs[1])
-                        for num, obj in enumerate(trevobjs):
-                            if num == 0:
-                                continue
-                            if 'pending' not in obj.state:
-                                obj.current = True
-                                obj.expired_timestamp = datetime(9999, 12, 31)
-                                self.session.add(obj)
-                                break
-                # now delete revision object
-                self.session.delete(item)
-            for cont in to_purge:
-                self.session.delete(cont)
+            table = orm.class_mapper(o).mapped_table.name
+            revision_table = orm.class_mapper(
+                o.__revision_class__).mapped_table.name
+            columns = orm.class_mapper(o).mapped_table.c.keys()
+            # The latest version of each object whose current version is
+            # from a purged revision, that isn't from a purged revision.
+            execute('''CREATE TEMPORARY TABLE purge_survivor ON COMMIT DROP AS
+                SELECT DISTINCT ON (r.id) r.id, r.revision_id
+                FROM "%(revision_table)s" r
+                JOIN revision ON revision.id = r.revision_id
+                WHERE r.id IN (SELECT id FROM "%(table)s" WHERE revision_id
+                               IN (SELECT id FROM purged_revision))
+                  AND r.revision_id NOT IN (SELECT id FROM purged_revision)
+                ORDER BY r.id, revision.timestamp DESC''' % {
+                    'table': table, 'revision_table': revision_table})
+            to_purge[o] = [row[0] for row in execute(
+                '''SELECT id FROM "%s" WHERE revision_id
+                   IN (SELECT id FROM purged_revision)
+                   AND id NOT IN (SELECT id FROM purge_survivor)''' % table)]
+            reverted[o] = [row[0] for row in
+                           execute('SELECT id FROM purge_survivor')]
+            execute('''UPDATE "%(table)s" SET %(set)s
+                FROM "%(revision_table)s" r
+                JOIN purge_survivor s
+                  ON s.id = r.id AND s.revision_id = r.revision_id
+                WHERE "%(table)s".id = r.id''' % {
+                    'table': table, 'revision_table': revision_table,
+                    'set': ', '.join('"%s" = r."%s"' % (column, column)
+                                     for column in columns if column != 'id')})
+            execute('''UPDATE "%s" r
+                SET current = true, expired_id = NULL,
+                    expired_timestamp = '9999-12-31'
+                FROM purge_survivor s
+                WHERE s.id = r.id AND s.revision_id = r.revision_id
+                  AND r.state NOT LIKE 'pending%%' ''' % revision_table)
+            execute('''DELETE FROM "%s" WHERE revision_id
+                IN (SELECT id FROM purged_revision)''' % revision_table)
+            execute('DROP TABLE purge_survivor')
+
+        # The objects have changed underneath the session.
+        self.session.expire_all()
+        for o, ids in to_purge.items():
+            for obj in self._objects_by_id(o, ids):
+                self.session.delete(obj)
+        packages = set()
+        for o, ids in reverted.items():
+            for obj in self._objects_by_id(o, ids):
+                if isinstance(obj, Package):
+                    packages.add(obj)
+                elif hasattr(obj, 'related_packages'):
+                    packages.update(obj.related_packages())
+        packages.discard(None)
+
+        revisions = self.session.query(Revision) \
+            .filter(Revision.id.in_(revision_ids))
         if leave_record:
-            revision.message = u'PURGED: %s' % datetime.now()
+            revisions.update({'message': u'PURGED: %s' % datetime.now()},
+                             synchronize_session=False)
         else:
-            self.session.delete(revision)
+            for revision in revisions:
+                self.session.delete(revision)
+        self.commit()
+
+        notifier = modification.DomainObjectModificationExtension()
+        for package in packages:
+            notifier.notify(package, DomainObjectOperation.changed)
+        self.session.remove()
+
+    def _objects_by_id(self, cls, ids, chunk_size=1000):
+        for start in range(0, len(ids), chunk_size):
+            chunk = ids[start:start + chunk_size]
+            for obj in self.session.query(cls).filter(cls.id.in_(chunk)):
+                yield obj
+
+    def compact_revisions(self, before, archive=False):
+        '''Remove the old versions of objects from the revision tables.
+
+        Object revisions that stopped being current before `before` are
+        deleted, or moved to a ``<table>_archive`` table (created if needed)
+        if `archive` is True. Current and pending object revisions are always
+        kept, so only the history of objects is lost, e.g. package_show with a
+        ``revision_date`` before `before` won't find the dataset. The
+        revisions themselves are kept for the activity streams.
+
+        :param before: the cutoff date
+        :type before: datetime
+        :param archive: whether to archive the object revisions rather than
+            delete them
+        :returns: a dict of the number of object revisions removed from each
+            revision table
+
+        '''
+        import sqlalchemy
+        connection = self.session.connection()
+        removed = {}
+        for table in self.metadata.sorted_tables:
+            if not (table.name.endswith('_revision') and
+                    'current' in table.c and
+                    'expired_timestamp' in table.c):
+                continue
+            where = '''WHERE current IS NOT TRUE
+                AND expired_timestamp < :before'''
+            if archive:
+                archive_name = table.name + '_archive'
+                if not meta.engine.has_table(archive_name):
+                    connection.execute('CREATE TABLE "%s" (LIKE "%s")' %
+                                       (archive_name, table.name))
+                connection.execute(sqlalchemy.text(
+                    'INSERT INTO "%s" SELECT * FROM "%s" %s' %
+                    (archive_name, table.name, where)), before=before)
+            result = connection.execute(sqlalchemy.text(
+                'DELETE FROM "%s" %s' % (table.name, where)), before=before)
+            removed[table.name] = result.rowcount
         self.commit_and_remove()
+        return removed
 
 
 repo = Repository(meta.metadata, meta.Session,
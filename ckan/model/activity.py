@@ -264,6 +264,95 @@ def dashboard_activity_list(user_id, limit, offset):
     q = _dashboard_activity_query(user_id)
     return _activities_at_offset(q, limit, offset)
 
+
+def dashboard_activity_list_since(user_id, since, limit):
+    '''Return the new activities in the given user's dashboard.
+
+    Returns the activities from the user's dashboard activity stream that
+    happened after the datetime `since`, leaving out the user's own
+    activities. The filtering is done in the database rather than on the
+    dictized activities.
+
+    '''
+    import ckan.model as model
+    q = _dashboard_activity_query(user_id)
+    q = q.filter(model.Activity.timestamp > since)
+    q = q.filter(model.Activity.user_id != user_id)
+    return _activities_at_offset(q, limit, 0)
+
+
+_users_with_new_dashboard_activity_sql = '''
+    SELECT DISTINCT "user".id
+    FROM "user"
+    LEFT JOIN dashboard ON dashboard.user_id = "user".id
+    JOIN (
+        SELECT activity.object_id AS recipient_id,
+               activity.user_id AS actor_id, activity.timestamp
+        FROM activity
+        WHERE activity.timestamp > :since
+      UNION ALL
+        SELECT user_following_user.follower_id,
+               activity.user_id, activity.timestamp
+        FROM activity
+        JOIN user_following_user
+          ON user_following_user.object_id = activity.user_id
+        WHERE activity.timestamp > :since
+      UNION ALL
+        SELECT user_following_dataset.follower_id,
+               activity.user_id, activity.timestamp
+        FROM activity
+        JOIN user_following_dataset
+          ON user_following_dataset.object_id = activity.object_id
+        WHERE activity.timestamp > :since
+      UNION ALL
+        SELECT user_following_group.follower_id,
+               activity.user_id, activity.timestamp
+        FROM activity
+        JOIN user_following_group
+          ON user_following_group.object_id = activity.object_id
+        WHERE activity.timestamp > :since
+      UNION ALL
+        SELECT user_following_group.follower_id,
+               activity.user_id, activity.timestamp
+        FROM activity
+        JOIN member
+          ON member.table_id = activity.object_id
+         AND member.table_name = 'package'
+         AND member.state = 'active'
+        JOIN user_following_group
+          ON user_following_group.object_id = member.group_id
+        WHERE activity.timestamp > :since
+    ) AS new_activity ON new_activity.recipient_id = "user".id
+    WHERE "user".activity_streams_email_notifications = true
+      AND "user".email IS NOT NULL
+      AND "user".email != ''
+      AND new_activity.actor_id != "user".id
+      AND new_activity.timestamp > COALESCE(dashboard.email_last_sent, :since)
+      AND new_activity.timestamp >
+          COALESCE(dashboard.activity_stream_last_viewed, :since)
+    ORDER BY "user".id
+'''
+
+
+def users_with_new_dashboard_activity(since):
+    '''Return the ids of users who may have new dashboard activities.
+
+    Returns, in a single query, the ids of the users who have email
+    notifications turned on and an email address, and whose dashboard
+    activity stream contains activities from other users newer than `since`
+    and newer than both their dashboard's email_last_sent and
+    activity_stream_last_viewed times. Users who have no dashboard row yet
+    are included too.
+
+    The result is a superset of the users who will actually be notified (it
+    doesn't take private datasets into account, for example), use
+    dashboard_activity_list_since() to get each user's actual activities.
+
+    '''
+    result = meta.Session.execute(_users_with_new_dashboard_activity_sql,
+            {'since': since})
+    return [row[0] for row in result]
+
 def _changed_packages_activity_query():
     '''Return an SQLAlchemyu query for all changed package activities.
 
@@ -1,11 +1,19 @@
 import datetime
+import hashlib
+import logging
+import os
+import threading
+import time
 import urllib2
 import re
+import weakref
 import simplejson as json
 
 from pylons import config
 from pylons.i18n import _
 
+log = logging.getLogger(__name__)
+
 
 class License(object):
     """Domain object for a license."""
@@ -41,12 +49,28 @@ class License(object):
 
 
 class LicenseRegister(object):
-    """Dictionary-like interface to a group of licenses."""
+    """Dictionary-like interface to a group of licenses.
+
+    With ``licenses_group_url`` set, the licenses are loaded from that URL
+    and a copy is kept in ``cache_dir``, which is used instead if the URL
+    can't be reached later on. The licenses are reloaded in a background
+    thread every ``ckan.licenses_refresh_interval`` seconds (default: 3600,
+    0 turns it off). The thread is started by the first read of the licenses
+    in each process, as threads aren't inherited by forked worker processes,
+    and stops once the register is no longer used.
+    """
 
     def __init__(self):
+        self._licenses_by_id = {}
+        self._refresh_url = None
+        self._refresh_pid = None
+        self._refresh_lock = threading.Lock()
         group_url = config.get('licenses_group_url', None)
         if group_url:
             self.load_licenses(group_url)
+            self._refresh_url = group_url
+            self._refresh_interval = int(config.get(
+                'ckan.licenses_refresh_interval', 3600))
         else:
             default_license_list = [
                 LicenseNotSpecified(),
@@ -68,55 +92,121 @@ class LicenseRegister(object):
             self._create_license_list(default_license_list)
 
     def load_licenses(self, license_url):
+        cache_path = self._cache_path(license_url)
         try:
             response = urllib2.urlopen(license_url)
             response_body = response.read()
         except Exception, inst:
             msg = "Couldn't connect to licenses service %r: %s" % (license_url, inst)
-            raise Exception, msg
+            if not (cache_path and os.path.exists(cache_path)):
+                raise Exception, msg
+            log.warning('%s, using the cached copy %s', msg, cache_path)
+            with open(cache_path) as cache_file:
+                response_body = cache_file.read()
+            cache_path = None
         try:
             license_data = json.loads(response_body)
         except Exception, inst:
             msg = "Couldn't read response from licenses service %r: %s" % (response_body, inst)
-            raise Exception, inst
+            raise Exception, msg
         self._create_license_list(license_data, license_url)
+        if cache_path:
+            self._write_cache(cache_path, response_body)
+
+    def _cache_path(self, license_url):
+        cache_dir = config.get('cache_dir')
+        if not cache_dir:
+            return None
+        return os.path.join(cache_dir, 'licenses',
+                            hashlib.md5(license_url).hexdigest() + '.json')
+
+    def _write_cache(self, cache_path, response_body):
+        # Write to a temporary file and rename it, so that other processes
+        # never read half a file.
+        try:
+            if not os.path.exists(os.path.dirname(cache_path)):
+                os.makedirs(os.path.dirname(cache_path))
+            temp_path = '%s.%s' % (cache_path, os.getpid())
+            with open(temp_path, 'w') as cache_file:
+                cache_file.write(response_body)
+            os.rename(temp_path, cache_path)
+        except (IOError, OSError), inst:
+            log.warning("Couldn't cache the licenses in %s: %s",
+                        cache_path, inst)
+
+    def _start_refresh(self):
+        '''Start this process's refresh thread, unless it's running.'''
+        if not self._refresh_url or self._refresh_interval <= 0 or \
+                self._refresh_pid == os.getpid():
+            return
+        with self._refresh_lock:
+            if self._refresh_pid == os.getpid():
+                return
+            self._refresh_pid = os.getpid()
+            thread = threading.Thread(
+                target=_refresh,
+                args=(weakref.ref(self), self._refresh_url,
+                      self._refresh_interval),
+                name='license-refresh')
+            thread.daemon = True
+            thread.start()
 
     def _create_license_list(self, license_data, license_url=''):
         if isinstance(license_data, dict):
-            self.licenses = [License(entity) for entity in license_data.values()]
+            licenses = [License(entity) for entity in license_data.values()]
         elif isinstance(license_data, list):
-            self.licenses = [License(entity) for entity in license_data]
+            licenses = [License(entity) for entity in license_data]
         else:
             msg = "Licenses at %s must be dictionary or list" % license_url
             raise ValueError(msg)
+        # Build both before replacing either, as a refresh may be replacing
+        # them while requests read them. The first license with an id wins.
+        licenses_by_id = dict((license.id, license)
+                              for license in reversed(licenses))
+        self.licenses, self._licenses_by_id = licenses, licenses_by_id
 
     def __getitem__(self, key, default=Exception):
-        for license in self.licenses:
-            if key == license.id:
-                return license
-        if default != Exception:
-            return default
-        else:
+        self._start_refresh()
+        try:
+            return self._licenses_by_id[key]
+        except KeyError:
+            if default != Exception:
+                return default
             raise KeyError, "License not found: %s" % key
 
     def get(self, key, default=None):
         return self.__getitem__(key, default=default)
 
     def keys(self):
-        return [license.id for license in self.licenses]
+        return [license.id for license in self.values()]
 
     def values(self):
+        self._start_refresh()
         return self.licenses
 
     def items(self):
-        return [(license.id, license) for license in self.licenses]
+        return [(license.id, license) for license in self.values()]
 
     def __iter__(self):
         return iter(self.keys())
 
     def __len__(self):
-        return len(self.licenses)
+        return len(self.values())
+
 
+def _refresh(register_ref, license_url, interval):
+    '''Reload the licenses of the register every `interval` seconds, until
+    it's garbage collected.'''
+    while True:
+        time.sleep(interval)
+        register = register_ref()
+        if register is None:
+            return
+        try:
+            register.load_licenses(license_url)
+        except Exception, inst:
+            log.warning("Couldn't refresh the licenses: %s", inst)
+        del register
 
 
 class DefaultLicense(dict):
@@ -6,6 +6,7 @@ from pylons import config
 from sqlalchemy import MetaData, and_
 import sqlalchemy.orm as orm
 from sqlalchemy.orm.session import SessionExtension
+from sqlalchemy.sql.expression import UpdateBase
 
 import extension
 import ckan.lib.activity_streams_session_extension as activity
@@ -51,6 +52,50 @@ class CkanCacheExtension(SessionExtension):
             except self.redis_exception:
                 pass
 
+class MetadataModifiedExtension(SessionExtension):
+    '''Keeps the package table's metadata_modified column up to date.
+
+    When a dataset or one of its resources, tags, extras or relationships is
+    written in a revision, the dataset's metadata_modified is set to the
+    revision's timestamp. Changes to the dataset's groups don't count. This
+    has to run before CkanSessionExtension.before_flush() so that the
+    datasets are in the session's _object_cache.
+
+    '''
+    def before_flush(self, session, flush_context, instances):
+        revision = getattr(session, 'revision', None)
+        if revision is None or getattr(session, 'revisioning_disabled', False):
+            return
+        import ckan.model as model
+
+        changed = [obj for obj in session.dirty if
+            session.is_modified(obj, include_collections=False, passive=True)]
+
+        packages = set()
+        for obj in set(session.new) | set(changed) | set(session.deleted):
+            if not hasattr(obj, '__revision_class__') or \
+                    isinstance(obj, model.Member):
+                continue
+            if isinstance(obj, model.Package):
+                packages.add(obj)
+            elif isinstance(obj, model.PackageRelationship):
+                packages.update([obj.subject, obj.object])
+            else:
+                try:
+                    packages.update(obj.related_packages())
+                except AttributeError:
+                    pass
+        packages.discard(None)
+        if not packages:
+            return
+
+        if revision.timestamp is None:
+            revision.timestamp = datetime.datetime.now()
+        for package in packages:
+            if package.metadata_modified != revision.timestamp:
+                package.metadata_modified = revision.timestamp
+
+
 class CkanSessionExtension(SessionExtension):
 
     def before_flush(self, session, flush_context, instances):
@@ -121,19 +166,50 @@ class CkanSessionExtension(SessionExtension):
         if hasattr(session, '_object_cache'):
             del session._object_cache
 
+class ReplicaSessionExtension(SessionExtension):
+    '''Records that a session has written to the database, so that it
+    doesn't read from a replica that may not have the changes yet.'''
+
+    def after_flush(self, session, flush_context):
+        session.wrote = True
+
+
+class RoutingSession(orm.Session):
+    '''A session that sends its queries to a replica of the database while
+    its replica_engine is set, see ckan.lib.replicas.'''
+    replica_engine = None
+    # whether any queries were sent to a replica
+    read_replica = False
+    # whether anything was written to the primary database
+    wrote = False
+    # the number of actions with side effects being called
+    writing = 0
+
+    def get_bind(self, mapper=None, clause=None):
+        # writes always go to the primary, even from side-effect-free actions
+        if self.replica_engine is not None and not self._flushing and \
+                not isinstance(clause, UpdateBase):
+            self.read_replica = True
+            return self.replica_engine
+        return super(RoutingSession, self).get_bind(mapper, clause)
+
+
 # __all__ = ['Session', 'engine', 'metadata', 'mapper']
 
 # SQLAlchemy database engine. Updated by model.init_model()
 engine = None
 
 Session = orm.scoped_session(orm.sessionmaker(
+    class_=RoutingSession,
     autoflush=False,
     autocommit=False,
     expire_on_commit=False,
     extension=[CkanCacheExtension(),
+               MetadataModifiedExtension(),
                CkanSessionExtension(),
                extension.PluginSessionExtension(),
-               activity.DatasetActivitySessionExtension()],
+               activity.DatasetActivitySessionExtension(),
+               ReplicaSessionExtension()],
 ))
 
 create_local_session = orm.sessionmaker(
@@ -141,6 +217,7 @@ create_local_session = orm.sessionmaker(
     autocommit=False,
     expire_on_commit=False,
     extension=[CkanCacheExtension(),
+               MetadataModifiedExtension(),
                CkanSessionExtension(),
                extension.PluginSessionExtension(),
                activity.DatasetActivitySessionExtension()],
@@ -1,9 +1,7 @@
-import datetime
-from calendar import timegm
 import logging
 logger = logging.getLogger(__name__)
 
-from sqlalchemy.sql import select, and_, union, or_
+from sqlalchemy.sql import and_, or_
 from sqlalchemy import orm
 from sqlalchemy import types, Column, Table
 from pylons import config
@@ -45,6 +43,10 @@ package_table = Table('package', meta.metadata,
         Column('type', types.UnicodeText, default=u'dataset'),
         Column('owner_org', types.UnicodeText),
         Column('private', types.Boolean, default=False),
+        # The latest revision timestamp of the package or any of its
+        # resources, tags, extras or relationships, set by
+        # ckan.model.meta.MetadataModifiedExtension.
+        Column('metadata_modified', types.DateTime),
 )
 
 
@@ -419,6 +421,9 @@ class Package(vdm.sqlalchemy.RevisionedObjectMixin,
 
         results = {} # field_name:diffs
         results.update(super(Package, self).diff(to_revision, from_revision))
+        # metadata_modified changes with every revision, so isn't a change
+        # to show.
+        results.pop('metadata_modified', None)
         # Iterate over PackageTag, PackageExtra, Resources etc.
         for obj_class in [ResourceGroup, Resource, PackageExtra, PackageTag]:
             obj_rev_class = obj_class.__revision_class__
@@ -468,47 +473,6 @@ class Package(vdm.sqlalchemy.RevisionedObjectMixin,
                         results[key] = value_diff
         return results
 
-    @property
-    def metadata_modified(self):
-        """
-        Return most recent timestamp for revisions related to this package.
-        NB Excludes changes to the package's groups
-        """
-        from ckan import model
-        where = [model.package_table.c.id == self.id]
-        where_clauses = [
-            and_(model.package_table.c.revision_id == model.revision_table.c.id, *where),
-            and_(model.package_extra_table.c.package_id == model.package_table.c.id,
-                 model.package_extra_table.c.revision_id == model.revision_table.c.id, *where),
-            and_(model.package_relationship_table.c.subject_package_id == model.package_table.c.id,
-                 model.package_relationship_table.c.revision_id == model.revision_table.c.id, *where),
-            and_(model.package_relationship_table.c.object_package_id == model.package_table.c.id,
-                 model.package_relationship_table.c.revision_id == model.revision_table.c.id, *where),
-            and_(model.resource_group_table.c.package_id == model.package_table.c.id,
-                 model.resource_group_table.c.revision_id == model.revision_table.c.id, *where),
-            and_(model.resource_group_table.c.package_id == model.package_table.c.id,
-                 model.resource_table.c.resource_group_id == model.resource_group_table.c.id,
-                 model.resource_table.c.revision_id == model.revision_table.c.id, *where),
-            and_(model.package_tag_table.c.package_id == model.package_table.c.id,
-                 model.package_tag_table.c.revision_id == model.revision_table.c.id, *where)
-            ]
-
-        query = union(*[select([model.revision_table.c.timestamp], x) for x in where_clauses]
-                      ).order_by('timestamp DESC').limit(1)
-        # Use current connection because we might be in a 'before_commit' of
-        # a SessionExtension - only by using the current connection can we get
-        # at the newly created revision etc. objects.
-        conn = model.Session.connection()
-        result = conn.execute(query).fetchone()
-
-        if result:
-            result_datetime = _types.iso_date_to_datetime_for_sqlite(result[0])
-            timestamp_without_usecs = result_datetime.utctimetuple()
-            usecs = float(result_datetime.microsecond) / 1e6
-            # use timegm instead of mktime, because we don't want it localised
-            timestamp_float = timegm(timestamp_without_usecs) + usecs
-            return datetime.datetime.utcfromtimestamp(timestamp_float)
-
     @property
     def is_private(self):
         """
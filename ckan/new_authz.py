@@ -7,6 +7,7 @@ from paste.deploy.converters import asbool
 
 import ckan.plugins as p
 import ckan.model as model
+import ckan.lib.timing as timing
 
 log = getLogger(__name__)
 
@@ -60,7 +61,8 @@ def is_authorized(action, context, data_dict=None):
 
     auth_function = _get_auth_function(action)
     if auth_function:
-        return auth_function(context, data_dict)
+        with timing.timer('auth'):
+            return auth_function(context, data_dict)
     else:
         raise ValueError(_('Authorization function not found: %s' % action))
 
@@ -478,6 +478,36 @@ class TestPackageSearchApi3(Api3TestCase, PackageSearchApiTestCase):
         assert res_dict['count'] == 1, res_dict
 
 
+    def test_15_cursor(self):
+        params = {'q': 'tags:russian', 'rows': 1, 'cursor': '*',
+                  'sort': 'name asc'}
+        res = self.app.get('/api/action/package_search', params=params)
+        result = json.loads(res.body)['result']
+        assert_equal(result['count'], 2)
+        assert_equal(result['results'][0]['name'], 'annakarenina')
+        params['cursor'] = result['next_cursor']
+        res = self.app.get('/api/action/package_search', params=params)
+        result = json.loads(res.body)['result']
+        assert_equal(result['count'], 1)
+        assert_equal(result['results'][0]['name'], 'warandpeace')
+        assert_equal(result['next_cursor'], None)
+
+    def test_16_dataset_export(self):
+        import ckan.controllers.api as api
+        page_size = api.EXPORT_PAGE_SIZE
+        api.EXPORT_PAGE_SIZE = 1
+        try:
+            res = self.app.get('/api/util/dataset/export',
+                               params={'q': 'tags:russian',
+                                       'sort': 'name asc'})
+        finally:
+            api.EXPORT_PAGE_SIZE = page_size
+        assert res.header('Content-Type').startswith('application/x-ndjson')
+        names = [json.loads(line)['name'] for line in res.body.splitlines()]
+        assert_equal(names, ['annakarenina', 'warandpeace'])
+        self.app.get('/api/util/dataset/export', params={'sort': 'title asc'},
+                     status=400)
+
 class TestPackageSearchApiUnversioned(PackageSearchApiTestCase,
                                       ApiUnversionedTestCase,
                                       LegacyOptionsTestCase): pass
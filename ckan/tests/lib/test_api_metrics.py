@@ -0,0 +1,73 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+
+from nose.tools import assert_equal
+
+from ckan.lib.api_metrics import RateCounter
+
+
+class TestRateCounter(object):
+
+    def test_stats(self):
+        counter = RateCounter(window=60)
+        counter.record('package_show', 0.003)
+        counter.record('package_show', 0.150)
+        counter.record('package_search', 0.030, error=True)
+
+        stats = counter.stats()
+        assert_equal(stats['calls'], 3)
+        assert_equal(stats['throughput'], 3 / 60.0)
+        package_show = stats['actions']['package_show']
+        assert_equal(package_show['calls'], 2)
+        assert_equal(package_show['error_rate'], 0.0)
+        assert_equal(package_show['latency_p50_ms'], 5)
+        assert_equal(package_show['latency_p99_ms'], 200)
+        assert_equal(stats['actions']['package_search']['error_rate'], 1.0)
+
+    def test_slowest_bucket_open_ended(self):
+        counter = RateCounter(window=60)
+        counter.record('package_search', 12.0)
+        stats = counter.stats()
+        assert_equal(stats['latency_p50_ms'], '+Inf')
+
+    def test_no_calls(self):
+        stats = RateCounter().stats(10)
+        assert_equal(stats['calls'], 0)
+        assert_equal(stats['actions'], {})
+        assert stats['latency_p50_ms'] is None
+
+
+class TestSharedRateCounter(object):
+
+    def setup(self):
+        self.dir = tempfile.mkdtemp()
+        self.store_path = os.path.join(self.dir, 'api_metrics.sqlite')
+
+    def teardown(self):
+        shutil.rmtree(self.dir)
+
+    def test_shared_between_counters(self):
+        first = RateCounter(store_path=self.store_path)
+        second = RateCounter(store_path=self.store_path)
+        first.record('package_show', 0.01)
+        # Flush the first counter's bucket to the store.
+        first.flush(int(time.time()) + 1)
+        second.record('package_show', 0.01)
+        assert_equal(second.stats()['actions']['package_show']['calls'], 2)
+        # the first counter's bucket isn't counted again from the store, and
+        # the second's isn't written yet
+        assert_equal(first.stats()['actions']['package_show']['calls'], 1)
+
+    def test_record_does_not_write(self):
+        counter = RateCounter(store_path=self.store_path)
+        counter.record('package_show', 0.01)
+        connection = sqlite3.connect(self.store_path)
+        try:
+            assert_equal(connection.execute(
+                'SELECT count(*) FROM bucket').fetchone()[0], 0)
+        finally:
+            connection.close()
+        assert_equal(counter.stats()['calls'], 1)
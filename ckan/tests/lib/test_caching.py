@@ -0,0 +1,83 @@
+from nose.tools import assert_equal
+from pylons import config
+
+from ckan.lib.caching import Cache, LRUCache
+
+
+class TestLRUCache(object):
+
+    def test_get_and_set(self):
+        cache = LRUCache(2)
+        assert cache.get('a') is None
+        cache.set('a', 1)
+        assert_equal(cache.get('a'), 1)
+
+    def test_least_recently_used_dropped(self):
+        cache = LRUCache(2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        assert_equal(len(cache), 2)
+        assert_equal(cache.get('a'), 1)
+        assert cache.get('b') is None
+        assert_equal(cache.get('c'), 3)
+
+    def test_expires(self):
+        cache = LRUCache(2, expires=-1)
+        cache.set('a', 1)
+        assert cache.get('a') is None
+
+    def test_delete_matching(self):
+        cache = LRUCache(3)
+        cache.set(('a', 1), 1)
+        cache.set(('a', 2), 2)
+        cache.set(('b', 1), 3)
+        cache.delete_matching(lambda key: key[0] == 'a')
+        assert_equal(len(cache), 1)
+        assert_equal(cache.get(('b', 1)), 3)
+
+    def test_max_cost(self):
+        cache = LRUCache(10, max_cost=10)
+        cache.set('a', 1, cost=4)
+        cache.set('b', 2, cost=4)
+        assert_equal(cache.cost, 8)
+        cache.set('c', 3, cost=4)
+        assert cache.get('a') is None
+        assert_equal(cache.get('b'), 2)
+        assert_equal(cache.cost, 8)
+        cache.set('b', 2, cost=1)
+        assert_equal(cache.cost, 5)
+        cache.clear()
+        assert_equal(cache.cost, 0)
+
+
+
+class TestCache(object):
+
+    def setup(self):
+        self.cache = Cache('test', 'ckan.test_cache', max_bytes=10, cost=len)
+
+    def test_get_and_set(self):
+        assert self.cache.get('a') is None
+        self.cache.set('a', 'value')
+        assert_equal(self.cache.get('a'), 'value')
+        stats = self.cache.stats()
+        assert_equal(stats['hits'], 1)
+        assert_equal(stats['misses'], 1)
+        assert_equal(stats['hit_rate'], 0.5)
+        assert_equal(stats['bytes'], 5)
+
+    def test_configured(self):
+        config['ckan.test_cache.max_bytes'] = '4'
+        try:
+            self.cache.set('a', 'value')
+            assert self.cache.get('a') is None
+        finally:
+            del config['ckan.test_cache.max_bytes']
+
+    def test_clear(self):
+        self.cache.set('a', 'value')
+        self.cache.clear()
+        assert self.cache.get('a') is None
+        assert_equal(self.cache.stats()['size'], 0)
@@ -11,6 +11,10 @@ import nose.tools
 
 import ckan.lib.email_notifications as email_notifications
 import ckan.logic as logic
+import ckan.model as model
+import ckan.tests as tests
+import ckan.tests.mock_mail_server as mock_mail_server
+import ckan.tests.pylons_controller as pylons_controller
 
 
 def test_string_to_time_delta():
@@ -44,3 +48,64 @@ def test_string_to_time_delta():
             datetime.timedelta(milliseconds=123, microseconds=456))
     nose.tools.assert_raises(logic.ParameterError,
         email_notifications.string_to_timedelta, 'foobar')
+
+
+class TestNotificationsForUsers(mock_mail_server.SmtpServerHarness,
+        pylons_controller.PylonsTestCase):
+    '''Tests for the batch path of get_and_send_notifications_for_all_users().
+
+    '''
+    @classmethod
+    def setup_class(cls):
+        mock_mail_server.SmtpServerHarness.setup_class()
+        pylons_controller.PylonsTestCase.setup_class()
+        tests.CreateTestData.create()
+        cls.since = datetime.datetime.now() - datetime.timedelta(days=1)
+
+        # A user who has never viewed their dashboard, so has no dashboard
+        # row, and who follows a dataset that someone else then changes.
+        context = {'model': model, 'session': model.Session,
+                'user': 'testsysadmin'}
+        cls.user = logic.get_action('user_create')(context, {
+            'name': 'dashless', 'email': 'dashless@example.com',
+            'password': 'dashless',
+            'activity_streams_email_notifications': True})
+        context = {'model': model, 'session': model.Session,
+                'user': 'dashless'}
+        logic.get_action('follow_dataset')(context, {'id': 'warandpeace'})
+        context = {'model': model, 'session': model.Session,
+                'user': 'testsysadmin'}
+        package = logic.get_action('package_show')(context,
+                {'id': 'warandpeace'})
+        package['notes'] = u'updated'
+        logic.get_action('package_update')(context, package)
+
+    @classmethod
+    def teardown_class(cls):
+        mock_mail_server.SmtpServerHarness.teardown_class()
+        pylons_controller.PylonsTestCase.teardown_class()
+        model.repo.rebuild_db()
+
+    def _dashboard(self):
+        return model.Session.query(model.Dashboard).filter_by(
+                user_id=self.user['id']).first()
+
+    def test_01_users_without_dashboard_included(self):
+        assert self._dashboard() is None
+        user_ids = model.activity.users_with_new_dashboard_activity(
+                self.since)
+        assert self.user['id'] in user_ids
+
+    def test_02_get_and_send_notifications_for_users(self):
+        self.clear_smtp_messages()
+        email_notifications._get_and_send_notifications_for_users(
+                [self.user['id']], self.since, 1)
+        messages = self.get_smtp_messages()
+        nose.tools.assert_equal(len(messages), 1)
+        nose.tools.assert_equal(messages[0][2], ['dashless@example.com'])
+
+        # the user's dashboard row is made, so they aren't emailed again
+        assert self._dashboard() is not None
+        assert self.user['id'] not in (
+                model.activity.users_with_new_dashboard_activity(self.since))
+        self.clear_smtp_messages()
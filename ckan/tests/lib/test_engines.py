@@ -0,0 +1,59 @@
+import sqlite3
+
+import sqlalchemy.exc
+from nose.tools import assert_equal, assert_raises
+from pylons import config
+
+import ckan.lib.engines as engines
+
+
+class TestMeasuredQueuePool(object):
+
+    def test_counts_checkouts_and_timeouts(self):
+        pool = engines.MeasuredQueuePool(lambda: sqlite3.connect(':memory:'),
+                                         pool_size=1, max_overflow=0,
+                                         timeout=0.01)
+        connection = pool.connect()
+        assert_raises(sqlalchemy.exc.TimeoutError, pool.connect)
+        assert_equal(pool.checkouts, 2)
+        assert_equal(pool.timeouts, 1)
+        assert pool.max_wait >= 0.01
+        connection.close()
+        pool.connect().close()
+        assert_equal(pool.checkouts, 3)
+
+
+class TestGetEngine(object):
+
+    def teardown(self):
+        for key in ('ckan.db.pool_size', 'ckan.db.test.pool_size'):
+            config.pop(key, None)
+
+    def test_settings(self):
+        config['ckan.db.pool_size'] = '3'
+        assert_equal(engines._setting('test', 'pool_size'), '3')
+        config['ckan.db.test.pool_size'] = '7'
+        assert_equal(engines._setting('test', 'pool_size'), '7')
+        assert_equal(engines._setting('test', 'pool_recycle', -1), -1)
+
+    def test_pool_stats(self):
+        url = config['sqlalchemy.url']
+        if not url.startswith('postgres'):
+            return
+        config['ckan.db.test.pool_size'] = '2'
+        engine = engines.get_engine('test', url)
+        try:
+            assert engines.get_engine('test', url) is engine
+            connection = engine.connect()
+            stats = [pool for pool in engines.stats()
+                     if pool['pool'] == 'test'][0]
+            assert_equal(stats['size'], 2)
+            assert_equal(stats['checked_out'], 1)
+            assert_equal(stats['checkouts'], 1)
+            assert_equal(stats['utilization'], 1 / 12.0)
+            connection.close()
+        finally:
+            engine.dispose()
+            engines.forget(engine)
+        assert engines.get_engine('test', url) is not engine
+        engines.forget(engines.get_engine('test', url))
@@ -0,0 +1,98 @@
+from nose.tools import assert_equal, assert_not_equal
+from pylons import config
+import jinja2
+
+import ckan.lib.fragment_cache as fragment_cache
+import ckan.lib.jinja_extensions as jinja_extensions
+
+
+class TestFragmentCache(object):
+
+    @classmethod
+    def setup_class(cls):
+        cls.original_debug = config.get('debug')
+        config['debug'] = 'false'
+
+    @classmethod
+    def teardown_class(cls):
+        config['debug'] = cls.original_debug
+
+    def setup(self):
+        fragment_cache.clear()
+        self.renders = 0
+
+    def _render(self):
+        self.renders += 1
+        return u'<p>fragment %i</p>' % self.renders
+
+    def test_get_fragment(self):
+        key = fragment_cache.make_key('item.html', ['id', 'revision-1'])
+        assert_equal(fragment_cache.get_fragment(key, self._render),
+                     u'<p>fragment 1</p>')
+        assert_equal(fragment_cache.get_fragment(key, self._render),
+                     u'<p>fragment 1</p>')
+        assert_equal(self.renders, 1)
+
+        key = fragment_cache.make_key('item.html', ['id', 'revision-2'])
+        assert_equal(fragment_cache.get_fragment(key, self._render),
+                     u'<p>fragment 2</p>')
+
+    def test_make_key(self):
+        key = fragment_cache.make_key('item.html', 'id',
+                                      {'truncate': 80, 'package': {}})
+        assert_equal(key, fragment_cache.make_key(
+            'item.html', 'id', {'truncate': 80, 'package': {'a': 1}}))
+        assert_not_equal(key, fragment_cache.make_key(
+            'item.html', 'id', {'truncate': 120, 'package': {}}))
+        assert_not_equal(key, fragment_cache.make_key(
+            'other.html', 'id', {'truncate': 80, 'package': {}}))
+
+    def test_resources_are_needed_again(self):
+        needed = []
+
+        def render():
+            needed.append('base/main')
+            fragment_cache.resource_needed('base/main')
+            return u'fragment'
+
+        import ckan.lib.helpers as h
+        original_include_resource = h.include_resource
+        h.include_resource = needed.append
+        try:
+            key = fragment_cache.make_key('item.html', 'id')
+            fragment_cache.get_fragment(key, render)
+            fragment_cache.get_fragment(key, render)
+        finally:
+            h.include_resource = original_include_resource
+        assert_equal(needed, ['base/main', 'base/main'])
+
+    def test_disabled_in_debug_mode(self):
+        config['debug'] = 'true'
+        try:
+            key = fragment_cache.make_key('item.html', 'id')
+            fragment_cache.get_fragment(key, self._render)
+            fragment_cache.get_fragment(key, self._render)
+        finally:
+            config['debug'] = 'false'
+        assert_equal(self.renders, 2)
+
+    def test_cache_tag(self):
+        env = jinja2.Environment(
+            loader=jinja2.DictLoader({'list.html':
+                '{% for item in items %}'
+                '{% cache item.id, item.revision %}'
+                '[{{ item.title }}]'
+                '{% endcache %}'
+                '{% endfor %}'}),
+            autoescape=True,
+            extensions=[jinja_extensions.FragmentCacheExtension])
+        template = env.get_template('list.html')
+        items = [{'id': 'a', 'revision': 1, 'title': 'A'},
+                 {'id': 'b', 'revision': 1, 'title': '<B>'}]
+        assert_equal(template.render(items=items), '[A][&lt;B&gt;]')
+
+        # the revision didn't change so the cached fragment is used
+        items[0]['title'] = 'changed'
+        assert_equal(template.render(items=items), '[A][&lt;B&gt;]')
+        items[0]['revision'] = 2
+        assert_equal(template.render(items=items), '[changed][&lt;B&gt;]')
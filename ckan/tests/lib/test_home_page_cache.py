@@ -0,0 +1,76 @@
+from nose.tools import assert_equal
+from pylons import config
+
+import ckan.model as model
+import ckan.logic as logic
+import ckan.lib.home_page_cache as home_page_cache
+from ckan.lib.create_test_data import CreateTestData
+
+
+class TestHomePageCache(object):
+
+    @classmethod
+    def setup_class(cls):
+        # test-core.ini turns the cache off
+        cls._original_config = config.copy()
+        config['ckan.home_page_cache_expires'] = '300'
+        config['ckan.home_page_cache_type'] = 'memory'
+        CreateTestData.create()
+
+    @classmethod
+    def teardown_class(cls):
+        home_page_cache.clear()
+        config.clear()
+        config.update(cls._original_config)
+        model.repo.rebuild_db()
+
+    def setup(self):
+        home_page_cache.clear()
+
+    def _action(self, action, data_dict):
+        context = {'model': model, 'session': model.Session,
+                   'user': 'testsysadmin'}
+        return logic.get_action(action)(context, data_dict)
+
+    def _cached(self, value):
+        return home_page_cache.get('search', lambda: value)
+
+    def test_get(self):
+        calls = []
+
+        def createfunc():
+            calls.append(1)
+            return {'count': 2}
+        assert_equal(home_page_cache.get('search', createfunc),
+                     {'count': 2})
+        assert_equal(home_page_cache.get('search', createfunc),
+                     {'count': 2})
+        assert_equal(len(calls), 1)
+
+    def test_clear(self):
+        assert_equal(self._cached('old'), 'old')
+        home_page_cache.clear()
+        assert_equal(self._cached('new'), 'new')
+
+    def test_disabled(self):
+        config['ckan.home_page_cache_expires'] = '0'
+        try:
+            assert_equal(self._cached('old'), 'old')
+            assert_equal(self._cached('new'), 'new')
+        finally:
+            config['ckan.home_page_cache_expires'] = '300'
+
+    def test_dataset_change_clears(self):
+        assert_equal(self._cached('old'), 'old')
+        assert_equal(self._cached('new'), 'old')
+        package = self._action('package_show', {'id': 'annakarenina'})
+        package['notes'] = u'Updated for the home page'
+        self._action('package_update', package)
+        assert_equal(self._cached('new'), 'new')
+
+    def test_group_change_clears(self):
+        assert_equal(self._cached('old'), 'old')
+        group = self._action('group_show', {'id': 'roger'})
+        group['description'] = u'Updated for the home page'
+        self._action('group_update', group)
+        assert_equal(self._cached('new'), 'new')
@@ -0,0 +1,23 @@
+from nose.tools import assert_equal
+
+from ckan.lib.index_audit import seq_scans, _index_columns
+
+
+class TestIndexAudit(object):
+
+    def test_seq_scans(self):
+        plan = {'Node Type': 'Limit', 'Plans': [
+            {'Node Type': 'Nested Loop', 'Plans': [
+                {'Node Type': 'Seq Scan', 'Relation Name': 'member'},
+                {'Node Type': 'Index Scan', 'Relation Name': 'package'},
+            ]},
+        ]}
+        assert_equal(seq_scans(plan), ['member'])
+
+    def test_index_columns(self):
+        assert_equal(_index_columns(
+            'CREATE INDEX idx_activity_user_id_timestamp ON activity '
+            'USING btree (user_id, "timestamp")'), ['user_id', 'timestamp'])
+        assert_equal(_index_columns(
+            'CREATE INDEX idx ON tracking_raw USING btree '
+            '(access_timestamp DESC)'), ['access_timestamp'])
@@ -8,6 +8,7 @@ from ckan import model
 from ckan.tests.pylons_controller import PylonsTestCase
 from ckan.tests.mock_mail_server import SmtpServerHarness
 from ckan.lib.mailer import mail_recipient, mail_user, send_reset_link, add_msg_niceties, MailerException, get_reset_link_body, get_reset_link
+from ckan.lib.mailer import smtp_connection, make_msg, send_msg
 from ckan.lib.create_test_data import CreateTestData
 from ckan.lib.base import g
 
@@ -90,6 +91,27 @@ class TestMailer(SmtpServerHarness, PylonsTestCase):
                                          'bob')
         assert expected_body in msg[3], '%r not in %r' % (expected_body, msg[3])
 
+    def test_send_msgs_over_one_connection(self):
+        msgs = self.get_smtp_messages()
+        assert_equal(msgs, [])
+
+        # send two emails over the same smtp connection
+        recipients = [('Bob', 'bob@bob.net'), ('Mary', 'mary@mary.net')]
+        with smtp_connection() as connection:
+            for recipient_name, recipient_email in recipients:
+                msg = make_msg(recipient_name, recipient_email, 'Meeting',
+                               'The meeting is cancelled.')
+                send_msg(connection, recipient_email, msg)
+        time.sleep(0.1)
+
+        # check they both went to the mock smtp server
+        msgs = self.get_smtp_messages()
+        assert_equal(len(msgs), 2)
+        assert_equal([msg[2] for msg in msgs],
+                     [[recipient_email] for _, recipient_email in recipients])
+        expected_body = self.mime_encode('The meeting is cancelled.', 'Mary')
+        assert expected_body in msgs[1][3], '%r not in %r' % (expected_body, msgs[1][3])
+
     def test_mail_user_without_email(self):
         # send email
         test_email = {'recipient': model.User.by_name(u'mary'),
@@ -0,0 +1,46 @@
+from nose.tools import assert_equal
+
+import ckan.model as model
+import ckan.logic as logic
+import ckan.lib.package_cache as package_cache
+from ckan.lib.create_test_data import CreateTestData
+
+
+class TestPackageShowCache(object):
+
+    @classmethod
+    def setup_class(cls):
+        CreateTestData.create()
+
+    @classmethod
+    def teardown_class(cls):
+        model.repo.rebuild_db()
+
+    def _package_show(self, **context):
+        context.update({'model': model, 'session': model.Session,
+                        'user': 'testsysadmin'})
+        return logic.get_action('package_show')(context,
+                                                {'id': 'annakarenina'})
+
+    def test_cached(self):
+        package_cache.clear()
+        first = self._package_show()
+        hits = package_cache.stats()['hits']
+        second = self._package_show()
+        assert_equal(package_cache.stats()['hits'], hits + 1)
+        assert_equal(first, second)
+
+    def test_update_invalidates(self):
+        package_dict = self._package_show()
+        package_dict['title'] = u'A Novel By Tolstoy, Again'
+        logic.get_action('package_update')(
+            {'model': model, 'session': model.Session,
+             'user': 'testsysadmin'}, package_dict)
+        assert_equal(self._package_show()['title'],
+                     u'A Novel By Tolstoy, Again')
+
+    def test_revision_date_bypasses(self):
+        bypassed = package_cache.stats()['bypassed']
+        revision = model.Package.get('annakarenina').revision
+        self._package_show(revision_date=revision.timestamp)
+        assert_equal(package_cache.stats()['bypassed'], bypassed + 1)
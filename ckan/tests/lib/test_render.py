@@ -0,0 +1,65 @@
+import os
+import json
+import shutil
+import tempfile
+
+from nose.tools import assert_equal
+from pylons import config
+
+import ckan.lib.render as render
+
+
+class TestPrecompileTemplates(object):
+
+    @classmethod
+    def setup_class(cls):
+        cls.original_cache_dir = config.get('cache_dir')
+
+    @classmethod
+    def teardown_class(cls):
+        config['cache_dir'] = cls.original_cache_dir
+        render._template_info_cache.clear()
+
+    def setup(self):
+        self.cache_dir = tempfile.mkdtemp()
+        config['cache_dir'] = self.cache_dir
+        self.types_path = os.path.join(self.cache_dir, 'template_types.json')
+
+    def teardown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def _saved_types(self):
+        with open(self.types_path) as f:
+            return json.load(f)['templates']
+
+    def test_list_templates(self):
+        templates = render.list_templates()
+        assert_equal(templates['page.html'], render.find_template('page.html'))
+        assert_equal(templates['layout.html'],
+                     render.find_template('layout.html'))
+
+    def test_precompile_saves_template_types(self):
+        render.precompile_templates()
+        saved = self._saved_types()
+        for name in ('page.html', 'layout.html'):
+            path = render.find_template(name)
+            assert_equal(saved[name]['template_path'], path)
+            assert_equal(saved[name]['template_type'],
+                         render.template_type(path))
+
+    def test_precompile_reuses_saved_template_types(self):
+        render.precompile_templates()
+        with open(self.types_path) as f:
+            saved = json.load(f)
+        saved['templates']['page.html']['template_type'] = 'genshi'
+        saved['templates']['layout.html']['mtime'] = 0
+        with open(self.types_path, 'w') as f:
+            json.dump(saved, f)
+
+        render.precompile_templates()
+        saved = self._saved_types()
+        # page.html hasn't changed so it isn't looked at again, but
+        # layout.html has so its type is worked out again
+        assert_equal(saved['page.html']['template_type'], 'genshi')
+        assert_equal(saved['layout.html']['template_type'],
+                     render.template_type(render.find_template('layout.html')))
@@ -0,0 +1,107 @@
+from nose.tools import assert_equal
+from nose.plugins.skip import SkipTest
+from pylons import config
+
+import ckan.model as model
+import ckan.logic as logic
+import ckan.lib.replicas as replicas
+from ckan.lib.create_test_data import CreateTestData
+
+
+class TestReplicaRouting(object):
+
+    @classmethod
+    def setup_class(cls):
+        if model.engine_is_sqlite():
+            raise SkipTest('Read replicas need PostgreSQL')
+        CreateTestData.create()
+        # the primary database, read-only, stands in for a replica with no
+        # lag
+        url = config['sqlalchemy.url']
+        url += '&' if '?' in url else '?'
+        url += 'options=-c%20default_transaction_read_only%3Don'
+        config['ckan.db.replica_urls'] = '%s %s' % (
+            url, 'postgresql://nobody@127.0.0.1:1/none')
+        replicas.reset()
+
+    @classmethod
+    def teardown_class(cls):
+        del config['ckan.db.replica_urls']
+        replicas.reset()
+        model.repo.rebuild_db()
+
+    def setup(self):
+        model.Session.remove()
+        replicas.reset()
+
+    def _reads(self):
+        return sum(replica['reads'] for replica in replicas.stats())
+
+    def _call(self, action, data_dict, user='testsysadmin'):
+        context = {'model': model, 'session': model.Session, 'user': user}
+        return logic.get_action(action)(context, data_dict)
+
+    def test_unreachable_replica_not_used(self):
+        self._call('package_list', {})
+        stats = dict((replica['name'], replica) for replica in
+                     replicas.stats())
+        assert_equal(stats['127.0.0.1/none']['healthy'], False)
+        assert stats['127.0.0.1/none']['error']
+        assert_equal(stats['127.0.0.1/none']['reads'], 0)
+        assert_equal(stats['127.0.0.1/none']['lag'], None)
+
+    def test_side_effect_free_actions_read_replica(self):
+        reads = self._reads()
+        package = self._call('package_show', {'id': 'annakarenina'},
+                             user='annafan')
+        assert_equal(package['name'], 'annakarenina')
+        assert_equal(self._reads(), reads + 1)
+        assert model.Session().read_replica
+
+    def test_reads_after_write_use_primary(self):
+        package = self._call('package_show', {'id': 'warandpeace'})
+        reads = self._reads()
+        package['title'] = u'War and Peace, Again'
+        self._call('package_update', package)
+        self._call('package_show', {'id': 'warandpeace'})
+        assert_equal(self._reads(), reads)
+
+        # the writer's next requests still read from the primary
+        model.Session.remove()
+        self._call('package_show', {'id': 'warandpeace'})
+        assert_equal(self._reads(), reads)
+        # but other users' don't
+        self._call('package_show', {'id': 'warandpeace'}, user='annafan')
+        assert_equal(self._reads(), reads + 1)
+
+    def test_nested_reads_use_primary(self):
+        reads = self._reads()
+        # package_create calls package_show, which has to see the new dataset
+        package = self._call('package_create', {'name': 'replica-test'})
+        assert_equal(package['name'], 'replica-test')
+        assert_equal(self._reads(), reads)
+
+    def test_writes_of_routed_actions_use_primary(self):
+        # an action that's side-effect-free but writes, as
+        # dashboard_activity_list did when it made the user's dashboard
+        user = model.User(name=u'replica-writer')
+        model.Session.add(user)
+        model.Session.commit()
+        user_id = user.id
+        model.Session.remove()
+
+        def action(context, data_dict):
+            return model.Dashboard.get(user_id)
+        action.side_effect_free = True
+
+        reads = self._reads()
+        context = {'model': model, 'session': model.Session,
+                   'user': 'replica-writer'}
+        with replicas.route(action, context):
+            action(context, {})
+        assert_equal(self._reads(), reads + 1)
+        assert replicas.wrote_recently('replica-writer')
+
+        model.Session.remove()
+        assert_equal(model.Session.query(model.Dashboard).filter_by(
+            user_id=user_id).count(), 1)
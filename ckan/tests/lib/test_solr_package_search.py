@@ -35,6 +35,29 @@ class TestQuery:
 
         assert_raises(search.SearchError, convert, {'tags': {'tolstoy':1}})
 
+    def test_2_cursor_sort_and_filter(self):
+        from ckan.lib.search.query import (_cursor_sort_and_filter,
+                                           _encode_cursor)
+        assert_equal(_cursor_sort_and_filter('*', None), ('id asc', None))
+        assert_equal(_cursor_sort_and_filter('*', 'name  desc'),
+                     ('name desc', None))
+        cursor = _encode_cursor('name asc', u'war"and')
+        assert_equal(_cursor_sort_and_filter(cursor, None),
+                     ('name asc', u'+name:{"war\\"and" TO *}'))
+        assert_raises(search.SearchQueryError, _cursor_sort_and_filter,
+                      '*', 'title asc')
+        assert_raises(search.SearchQueryError, _cursor_sort_and_filter,
+                      cursor, 'id asc')
+        assert_raises(search.SearchQueryError, _cursor_sort_and_filter,
+                      'not-a-cursor', None)
+
+    def test_2_has_extras(self):
+        from ckan.lib.search.query import _has_extras
+        assert _has_extras('*')
+        assert _has_extras('name, extras_department')
+        assert not _has_extras('id data_dict')
+        assert not _has_extras('name')
+
 class TestSearch(TestController):
     # 'penguin' is in all test search packages
     q_all = u'penguin'
@@ -217,6 +240,38 @@ class TestSearch(TestController):
         assert len(pkgs) == 2, pkgs
         assert pkgs == all_pkgs[4:6]
 
+    def test_cursor_pagination(self):
+        all_pkgs = search.query_for(model.Package).run(
+            {'q': self.q_all, 'sort': 'name desc', 'rows': 100})['results']
+        pkgs = []
+        query = {'q': self.q_all, 'sort': 'name desc', 'rows': 4,
+                 'cursor': '*'}
+        while True:
+            result = search.query_for(model.Package).run(dict(query))
+            assert_equal(result['count'], len(all_pkgs) - len(pkgs))
+            pkgs.extend(result['results'])
+            if not result['next_cursor']:
+                break
+            query['cursor'] = result['next_cursor']
+        assert_equal(pkgs, all_pkgs)
+
+        assert_raises(search.SearchQueryError,
+                      search.query_for(model.Package).run,
+                      {'q': self.q_all, 'cursor': '*', 'start': 2})
+
+    def test_pagination_without_extra_row(self):
+        from pylons import config
+        all_pkgs = search.query_for(model.Package).run(
+            {'q': self.q_all})['results']
+        config['search.extra_row_workaround'] = 'false'
+        try:
+            result = search.query_for(model.Package).run(
+                {'q': self.q_all, 'rows': 2, 'start': 2})
+        finally:
+            del config['search.extra_row_workaround']
+        assert result['results'] == all_pkgs[2:4], result['results']
+        assert result['count'] == len(all_pkgs), result['count']
+
     def test_order_by(self):
         # TODO: fix this test
         #
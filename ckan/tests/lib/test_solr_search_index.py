@@ -5,6 +5,7 @@ import solr
 from pylons import config
 from ckan import model
 import ckan.lib.search as search
+import ckan.logic as logic
 from ckan.tests import TestController, CreateTestData, setup_test_search_index, is_search_supported
 
 class TestSolrConfig(TestController):
@@ -127,6 +128,66 @@ class TestSolrSearchIndex(TestController):
         assert response.results[0]['title'] == u'\u00c3altimo n\u00famero penguin'
 
 
+class TestTagIndex(TestController):
+    @classmethod
+    def setup_class(cls):
+        setup_test_search_index()
+        CreateTestData.create()
+        cls.solr = search.make_connection()
+        cls.fq = ' +site_id:"%s" +entity_type:tag ' % config['ckan.site_id']
+
+    @classmethod
+    def teardown_class(cls):
+        model.repo.rebuild_db()
+        cls.solr.close()
+
+    def setup(self):
+        search.rebuild()
+
+    def teardown(self):
+        search.index_for('Package').clear()
+
+    def _tag_indexed(self, name):
+        return len(self.solr.query('name:"%s"' % name, fq=self.fq)) == 1
+
+    def _without_tag(self, package_name, tag_name):
+        context = {'model': model, 'ignore_auth': True, 'validate': False}
+        pkg_dict = logic.get_action('package_show')(context,
+                                                    {'id': package_name})
+        pkg_dict['tags'] = [tag for tag in pkg_dict['tags']
+                            if tag['name'] != tag_name]
+        return pkg_dict
+
+    def test_concurrent_edits_removing_shared_tag(self):
+        # Two edits remove a tag that both datasets have, each indexed
+        # before the other's change is in the database.
+        package_index = search.index_for('Package')
+        package_index.update_dict(self._without_tag('annakarenina',
+                                                    'russian'))
+        package_index.update_dict(self._without_tag('warandpeace',
+                                                    'russian'))
+        assert self._tag_indexed('russian')
+
+        assert search.reconcile_tags() == (0, 1)
+        assert not self._tag_indexed('russian')
+        assert self._tag_indexed('tolstoy')
+
+    def test_concurrent_edits_one_keeping_shared_tag(self):
+        package_index = search.index_for('Package')
+        package_index.update_dict(self._without_tag('annakarenina',
+                                                    'russian'))
+        package_index.update_dict(self._without_tag('warandpeace',
+                                                    'tolstoy'))
+        assert search.reconcile_tags() == (0, 0)
+        assert self._tag_indexed('russian')
+
+    def test_missing_tag_added(self):
+        self.solr.delete_query('+name:"tolstoy"' + self.fq)
+        self.solr.commit()
+        assert search.reconcile_tags() == (1, 0)
+        assert self._tag_indexed('tolstoy')
+
+
 class TestSolrSearch:
     @classmethod
     def setup_class(cls):
@@ -147,9 +208,20 @@ class TestSolrSearch:
         Make sure that all packages created by CreateTestData.create_search_test_data
         have been added to the search index.
         """
-        results = self.solr.query('*:*', fq=self.fq)
+        results = self.solr.query('*:*', fq=self.fq + '+entity_type:package')
         assert len(results) == 6, len(results)
 
+    def test_0_resources_and_tags_indexed(self):
+        results = self.solr.query('*:*', fq=self.fq + '+entity_type:resource')
+        assert len(results) == model.Session.query(model.Resource) \
+            .filter_by(state='active').count(), len(results)
+        results = self.solr.query('name:penguin',
+                                  fq=self.fq + '+entity_type:tag')
+        assert len(results) == 1, len(results)
+        results = self.solr.query('name:russian',
+                                  fq=self.fq + '+entity_type:tag')
+        assert len(results) == 0, len(results)
+
     def test_1_basic(self):
         results = self.solr.query('sweden', fq=self.fq)
         assert len(results) == 2
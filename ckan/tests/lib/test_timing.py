@@ -0,0 +1,75 @@
+from nose.tools import assert_equal
+
+import ckan.lib.timing as timing
+from ckan.config.middleware import TimingMiddleware
+
+
+class TestTiming(object):
+
+    def teardown(self):
+        timing.stop()
+
+    def test_timer_outside_request(self):
+        assert timing.current() is None
+        with timing.timer('sql'):
+            pass
+        assert timing.current() is None
+
+    def test_timers(self):
+        timings = timing.start()
+        with timing.timer('action'):
+            with timing.timer('action'):
+                with timing.timer('auth'):
+                    pass
+        timings.add('sql', 0.002)
+        timings.add('sql', 0.003)
+        assert timing.stop() is timings
+        assert timing.current() is None
+
+        assert_equal(timings.timers['action'][0], 2)
+        assert_equal(timings.timers['auth'][0], 1)
+        assert timings.timers['action'][1] >= timings.timers['auth'][1]
+        assert_equal(timings.timers['sql'][0], 2)
+        count, milliseconds = timings.as_dict()['sql']
+        assert_equal(count, 2)
+        assert abs(milliseconds - 5.0) < 0.001
+
+    def test_header(self):
+        timings = timing.start()
+        timings.add('solr', 0.0084)
+        timings.add('sql', 0.0351)
+        header = timings.header()
+        assert header.startswith('total=')
+        assert header.endswith('; sql=1/35.1ms; solr=1/8.4ms'), header
+
+    def test_timed(self):
+        timings = timing.start()
+        double = timing.timed('solr', lambda x: x * 2)
+        assert_equal(double(2), 4)
+        assert_equal(timings.timers['solr'][0], 1)
+
+
+class TestTimingMiddleware(object):
+
+    def test_streamed_response(self):
+        def app(environ, start_response):
+            start_response('200 OK', [])
+
+            def body():
+                yield 'a'
+                # made while the body is streamed
+                timing.current().add('sql', 0.001)
+                yield 'b'
+            return body()
+
+        environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': '/'}
+        def start_response(status, headers, exc_info=None):
+            pass
+        app_iter = TimingMiddleware(app, {})(environ, start_response)
+        timings = environ['ckan.timings']
+        assert timing.current() is timings
+        assert_equal(''.join(app_iter), 'ab')
+        app_iter.close()
+        assert timing.current() is None
+        assert_equal(timings.timers['sql'][0], 1)
+        assert timings.end is not None
@@ -8,6 +8,7 @@ from pylons import config
 import ckan
 from ckan.lib.create_test_data import CreateTestData
 from ckan.lib.dictization.model_dictize import resource_dictize
+from ckan.lib.dictization.model_dictize import package_dictize
 import ckan.model as model
 from ckan.tests import WsgiAppCase
 from ckan.tests.functional.api import assert_dicts_equal_ignoring_ordering
@@ -66,6 +67,34 @@ class TestAction(WsgiAppCase):
         assert res['help'].startswith(
             "Return a list of the names of the site's datasets (packages).")
 
+    def test_01_package_list_paging(self):
+        context = {'model': model, 'session': model.Session}
+        package_list = get_action('package_list')
+        assert_equal(package_list(context, {'limit': 1}), ['annakarenina'])
+        assert_equal(package_list(context, {'limit': 1, 'offset': 1}),
+                     ['warandpeace'])
+        assert_equal(package_list(context, {'offset': 2}), [])
+        assert_equal(package_list(context, {'since': '9999-01-01'}), [])
+        assert_raises(ckan.logic.ParameterError, package_list, context,
+                      {'limit': 'a'})
+
+    def test_01_package_list_etag(self):
+        res = self.app.get('/api/action/package_list')
+        etag = res.headers['ETag']
+        res = self.app.get('/api/action/package_list',
+                           headers={'If-None-Match': etag}, status=304)
+
+    def test_01_current_package_list_with_resources(self):
+        context = {'model': model, 'session': model.Session}
+        package_dicts = get_action('current_package_list_with_resources')(
+            context, {'limit': 10})
+        assert_equal(len(package_dicts), 2)
+        for package_dict in package_dicts:
+            expected = package_dictize(model.Package.get(package_dict['id']),
+                                       {'model': model,
+                                        'session': model.Session})
+            assert_equal(package_dict, expected)
+
     def test_01_package_show(self):
         anna_id = model.Package.by_name(u'annakarenina').id
         postparams = '%s=1' % json.dumps({'id': anna_id})
@@ -337,6 +366,39 @@ class TestAction(WsgiAppCase):
         assert res_obj['error'] == { '__type': 'Validation Error',
                 'password': ['Your password must be 4 characters or longer']}
 
+    def test_12_package_update_unchanged(self):
+        context = {'model': model, 'session': model.Session,
+                   'user': self.sysadmin_user.name}
+        package = get_action('package_show')(context, {'id': 'annakarenina'})
+        revisions = model.Session.query(model.Revision).count()
+
+        context['skip_unchanged'] = True
+        updated = get_action('package_update')(context, package)
+        assert context['package_unchanged']
+        assert_equal(updated['revision_id'], package['revision_id'])
+        assert_equal(model.Session.query(model.Revision).count(), revisions)
+
+    def test_12_package_update_unchanged_keeps_pending_changes(self):
+        for defer_commit in (True, False):
+            context = {'model': model, 'session': model.Session,
+                       'user': self.sysadmin_user.name}
+            package = get_action('package_show')(context,
+                                                 {'id': 'annakarenina'})
+            revisions = model.Session.query(model.Revision).count()
+
+            # a change of the caller's, pending in the same session
+            vocab_name = u'unchanged-%s' % defer_commit
+            model.Session.add(model.Vocabulary(vocab_name))
+            context.update({'skip_unchanged': True,
+                            'defer_commit': defer_commit})
+            get_action('package_update')(context, package)
+            assert context['package_unchanged']
+            model.repo.commit()
+
+            assert model.Vocabulary.get(vocab_name) is not None
+            assert_equal(model.Session.query(model.Revision).count(),
+                         revisions)
+
     def test_12_user_update(self):
         normal_user_dict = {'id': self.normal_user.id,
                             'name': self.normal_user.name,
@@ -516,6 +578,17 @@ class TestAction(WsgiAppCase):
         assert res_obj['help'].startswith('Return the details of a group.')
         assert res_obj['success'] is False
 
+    def test_14_group_show_paged(self):
+        postparams = '%s=1' % json.dumps({'id': 'david',
+                                          'packages_limit': 1,
+                                          'packages_offset': 1,
+                                          'include_users': False})
+        res = self.app.post('/api/action/group_show', params=postparams)
+        result = json.loads(res.body)['result']
+        assert_equal(result['package_count'], 2)
+        assert_equal([p['name'] for p in result['packages']], ['warandpeace'])
+        assert 'users' not in result
+
     def test_16_user_autocomplete(self):
         #Empty query
         postparams = '%s=1' % json.dumps({})
@@ -818,6 +891,24 @@ class TestAction(WsgiAppCase):
         assert_equal(status['ckan_version'], ckan.__version__)
         assert_equal(status['site_url'], 'http://test.ckan.net')
 
+    def test_30_status_show_internals_for_sysadmins(self):
+        postparams = '%s=1' % json.dumps({})
+        res = self.app.post('/api/action/status_show', params=postparams)
+        status = json.loads(res.body)['result']
+        assert 'read_replicas' not in status
+        assert 'db_pools' not in status
+        res = self.app.post('/api/action/status_show', params=postparams,
+                extra_environ={'Authorization': str(self.normal_user.apikey)})
+        status = json.loads(res.body)['result']
+        assert 'read_replicas' not in status
+        assert 'db_pools' not in status
+        res = self.app.post('/api/action/status_show', params=postparams,
+                extra_environ={'Authorization':
+                               str(self.sysadmin_user.apikey)})
+        status = json.loads(res.body)['result']
+        assert_equal(status['read_replicas'], [])
+        assert 'db_pools' in status
+
     def test_31_bad_request_format(self):
         postparams = '%s=1' % json.dumps('not a dict')
         res = self.app.post('/api/action/package_list', params=postparams,
@@ -1,5 +1,13 @@
-from ckan.model.license import LicenseRegister
 import datetime
+import os
+import shutil
+import tempfile
+
+import simplejson as json
+from nose.tools import assert_equal
+from pylons import config
+
+from ckan.model.license import LicenseRegister
 
 class TestCase(object):
 
@@ -37,3 +45,45 @@ class TestLicense(TestCase):
             self.assert_unicode(license.title)
             self.assert_unicode(license.url)
 
+
+    def test_get_missing(self):
+        assert self.licenses.get('not-a-license') is None
+        try:
+            self.licenses['not-a-license']
+        except KeyError:
+            pass
+        else:
+            assert False, 'Expected a KeyError'
+
+
+class TestLicenseRegisterCache(TestCase):
+
+    def setup(self):
+        self.dir = tempfile.mkdtemp()
+        self.licenses_path = os.path.join(self.dir, 'licenses.json')
+        with open(self.licenses_path, 'w') as licenses_file:
+            json.dump([{'id': 'test-license', 'title': 'Test License',
+                        'url': ''}], licenses_file)
+        self.old_config = dict(config)
+        config['cache_dir'] = self.dir
+        config['licenses_group_url'] = 'file://' + self.licenses_path
+        config['ckan.licenses_refresh_interval'] = '0'
+
+    def teardown(self):
+        config.clear()
+        config.update(self.old_config)
+        shutil.rmtree(self.dir)
+
+    def test_cached_copy_used_when_unreachable(self):
+        assert_equal(LicenseRegister().keys(), [u'test-license'])
+        os.remove(self.licenses_path)
+        licenses = LicenseRegister()
+        assert_equal(licenses.keys(), [u'test-license'])
+        self.assert_unicode(licenses['test-license'].title)
+
+    def test_refresh_started_by_first_read(self):
+        config['ckan.licenses_refresh_interval'] = '3600'
+        licenses = LicenseRegister()
+        assert licenses._refresh_pid is None
+        licenses['test-license']
+        assert_equal(licenses._refresh_pid, os.getpid())
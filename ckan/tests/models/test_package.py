@@ -180,6 +180,20 @@ class TestPackage:
         assert package.metadata_modified == modified_timestamp
         last_modified_timestamp = modified_timestamp
 
+        # update a package's resource
+        rev = model.repo.new_revision()
+        package = model.Package.by_name(name)
+        package.resource_groups_all[0].resources_all.append(
+            model.Resource(url=u'http://example.com/data.csv'))
+        modified_timestamp = model.Session().revision.timestamp
+        assert modified_timestamp != last_modified_timestamp
+        model.repo.commit_and_remove()
+
+        package = model.Package.by_name(name)
+        assert package.metadata_created == created_timestamp
+        assert package.metadata_modified == modified_timestamp
+        last_modified_timestamp = modified_timestamp
+
         # update a package's group - NB no change this time
         rev = model.repo.new_revision()
         group = model.Group.by_name('roger')
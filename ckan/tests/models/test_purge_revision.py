@@ -84,3 +84,21 @@ class TestRevisionPurge:
         pkg = model.Package.by_name(self.pkgname)
         assert len(pkg.all_revisions) == 1
 
+    def test_purge_revisions(self):
+        pkg_id = model.Package.by_name(self.pkgname).id
+        revisions = model.repo.history() \
+            .order_by(model.Revision.timestamp.desc()).limit(2).all()
+        model.repo.purge_revisions([rev.id for rev in revisions])
+
+        assert model.Package.by_name(self.pkgname2) is None
+        assert model.Session.query(model.Package).get(pkg_id) is None
+        assert model.Session.query(model.PackageRevision) \
+            .filter_by(id=pkg_id).count() == 0
+        # Recreate the package for teardown.
+        self.setup()
+
+    def test_purge_no_revisions(self):
+        num_revisions = model.repo.history().count()
+        model.repo.purge_revisions([])
+        assert model.repo.history().count() == num_revisions
+        assert model.Package.by_name(self.pkgname) is not None
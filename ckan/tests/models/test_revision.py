@@ -42,3 +42,35 @@ class TestRevision:
         assert_equal(rev_dict['message'], self.rev.message)
         assert_equal(rev_dict['packages'], [u'testpkg'])
         
+
+
+class TestCompactRevisions:
+    @classmethod
+    def setup_class(cls):
+        rev = model.repo.new_revision()
+        rev.timestamp = datetime.datetime(2000, 1, 1)
+        model.Session.add(model.Package(name=u'compactpkg', url=u'a.com'))
+        model.repo.commit_and_remove()
+
+        rev = model.repo.new_revision()
+        rev.timestamp = datetime.datetime(2000, 1, 2)
+        model.Package.by_name(u'compactpkg').url = u'b.com'
+        model.repo.commit_and_remove()
+
+    @classmethod
+    def teardown_class(cls):
+        model.repo.rebuild_db()
+
+    def _package_revisions(self):
+        pkg = model.Package.by_name(u'compactpkg')
+        return model.Session.query(model.PackageRevision) \
+            .filter_by(id=pkg.id).all()
+
+    def test_compact_revisions(self):
+        assert_equal(len(self._package_revisions()), 2)
+        removed = model.repo.compact_revisions(datetime.datetime(2001, 1, 1))
+        assert_equal(removed['package_revision'], 1)
+        revisions = self._package_revisions()
+        assert_equal(len(revisions), 1)
+        assert revisions[0].current
+        assert_equal(model.Package.by_name(u'compactpkg').url, u'b.com')
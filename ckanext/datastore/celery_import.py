@@ -0,0 +1,2 @@
+def task_imports():
+    return ['ckanext.datastore.tasks']
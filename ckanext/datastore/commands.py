@@ -1,5 +1,7 @@
 import bin.datastore_setup as setup
 import logging
+import sys
+import time
 
 import ckan.lib.cli as cli
 
@@ -13,6 +15,9 @@ class SetupDatastoreCommand(cli.CkanCommand):
     Usage::
 
         paster datastore set-permissions SQL_SUPER_USER
+        paster datastore load RESOURCE_ID CSV_FILE [--workers=N]
+                              [--chunk-size=N] [--sample-size=N]
+                              [--encoding=ENCODING]
 
     Where:
         SQL_SUPER_USER is the name of a postgres user with sufficient
@@ -20,6 +25,12 @@ class SetupDatastoreCommand(cli.CkanCommand):
                          and revoke new permissions.  Typically, this would
                          be the "postgres" user.
 
+    load streams the rows of a CSV file with a header row into the
+    resource's DataStore table, creating it if needed with the column types
+    guessed from the first --sample-size rows (default: 1000). The rows are
+    inserted in chunks of --chunk-size rows (default: 5000) by --workers
+    processes (default: 1), and the rows per second are reported.
+
     '''
     summary = __doc__.split('\n')[0]
     usage = __doc__
@@ -28,6 +39,16 @@ class SetupDatastoreCommand(cli.CkanCommand):
 
         super(SetupDatastoreCommand, self).__init__(name)
 
+        self.parser.add_option('--workers', dest='workers', type='int',
+            default=1, help='Number of processes that insert rows (load)')
+        self.parser.add_option('--chunk-size', dest='chunk_size', type='int',
+            default=5000, help='Number of rows inserted at a time (load)')
+        self.parser.add_option('--sample-size', dest='sample_size',
+            type='int', default=1000,
+            help='Number of rows the column types are guessed from (load)')
+        self.parser.add_option('--encoding', dest='encoding',
+            default='utf-8', help='Encoding of the CSV file (load)')
+
     def command(self):
         '''
         Parse command line arguments and call appropriate method.
@@ -39,6 +60,13 @@ class SetupDatastoreCommand(cli.CkanCommand):
         cmd = self.args[0]
         self._load_config()
 
+        if cmd == 'load':
+            if len(self.args) != 3:
+                print self.usage
+                return
+            self.load(self.args[1], self.args[2])
+            return
+
         self.db_write_url_parts = cli.parse_db_config('ckan.datastore.write_url')
         self.db_read_url_parts = cli.parse_db_config('ckan.datastore.read_url')
         self.db_ckan_url_parts = cli.parse_db_config('sqlalchemy.url')
@@ -65,3 +93,33 @@ class SetupDatastoreCommand(cli.CkanCommand):
             print self.usage
             log.error('Command "%s" not recognized' % (cmd,))
             return
+
+    def load(self, resource_id, path):
+        import pylons
+        import ckan.model as model
+        import ckanext.datastore.loader as loader
+
+        if not model.Resource.get(resource_id):
+            print 'Resource "%s" was not found' % resource_id
+            sys.exit(1)
+
+        def progress(loaded, seconds):
+            if self.verbose:
+                print '%i rows loaded' % loaded
+
+        start = time.time()
+        try:
+            with open(path, 'rb') as f:
+                loaded = loader.load_csv(
+                    f, resource_id, pylons.config['ckan.datastore.write_url'],
+                    encoding=self.options.encoding,
+                    sample_size=self.options.sample_size,
+                    chunk_size=self.options.chunk_size,
+                    workers=self.options.workers,
+                    progress=progress)
+        except (IOError, loader.LoadError), e:
+            print 'Load failed: %s' % e
+            sys.exit(1)
+        seconds = time.time() - start
+        print 'Loaded %i rows in %.1f seconds (%i rows/second)' % (
+            loaded, seconds, loaded / seconds if seconds else loaded)
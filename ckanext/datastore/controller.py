@@ -0,0 +1,129 @@
+import csv
+import json
+import StringIO
+import zlib
+
+import pylons
+
+import ckan.lib.base as base
+import ckan.logic as logic
+import ckan.model as model
+import ckan.plugins as p
+import ckanext.datastore.db as db
+
+# format -> content type
+DUMP_FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'tsv': 'text/tab-separated-values; charset=utf-8',
+    'jsonl': 'application/x-ndjson; charset=utf-8',
+}
+
+# rows per chunk of the response
+CHUNK_ROWS = 500
+
+
+def _csv_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, (list, dict)):
+        value = json.dumps(value)
+    elif not isinstance(value, basestring):
+        value = unicode(value)
+    return value.encode('utf-8')
+
+
+def _csv_chunks(fields, rows, dialect):
+    buf = StringIO.StringIO()
+    writer = csv.writer(buf, dialect=dialect)
+    writer.writerow([_csv_value(field['id']) for field in fields])
+    for num, row in enumerate(rows):
+        writer.writerow([_csv_value(value) for value in row])
+        if num % CHUNK_ROWS == CHUNK_ROWS - 1:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+    yield buf.getvalue()
+
+
+def _jsonl_chunks(fields, rows):
+    field_ids = [field['id'] for field in fields]
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(dict(zip(field_ids, row))))
+        if len(lines) == CHUNK_ROWS:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+
+def _gzip_chunks(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def dump_chunks(fields, rows, format):
+    '''Return an iterator over the chunks of a dump of the rows in
+    `format`.'''
+    if format == 'csv':
+        return _csv_chunks(fields, rows, csv.excel)
+    elif format == 'tsv':
+        return _csv_chunks(fields, rows, csv.excel_tab)
+    return _jsonl_chunks(fields, rows)
+
+
+class DatastoreController(base.BaseController):
+
+    def dump(self, resource_id):
+        '''Stream all of a resource's rows, or the ones that match the
+        filters (JSON) and q parameters, as CSV (the default), TSV or JSON
+        lines (format=csv|tsv|jsonl). The fields and sort parameters work
+        like in datastore_search. The response is gzipped if the client
+        accepts it.'''
+        request = base.request
+        format = request.params.get('format', 'csv')
+        if format not in DUMP_FORMATS:
+            base.abort(400, p.toolkit._('Format must be one of: {0}').format(
+                ', '.join(sorted(DUMP_FORMATS))))
+
+        context = {'model': model, 'session': model.Session,
+                   'user': base.c.user or base.c.author}
+        data_dict = {
+            'resource_id': resource_id,
+            'connection_url': pylons.config.get(
+                'ckan.datastore.read_url',
+                pylons.config['ckan.datastore.write_url']),
+        }
+        for param in ('q', 'plain', 'language', 'fields', 'sort'):
+            if param in request.params:
+                data_dict[param] = request.params[param]
+        try:
+            if 'filters' in request.params:
+                data_dict['filters'] = json.loads(request.params['filters'])
+        except ValueError:
+            base.abort(400, p.toolkit._('filters must be a JSON object'))
+
+        if not db.resource_exists(data_dict):
+            base.abort(404, p.toolkit._('Resource "{0}" was not found.').format(
+                resource_id))
+        try:
+            p.toolkit.check_access('datastore_search', context, data_dict)
+            fields, rows = db.dump(context, data_dict)
+        except logic.NotAuthorized:
+            base.abort(401, p.toolkit._('Not authorized to read resource {0}')
+                       .format(resource_id))
+        except logic.ValidationError, e:
+            base.abort(409, json.dumps(e.error_dict))
+
+        chunks = dump_chunks(fields, rows, format)
+        base.response.headers['Content-Type'] = DUMP_FORMATS[format]
+        base.response.headers['Content-Disposition'] = \
+            'attachment; filename="{0}.{1}"'.format(resource_id, format)
+        if 'gzip' in request.headers.get('Accept-Encoding', ''):
+            base.response.headers['Content-Encoding'] = 'gzip'
+            chunks = _gzip_chunks(chunks)
+        return chunks
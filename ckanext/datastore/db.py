@@ -1,5 +1,6 @@
 import json
 import datetime
+import itertools
 import shlex
 import os
 import urllib
@@ -7,15 +8,19 @@ import urllib2
 import urlparse
 import logging
 import pprint
+import re
 import sqlalchemy
-from sqlalchemy.exc import ProgrammingError, IntegrityError
+from sqlalchemy.exc import ProgrammingError, IntegrityError, DBAPIError
 import psycopg2.extras
 
+import ckanext.datastore.search_cache as search_cache
+
 log = logging.getLogger(__name__)
 
 if not os.environ.get('DATASTORE_LOAD'):
     import paste.deploy.converters as converters
     import ckan.plugins.toolkit as toolkit
+    import ckan.lib.engines as engines
     ValidationError = toolkit.ValidationError
 else:
     log.warn("Running datastore without CKAN")
@@ -27,6 +32,11 @@ else:
 _pg_types = {}
 _type_names = set()
 _engines = {}
+# resource id or alias -> schema, see _get_schema()
+_table_schemas = {}
+_max_table_schemas = 1000
+# whether the "_table_version" table exists, None if not checked yet
+_version_table_exists = None
 
 _date_formats = ['%Y-%m-%d',
                 '%Y-%m-%d %H:%M:%S',
@@ -37,11 +47,40 @@ _date_formats = ['%Y-%m-%d',
                 '%d-%m-%Y',
                 '%m-%d-%Y',
                 ]
+
+# the number of records the types of new fields are guessed from
+_guess_sample_size = 1000
+_int4_max = 2 ** 31 - 1
+_int8_max = 2 ** 63 - 1
+
+
+def _column_pattern(value_pattern):
+    '''Return a regex that matches a column of values, one per line, that
+    each match value_pattern.'''
+    return re.compile(u'(?:[ \\t]*{0}[ \\t]*\\n)+\\Z'.format(value_pattern))
+
+
+def _date_column_pattern(format):
+    pattern = re.escape(format).replace('\\%', '%')
+    for directive in ('%Y', '%m', '%d', '%H', '%M', '%S'):
+        pattern = pattern.replace(
+            directive, r'\d{4}' if directive == '%Y' else r'\d{1,2}')
+    return _column_pattern(pattern)
+
+
+_integer_column = _column_pattern(r'[+-]?\d+')
+_numeric_column = _column_pattern(
+    r'[+-]?(?:\d+(?:\.\d*)?|\.\d+)(?:[eE][+-]?\d+)?')
+_date_columns = [(format, _date_column_pattern(format))
+                 for format in _date_formats]
+
 INSERT = 'insert'
 UPSERT = 'upsert'
 UPDATE = 'update'
 _methods = [INSERT, UPSERT, UPDATE]
 
+RECORDS_FORMATS = ['objects', 'lists', 'columns']
+
 
 def _strip(input):
     if isinstance(input, basestring) and len(input) and input[0] == input[-1]:
@@ -109,7 +148,10 @@ def _get_engine(context, data_dict):
     engine = _engines.get(connection_url)
 
     if not engine:
-        engine = sqlalchemy.create_engine(connection_url)
+        if os.environ.get('DATASTORE_LOAD'):
+            engine = sqlalchemy.create_engine(connection_url)
+        else:
+            engine = engines.get_engine('datastore', connection_url)
         _engines[connection_url] = engine
     return engine
 
@@ -184,49 +226,263 @@ def _rename_field(data_dict, term, replace):
     return data_dict
 
 
-def _guess_type(field):
-    'Simple guess type of field, only allowed are integer, numeric and text'
-    data_types = set([int, float])
-    if isinstance(field, (dict, list)):
+def _integer_type(values, integer):
+    '''Return `integer`, or bigint or numeric if some of the integers
+    `values` are too big for it.'''
+    largest = max(abs(int(value)) for value in values)
+    if largest > _int8_max:
+        return 'numeric'
+    return 'bigint' if largest > _int4_max else integer
+
+
+def _guess_column_type(values):
+    '''Guess the type of a column from a sample of its values.
+
+    Strings are checked a whole column at a time, with one regular
+    expression match of all of them, rather than by trying to convert each
+    one. Integers, JSON or strings, too big for an integer column make it a
+    bigint or numeric one.'''
+    values = [value for value in values if value is not None and value != '']
+    if not values:
+        return 'text'
+    python_types = set(type(value) for value in values)
+    if python_types & set([dict, list]):
         return 'nested'
-    if isinstance(field, int):
-        return 'int'
-    if isinstance(field, float):
+    if python_types <= set([int, long, bool]):
+        return _integer_type(values, 'int')
+    if python_types <= set([int, long, bool, float]):
         return 'float'
-    for data_type in list(data_types):
-        try:
-            data_type(field)
-        except (TypeError, ValueError):
-            data_types.discard(data_type)
-            if not data_types:
-                break
-    if int in data_types:
-        return 'integer'
-    elif float in data_types:
-        return 'numeric'
 
-    ##try iso dates
-    for format in _date_formats:
-        try:
-            datetime.datetime.strptime(field, format)
+    try:
+        column = u'\n'.join(unicode(value) for value in values) + u'\n'
+    except UnicodeDecodeError:
+        return 'text'
+    if _integer_column.match(column):
+        return _integer_type(values, 'integer')
+    if _numeric_column.match(column):
+        return 'numeric'
+    for format, pattern in _date_columns:
+        if pattern.match(column):
+            try:
+                for value in values:
+                    datetime.datetime.strptime(value.strip(), format)
+            except ValueError:
+                continue
             return 'timestamp'
-        except (ValueError, TypeError):
-            continue
     return 'text'
 
 
+def _guess_field_type(records, field_id):
+    '''Guess the type of a field from its values in the first records.'''
+    return _guess_column_type([record.get(field_id)
+                               for record in records[:_guess_sample_size]
+                               if isinstance(record, dict)])
+
+
 def _get_fields(context, data_dict):
-    fields = []
-    all_fields = context['connection'].execute(
-        u'SELECT * FROM "{0}" LIMIT 1'.format(data_dict['resource_id'])
+    schema = _get_schema(context, data_dict['resource_id'])
+    return [dict(field) for field in schema['fields']]
+
+
+def _create_version_table(connection):
+    '''Create the "_table_version" table if it doesn't exist.
+
+    It holds a version for each table and alias, the id of the last
+    transaction that changed its columns, indexes or rows, so that all
+    processes know that their cached schema of it, and their cached search
+    results, are out of date. Transaction ids are never used twice, even if
+    a table or this one is dropped and made again.
+    '''
+    global _version_table_exists
+    result = connection.execute(
+        u"SELECT 1 FROM pg_tables WHERE tablename = '_table_version'"
+    ).fetchone()
+    if not result:
+        connection.execute(u'''CREATE TABLE "_table_version" (
+            name text PRIMARY KEY, version bigint NOT NULL)''')
+    _version_table_exists = True
+
+
+def _has_version_table(connection):
+    global _version_table_exists
+    if _version_table_exists is None:
+        _version_table_exists = bool(connection.execute(
+            u"SELECT 1 FROM pg_tables WHERE tablename = '_table_version'"
+        ).fetchone())
+    return _version_table_exists
+
+
+def _get_table_version(connection, name):
+    '''Return the version of the table or alias `name`, or None if the
+    versions aren't kept.'''
+    global _version_table_exists
+    if not _has_version_table(connection):
+        return None
+    try:
+        result = connection.execute(
+            u'SELECT version FROM "_table_version" WHERE name = %s', name
+        ).fetchone()
+    except ProgrammingError:
+        # the table has been dropped since, check again next time
+        _version_table_exists = None
+        return None
+    return result[0] if result else 0
+
+
+def _bump_table_version(context, name):
+    '''Change the version of the table or alias `name`, so that the
+    cached schemas of it are not used any more. Must be called in the
+    transaction that changes it, after _create_version_table() and before
+    the changes.'''
+    connection = context['connection']
+    result = connection.execute(
+        u'UPDATE "_table_version" SET version = txid_current() '
+        u'WHERE name = %s', name)
+    if not result.rowcount:
+        connection.execute(u'INSERT INTO "_table_version" (name, version) '
+                           u'VALUES (%s, txid_current())', name)
+    context.setdefault('changed_tables', set()).add(name)
+
+
+def _bump_data_version(context, resource_id):
+    '''Change the versions of a table whose rows are being changed, and
+    of its aliases, so that cached search results of it are not used any
+    more. Must be called in the transaction that changes them.'''
+    _create_version_table(context['connection'])
+    for name in [resource_id] + _get_aliases(
+            context, {'resource_id': resource_id}):
+        _bump_table_version(context, name)
+
+
+def _plan_relations(plan, relations):
+    '''Add the (schema, name) of each relation scanned in an EXPLAIN plan
+    to the set `relations`.'''
+    if isinstance(plan, dict):
+        if 'Relation Name' in plan:
+            relations.add((plan.get('Schema'), plan['Relation Name']))
+        for value in plan.values():
+            _plan_relations(value, relations)
+    elif isinstance(plan, list):
+        for value in plan:
+            _plan_relations(value, relations)
+
+
+def _get_query_version(connection, sql):
+    '''Return the versions of the tables that the query `sql` reads, which
+    change with any committed change to one of them, or None if they can't
+    be known, e.g. if the query reads the system catalogs.
+
+    The tables are found by planning the query, which also resolves the
+    aliases to the tables they are of. A query that can't be
+    planned is rolled back to before the planning, so that it fails the
+    same way when it's run. Several statements are never cached, as
+    planning would run all but the first.'''
+    global _version_table_exists
+    if not _has_version_table(connection) or \
+            ';' in sql.strip().rstrip(';'):
+        return None
+    connection.execute(u'SAVEPOINT query_version')
+    try:
+        plan = connection.execute(
+            u'EXPLAIN (VERBOSE, FORMAT JSON) ' + sql).fetchone()[0]
+    except DBAPIError:
+        connection.execute(u'ROLLBACK TO SAVEPOINT query_version')
+        return None
+    connection.execute(u'RELEASE SAVEPOINT query_version')
+    if isinstance(plan, basestring):
+        plan = json.loads(plan)
+
+    relations = set()
+    _plan_relations(plan, relations)
+    if not relations or any(schema != 'public' for schema, name in relations):
+        return None
+    names = sorted(name for schema, name in relations)
+    try:
+        versions = dict(connection.execute(
+            u'SELECT name, version FROM "_table_version" '
+            u'WHERE name IN ({0})'.format(','.join(['%s'] * len(names))),
+            *names).fetchall())
+    except ProgrammingError:
+        _version_table_exists = None
+        return None
+    return [[name, versions.get(name, 0)] for name in names]
+
+
+def _forget_schemas(context):
+    '''Remove the tables changed by a committed transaction from this
+    process's schema cache.'''
+    for name in context.pop('changed_tables', []):
+        _table_schemas.pop(name, None)
+
+
+def _load_schema(context, name):
+    connection = context['connection']
+    schema = {'exists': False, 'is_alias': False,
+              'fields': [], 'unique_key': []}
+    result = connection.execute(u'''
+        SELECT c.relkind FROM pg_class c, pg_namespace n
+        WHERE n.oid = c.relnamespace AND n.nspname = 'public'
+            AND c.relkind IN ('r', 'v') AND c.relname = %s''', name
+    ).fetchone()
+    if not result:
+        return schema
+    schema['exists'] = True
+    schema['is_alias'] = result[0] == 'v'
+
+    all_fields = connection.execute(
+        u'SELECT * FROM "{0}" LIMIT 0'.format(name)
     )
     for field in all_fields.cursor.description:
         if not field[0].startswith('_'):
-            fields.append({
+            schema['fields'].append({
                 'id': field[0].decode('utf-8'),
                 'type': _get_type(context, field[1])
             })
-    return fields
+    all_fields.close()
+    if not schema['is_alias']:
+        schema['unique_key'] = _load_unique_key(context, name)
+    return schema
+
+
+def _get_schema(context, name):
+    '''Return whether the table or alias `name` exists, whether it is an
+    alias, its fields and its unique key.
+
+    The schema is cached in this process until the table's version changes,
+    so that a call usually only needs to look up the version, and for the
+    rest of the call in context['schemas']. The schemas of tables that are
+    being changed in the context's transaction are looked up each time.
+    '''
+    connection = context['connection']
+    if name in context.get('changed_tables', ()):
+        return _load_schema(context, name)
+    if name in context.get('schemas', {}):
+        return context['schemas'][name]
+
+    version = _get_table_version(connection, name)
+    schema = _table_schemas.get(name)
+    if schema is None or version is None or schema['version'] != version:
+        schema = _load_schema(context, name)
+        schema['version'] = version
+        if version is not None:
+            if len(_table_schemas) >= _max_table_schemas:
+                _table_schemas.clear()
+            _table_schemas[name] = schema
+    context.setdefault('schemas', {})[name] = schema
+    return schema
+
+
+def resource_exists(data_dict, alias=True):
+    '''Return whether there is a datastore table for
+    data_dict['resource_id'] or, if `alias` is True, an alias with that
+    name.'''
+    engine = _get_engine(None, data_dict)
+    context = {'connection': engine.connect()}
+    try:
+        schema = _get_schema(context, data_dict['resource_id'])
+    finally:
+        context['connection'].close()
+    return schema['exists'] and (alias or not schema['is_alias'])
 
 
 def json_get_values(obj, current_list=None):
@@ -272,6 +528,29 @@ def convert(data, type_name):
     return unicode(data)
 
 
+# types whose values come out of psycopg2 ready to be returned as they are
+_pass_through_types = frozenset(['int2', 'int4', 'float4', 'float8', 'bool',
+                                 'text', 'varchar', 'bpchar', 'name'])
+
+
+def _converter(type_name):
+    '''Return a function that converts the values of a column of type_name
+    like convert() does, or None if they need no converting. Picking it once
+    per column saves working out the type of every value.'''
+    if type_name in _pass_through_types:
+        return None
+    if type_name == 'nested':
+        return lambda data: None if data is None else json.loads(data[0])
+    # array type
+    if type_name.startswith('_'):
+        item_converter = _converter(type_name[1:])
+        if item_converter is None:
+            return lambda data: None if data is None else list(data)
+        return lambda data: None if data is None else \
+            [item_converter(item) for item in data]
+    return lambda data: convert(data, type_name)
+
+
 def create_table(context, data_dict):
     'Create table from combination of fields and first row of data.'
 
@@ -294,7 +573,7 @@ def create_table(context, data_dict):
                 raise ValidationError({
                     'fields': ['"{0}" type not guessable'.format(field['id'])]
                 })
-            field['type'] = _guess_type(records[0][field['id']])
+            field['type'] = _guess_field_type(records, field['id'])
 
     if records:
         # check record for sanity
@@ -307,7 +586,7 @@ def create_table(context, data_dict):
             if not field_id in field_ids:
                 extra_fields.append({
                     'id': field_id,
-                    'type': _guess_type(records[0][field_id])
+                    'type': _guess_field_type(records, field_id)
                 })
 
     fields = datastore_fields + supplied_fields + extra_fields
@@ -347,6 +626,7 @@ def create_alias(context, data_dict):
         # delete previous aliases
         previous_aliases = _get_aliases(context, data_dict)
         for alias in previous_aliases:
+            _bump_table_version(context, alias)
             sql_alias_drop_string = u'DROP VIEW "{0}"'.format(alias)
             context['connection'].execute(sql_alias_drop_string)
 
@@ -362,10 +642,17 @@ def create_alias(context, data_dict):
                     'alias': [(u'The alias "{0}" already exists.').format(alias)]
                 })
 
+            _bump_table_version(context, alias)
             context['connection'].execute(sql_alias_string)
 
 
 def create_indexes(context, data_dict):
+    map(context['connection'].execute, _index_statements(context, data_dict))
+
+
+def _index_statements(context, data_dict, concurrently=False):
+    '''Drop the indexes that data_dict's indexes or primary_key replace and
+    return the statements that create the new ones.'''
     indexes = _get_list(data_dict.get('indexes'))
     # primary key is not a real primary key
     # it's just a unique key
@@ -374,9 +661,9 @@ def create_indexes(context, data_dict):
     # index and primary key could be [],
     # which means that indexes should be deleted
     if indexes == None and primary_key == None:
-        return
+        return []
 
-    sql_index_skeletton = u'CREATE {unique} INDEX ON "{res_id}"'
+    sql_index_skeletton = u'CREATE {unique} INDEX {concurrently} ON "{res_id}"'
     sql_index_string_method = sql_index_skeletton + u' USING {method}({fields})'
     sql_index_string = sql_index_skeletton + u' ({fields})'
     sql_index_strings = []
@@ -391,6 +678,7 @@ def create_indexes(context, data_dict):
         # create index for faster full text search (indexes: gin or gist)
         sql_index_strings.append(sql_index_string_method.format(
             res_id=data_dict['resource_id'], unique='',
+            concurrently=concurrently and 'CONCURRENTLY' or '',
             method='gist', fields='_full_text'))
     else:
         indexes = []
@@ -418,9 +706,62 @@ def create_indexes(context, data_dict):
         sql_index_strings.append(sql_index_string.format(
                 res_id=data_dict['resource_id'],
                 unique='unique' if index == primary_key else '',
+                concurrently=concurrently and 'CONCURRENTLY' or '',
                 fields=fields_string))
 
-    map(context['connection'].execute, sql_index_strings)
+    return sql_index_strings
+
+
+def build_indexes(context, data_dict, statements, progress=None):
+    '''Run the CREATE INDEX CONCURRENTLY statements that create() left in
+    context['index_statements'] when it was called with
+    context['defer_indexes'].
+
+    The indexes are built one at a time, without a transaction or a timeout
+    and without locking the table against writes. progress(built, total) is
+    called before the first one and after each one. If one fails, the
+    invalid indexes it leaves behind are dropped.'''
+    engine = _get_engine(context, data_dict)
+    connection = engine.raw_connection()
+    total = len(statements)
+    try:
+        # CREATE INDEX CONCURRENTLY can't be run in a transaction
+        connection.set_isolation_level(
+            psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        cursor = connection.cursor()
+        if progress:
+            progress(0, total)
+        try:
+            for num, statement in enumerate(statements):
+                cursor.execute(statement.replace('%%', '%'))
+                if progress:
+                    progress(num + 1, total)
+        except psycopg2.Error:
+            _drop_invalid_indexes(cursor, data_dict['resource_id'])
+            raise
+    finally:
+        connection.set_isolation_level(
+            psycopg2.extensions.ISOLATION_LEVEL_READ_COMMITTED)
+        connection.close()
+
+    # the unique key is part of the cached schemas
+    context['connection'] = engine.connect()
+    try:
+        trans = context['connection'].begin()
+        _bump_table_version(context, data_dict['resource_id'])
+        trans.commit()
+        _forget_schemas(context)
+    finally:
+        context['connection'].close()
+
+
+def _drop_invalid_indexes(cursor, resource_id):
+    cursor.execute(u'''
+        SELECT i.relname FROM pg_class t, pg_class i, pg_index idx
+        WHERE t.oid = idx.indrelid AND i.oid = idx.indexrelid
+            AND NOT idx.indisvalid AND t.relname = %s''', (resource_id,))
+    for index in cursor.fetchall():
+        cursor.execute(u'DROP INDEX "{0}"'.format(index[0]))
 
 
 def _drop_indexes(context, data_dict, unique=False):
@@ -475,7 +816,7 @@ def alter_table(context, data_dict):
                 raise ValidationError({
                     'fields': ['"{0}" type not guessable'.format(field['id'])]
                 })
-            field['type'] = _guess_type(records[0][field['id']])
+            field['type'] = _guess_field_type(records, field['id'])
         new_fields.append(field)
 
     if records:
@@ -489,7 +830,7 @@ def alter_table(context, data_dict):
             if not field_id in field_ids:
                 new_fields.append({
                     'id': field_id,
-                    'type': _guess_type(records[0][field_id])
+                    'type': _guess_field_type(records, field_id)
                 })
 
     for field in new_fields:
@@ -630,6 +971,11 @@ def upsert_data(context, data_dict):
 
 
 def _get_unique_key(context, data_dict):
+    schema = _get_schema(context, data_dict['resource_id'])
+    return list(schema['unique_key'])
+
+
+def _load_unique_key(context, name):
     sql_get_unique_key = '''
     SELECT
         a.attname AS column_names
@@ -646,7 +992,7 @@ def _get_unique_key(context, data_dict):
         AND idx.indisprimary = false
         AND t.relname = %s
     '''
-    key_parts = context['connection'].execute(sql_get_unique_key, data_dict['resource_id'])
+    key_parts = context['connection'].execute(sql_get_unique_key, name)
     return [x[0] for x in key_parts]
 
 
@@ -817,6 +1163,7 @@ def delete_data(context, data_dict):
 
 
 def search_data(context, data_dict):
+    _records_format(data_dict)
     all_fields = _get_fields(context, data_dict)
     all_field_ids = _pluck('id', all_fields)
     all_field_ids.insert(0, '_id')
@@ -866,25 +1213,117 @@ def search_data(context, data_dict):
     return format_results(context, results, data_dict)
 
 
+def dump_data(context, data_dict):
+    '''Return the fields of the table (or the ones in data_dict['fields'])
+    and an iterator over all of its rows that match the filters and q of
+    data_dict, sorted by sort or else by _id.
+
+    The rows are read through a server-side cursor, so only a batch of
+    them is in memory at a time, and their values are converted like those
+    of format_results(). The connection is closed when the iterator is used
+    up or closed.'''
+    schema = _get_schema(context, data_dict['resource_id'])
+    if not schema['exists']:
+        raise ValidationError({
+            'resource_id': [u'table for resource "{0}" does not exist'.format(
+                data_dict['resource_id'])]
+        })
+    all_fields = [{'id': u'_id', 'type': 'int4'}] + \
+        [dict(field) for field in schema['fields']]
+    all_field_ids = _pluck('id', all_fields)
+
+    field_ids = _get_list(data_dict.get('fields')) or all_field_ids
+    for field in field_ids:
+        if not field in all_field_ids:
+            raise ValidationError({
+                'fields': [u'field "{0}" not in table'.format(field)]}
+            )
+    fields = [all_fields[all_field_ids.index(field_id)]
+              for field_id in field_ids]
+
+    select_columns = ', '.join([u'"{0}"'.format(field_id)
+                                for field_id in field_ids])
+    ts_query, rank_column = _textsearch_query(data_dict)
+    where_clause, where_values = _where(all_field_ids, data_dict)
+    sort = _sort(context, data_dict, all_field_ids) or u'ORDER BY "_id"'
+
+    sql_string = u'''SELECT {select} {rank}
+                    FROM "{resource}" {ts_query}
+                    {where} {sort}'''.format(
+            select=select_columns,
+            rank=rank_column,
+            resource=data_dict['resource_id'],
+            ts_query=ts_query,
+            where=where_clause,
+            sort=sort)
+
+    cursor = context['connection'].connection.cursor(name='datastore_dump')
+    cursor.itersize = int(data_dict.get('batch_size', 1000))
+    cursor.execute(sql_string, where_values)
+    converters = [_converter(field['type']) or (lambda data: data)
+                  for field in fields]
+    return fields, _dump_rows(context, cursor, converters)
+
+
+def _dump_rows(context, cursor, converters):
+    try:
+        for row in cursor:
+            yield [converter(value)
+                   for converter, value in zip(converters, row)]
+    finally:
+        cursor.close()
+        context['connection'].close()
+
+
+def _records_format(data_dict):
+    records_format = data_dict.get('records_format', 'objects')
+    if records_format not in RECORDS_FORMATS:
+        raise ValidationError({
+            'records_format': [u'records_format must be one of: {0}'.format(
+                ', '.join(RECORDS_FORMATS))]
+        })
+    return records_format
+
+
 def format_results(context, results, data_dict):
+    '''Set data_dict's fields, total and records from the results.
+
+    The records are converted a column at a time and, depending on
+    data_dict['records_format'], returned as a list of dicts ('objects', the
+    default), a list of lists in the order of the fields ('lists') or a list
+    of one list of values per field ('columns').'''
+    records_format = _records_format(data_dict)
     result_fields = []
     for field in results.cursor.description:
         result_fields.append({
             'id': field[0].decode('utf-8'),
             'type': _get_type(context, field[1])
         })
+    field_ids = _pluck('id', result_fields)
+    count_index = (field_ids.index('_full_count')
+                   if '_full_count' in field_ids else None)
     if len(result_fields) and result_fields[-1]['id'] == '_full_count':
         result_fields.pop()  # remove _full_count
-
-    records = []
-    for row in results:
-        converted_row = {}
-        if '_full_count' in row:
-            data_dict['total'] = row['_full_count']
-        for field in result_fields:
-            converted_row[field['id']] = convert(row[field['id']],
-                                                 field['type'])
-        records.append(converted_row)
+        field_ids.pop()
+
+    rows = results.fetchall()
+    if rows and count_index is not None:
+        data_dict['total'] = rows[0][count_index]
+
+    columns = zip(*rows)[:len(result_fields)] if rows else \
+        [() for field in result_fields]
+    for i, field in enumerate(result_fields):
+        converter = _converter(field['type'])
+        if converter:
+            columns[i] = map(converter, columns[i])
+
+    if records_format == 'columns':
+        records = map(list, columns)
+    elif records_format == 'lists':
+        records = map(list, itertools.izip(*columns)) if columns else []
+    else:
+        records = [dict(itertools.izip(field_ids, row))
+                   for row in itertools.izip(*columns)] if columns else []
     data_dict['records'] = records
     data_dict['fields'] = result_fields
 
@@ -915,9 +1354,14 @@ def create(context, data_dict):
 
     Any error results in total failure! For now pass back the actual error.
     Should be transactional.
+
+    If context['defer_indexes'] is set the replaced indexes are dropped but
+    the new ones are not built, their statements are left in
+    context['index_statements'] for build_indexes().
     '''
     engine = _get_engine(context, data_dict)
     context['connection'] = engine.connect()
+    context['schemas'] = {}
     timeout = context.get('query_timeout', 60000)
     _cache_types(context)
 
@@ -933,14 +1377,20 @@ def create(context, data_dict):
             u'SELECT * FROM pg_tables WHERE tablename = %s',
              data_dict['resource_id']
         ).fetchone()
+        _bump_data_version(context, data_dict['resource_id'])
         if not result:
             create_table(context, data_dict)
         else:
             alter_table(context, data_dict)
         insert_data(context, data_dict)
-        create_indexes(context, data_dict)
+        if context.get('defer_indexes'):
+            context['index_statements'] = _index_statements(
+                context, data_dict, concurrently=True)
+        else:
+            create_indexes(context, data_dict)
         create_alias(context, data_dict)
         trans.commit()
+        _forget_schemas(context)
         return _unrename_json_field(data_dict)
     except IntegrityError, e:
         if ('duplicate key value violates unique constraint' in str(e)
@@ -974,6 +1424,7 @@ def upsert(context, data_dict):
     '''
     engine = _get_engine(context, data_dict)
     context['connection'] = engine.connect()
+    context['schemas'] = {}
     timeout = context.get('query_timeout', 60000)
 
     try:
@@ -982,7 +1433,10 @@ def upsert(context, data_dict):
         context['connection'].execute(
             u'SET LOCAL statement_timeout TO {0}'.format(timeout))
         upsert_data(context, data_dict)
+        # last, as the version's row is locked until the commit
+        _bump_data_version(context, data_dict['resource_id'])
         trans.commit()
+        _forget_schemas(context)
         return _unrename_json_field(data_dict)
     except IntegrityError, e:
         if 'duplicate key value violates unique constraint' in str(e):
@@ -1008,28 +1462,33 @@ def upsert(context, data_dict):
 def delete(context, data_dict):
     engine = _get_engine(context, data_dict)
     context['connection'] = engine.connect()
+    context['schemas'] = {}
     _cache_types(context)
 
     try:
         # check if table exists
         trans = context['connection'].begin()
-        result = context['connection'].execute(
-            u'SELECT 1 FROM pg_tables WHERE tablename = %s',
-             data_dict['resource_id']
-        ).fetchone()
-        if not result:
+        schema = _get_schema(context, data_dict['resource_id'])
+        if not schema['exists'] or schema['is_alias']:
             raise ValidationError({
                 'resource_id': [u'table for resource "{0}" does not exist'.format(
                     data_dict['resource_id'])]
             })
         if not 'filters' in data_dict:
+            # the table's aliases are dropped with it
+            _create_version_table(context['connection'])
+            for name in [data_dict['resource_id']] + \
+                    _get_aliases(context, data_dict):
+                _bump_table_version(context, name)
             context['connection'].execute(
                 u'DROP TABLE "{0}" CASCADE'.format(data_dict['resource_id'])
             )
         else:
             delete_data(context, data_dict)
+            _bump_data_version(context, data_dict['resource_id'])
 
         trans.commit()
+        _forget_schemas(context)
         return _unrename_json_field(data_dict)
     except Exception:
         trans.rollback()
@@ -1041,24 +1500,29 @@ def delete(context, data_dict):
 def search(context, data_dict):
     engine = _get_engine(context, data_dict)
     context['connection'] = engine.connect()
+    context['schemas'] = {}
     timeout = context.get('query_timeout', 60000)
     _cache_types(context)
 
     try:
         # check if table exists
+        schema = _get_schema(context, data_dict['resource_id'])
         context['connection'].execute(
             u'SET LOCAL statement_timeout TO {0}'.format(timeout))
-        id = data_dict['resource_id']
-        result = context['connection'].execute(
-            u"(SELECT 1 FROM pg_tables where tablename = '{0}') union"
-             u"(SELECT 1 FROM pg_views where viewname = '{0}')".format(id)
-        ).fetchone()
-        if not result:
+        if not schema['exists']:
             raise ValidationError({
                 'resource_id': [u'table for resource "{0}" does not exist'.format(
                     data_dict['resource_id'])]
             })
-        return search_data(context, data_dict)
+        key = search_cache.make_key('search', data_dict,
+                                    schema.get('version'))
+        result = key and search_cache.get_result(key)
+        if result:
+            return result
+        result = search_data(context, data_dict)
+        if key:
+            search_cache.set_result(key, result)
+        return result
     except Exception, e:
         if 'due to statement timeout' in str(e):
             raise ValidationError({
@@ -1069,19 +1533,56 @@ def search(context, data_dict):
         context['connection'].close()
 
 
+def dump(context, data_dict):
+    '''Return the fields and an iterator over the rows of a table, see
+    dump_data().'''
+    engine = _get_engine(context, data_dict)
+    context['connection'] = engine.connect()
+    context['schemas'] = {}
+    timeout = context.get('query_timeout', 60000)
+    _cache_types(context)
+
+    try:
+        # server-side cursors only work in a transaction, and the timeout
+        # applies to each fetch of rows from it
+        context['connection'].begin()
+        context['connection'].execute(
+            u'SET LOCAL statement_timeout TO {0}'.format(timeout))
+        fields, rows = dump_data(context, data_dict)
+        return _unrename_json_field({'fields': fields})['fields'], rows
+    except Exception, e:
+        context['connection'].close()
+        if 'due to statement timeout' in str(e):
+            raise ValidationError({
+                'query': ['Query took too long']
+            })
+        raise
+
+
 def search_sql(context, data_dict):
     engine = _get_engine(context, data_dict)
     context['connection'] = engine.connect()
+    context['schemas'] = {}
     timeout = context.get('query_timeout', 60000)
     _cache_types(context)
 
     try:
+        _records_format(data_dict)
         context['connection'].execute(
             u'SET LOCAL statement_timeout TO {0}'.format(timeout))
+        key = search_cache.make_key(
+            'search_sql', data_dict,
+            _get_query_version(context['connection'], data_dict['sql']))
+        result = key and search_cache.get_result(key)
+        if result:
+            return result
         results = context['connection'].execute(
             data_dict['sql']
         )
-        return format_results(context, results, data_dict)
+        result = format_results(context, results, data_dict)
+        if key:
+            search_cache.set_result(key, result)
+        return result
 
     except ProgrammingError, e:
         raise ValidationError({
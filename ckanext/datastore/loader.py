@@ -0,0 +1,153 @@
+'''
+Loading local CSV files into the DataStore, see ``paster datastore load``.
+
+The file is read a chunk of rows at a time, so files of any size can be
+loaded. The types of the columns of a new table are guessed from a sample of
+the first rows, rather than from the first one as datastore_create does for
+records without field types. The chunks are inserted by a pool of worker
+processes, each chunk in its own transaction.
+'''
+import collections
+import csv
+import itertools
+import logging
+import multiprocessing
+import time
+
+import ckanext.datastore.db as db
+
+log = logging.getLogger(__name__)
+
+
+class LoadError(Exception):
+    pass
+
+
+def _read_csv(f, encoding):
+    for row in csv.reader(f):
+        yield [value.decode(encoding) for value in row]
+
+
+def _chunks(rows, size):
+    rows = iter(rows)
+    while True:
+        chunk = list(itertools.islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def guess_fields(header, sample):
+    '''Return the fields of a table for a CSV file's header row and a sample
+    of its rows, with their types guessed from the sample.'''
+    columns = list(itertools.izip_longest(*sample)) if sample else []
+    fields = []
+    for num, field_id in enumerate(header):
+        column = columns[num] if num < len(columns) else []
+        fields.append({'id': field_id,
+                       'type': db._guess_column_type(column)})
+    return fields
+
+
+def _insert_chunk(args):
+    '''Insert a chunk of rows. Returns the number of rows inserted and an
+    error message, as exceptions don't always survive the trip back from a
+    worker process.'''
+    data_dict, first_row, rows = args
+    field_ids = [field['id'] for field in data_dict['fields']]
+    records = []
+    for num, row in enumerate(rows):
+        if len(row) > len(field_ids):
+            return 0, u'row {0} has more values than the header'.format(
+                first_row + num)
+        # empty values are nulls, as there's no telling them apart in CSV
+        records.append(dict((field_id, value or None)
+                            for field_id, value in zip(field_ids, row)))
+    try:
+        db.upsert({}, {'resource_id': data_dict['resource_id'],
+                       'connection_url': data_dict['connection_url'],
+                       'method': db.INSERT,
+                       'records': records})
+    except db.ValidationError, e:
+        return 0, u'rows {0} to {1}: {2}'.format(
+            first_row, first_row + len(rows) - 1, e.error_dict)
+    except Exception, e:
+        return 0, u'rows {0} to {1}: {2}'.format(
+            first_row, first_row + len(rows) - 1, e)
+    return len(records), None
+
+
+def load_csv(f, resource_id, connection_url, encoding='utf-8',
+             sample_size=1000, chunk_size=5000, workers=1, progress=None):
+    '''Load the rows of the CSV file f into the table of resource_id.
+
+    The table is created if it doesn't exist yet, with the fields of the
+    file's header row and types guessed from its first sample_size rows. If
+    it does exist, the rows are appended to it and any new columns are
+    added.
+
+    :param workers: the number of processes that insert chunks of
+        chunk_size rows at the same time
+    :param progress: called with the number of rows loaded so far and the
+        seconds taken after each chunk
+
+    :returns: the number of rows loaded
+    :raises LoadError: if a chunk couldn't be inserted. The chunks already
+        inserted stay loaded.
+    '''
+    rows = _read_csv(f, encoding)
+    try:
+        header = rows.next()
+    except StopIteration:
+        raise LoadError(u'The file is empty')
+    for field_id in header:
+        if not db._is_valid_field_name(field_id):
+            raise LoadError(u'"{0}" is not a valid field name'.format(
+                field_id))
+    sample = list(itertools.islice(rows, sample_size))
+
+    data_dict = {
+        'resource_id': resource_id,
+        'connection_url': connection_url,
+        'fields': guess_fields(header, sample),
+        'records': [],
+    }
+    try:
+        db.create({}, dict(data_dict))
+    except db.ValidationError, e:
+        raise LoadError(e.error_dict)
+    # don't share the connections of this process with the workers
+    db._get_engine(None, data_dict).dispose()
+
+    # row numbers count the header as row 1, like spreadsheets do
+    chunks = ((data_dict, 2 + num * chunk_size, chunk) for num, chunk in
+              enumerate(_chunks(itertools.chain(sample, rows), chunk_size)))
+    pool = multiprocessing.Pool(workers) if workers > 1 else None
+    pending = collections.deque()
+    start = time.time()
+    totals = {'loaded': 0}
+
+    def done(result):
+        count, error = result
+        if error:
+            raise LoadError(error)
+        totals['loaded'] += count
+        if progress:
+            progress(totals['loaded'], time.time() - start)
+
+    try:
+        for chunk in chunks:
+            if not pool:
+                done(_insert_chunk(chunk))
+                continue
+            pending.append(pool.apply_async(_insert_chunk, (chunk,)))
+            # only read as far ahead of the workers as they can use
+            if len(pending) >= workers * 2:
+                done(pending.popleft().get())
+        while pending:
+            done(pending.popleft().get())
+    finally:
+        if pool:
+            pool.terminate()
+            pool.join()
+    return totals['loaded']
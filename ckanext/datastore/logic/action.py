@@ -1,9 +1,11 @@
+import json
 import logging
+import uuid
+
 import pylons
 import ckan.logic as logic
 import ckan.plugins as p
 import ckanext.datastore.db as db
-import sqlalchemy
 
 log = logging.getLogger(__name__)
 _get_or_bust = logic.get_or_bust
@@ -32,13 +34,27 @@ def datastore_create(context, data_dict):
     :type primary_key: list or comma separated string
     :param indexes: indexes on table
     :type indexes: list or comma separated string
+    :param async: build the indexes in a background job after the records
+        are loaded (optional, default: false, needs ``paster celeryd``)
+    :type async: bool
 
     Please note that setting the ``aliases``, ``indexes`` or ``primary_key`` replaces the exising
     aliases or constraints. Setting ``records`` appends the provided records to the resource.
 
+    Building the indexes of a large table can take longer than a request is
+    allowed to. With ``async`` the table is created, the records are
+    inserted and the replaced indexes are dropped straight away, but the new
+    indexes are built with ``CREATE INDEX CONCURRENTLY`` by a background job,
+    which doesn't stop the table being read and written. Until the job is
+    done searches may be slower and ``upsert`` and ``update`` may not find
+    the new primary key. The job's progress is kept in the ``progress``
+    task status of the resource, with the task type ``datastore_create``,
+    see ``task_status_show``.
+
     **Results:**
 
-    :returns: The newly created data object.
+    :returns: The newly created data object, and the ``job_id`` of the
+        background job if ``async`` is set and there are indexes to build.
     :rtype: dictionary
 
     See :ref:`fields` and :ref:`records` for details on how to lay out records.
@@ -66,12 +82,56 @@ def datastore_create(context, data_dict):
                 'alias': ['{0} is not a valid alias name'.format(alias)]
             })
 
+    if db._get_bool(data_dict.get('async')):
+        try:
+            import ckanext.datastore.tasks
+        except ImportError:
+            raise p.toolkit.ValidationError({
+                'async': ['Background jobs need celery to be installed']
+            })
+        context['defer_indexes'] = True
+
     result = db.create(context, data_dict)
+    statements = context.pop('index_statements', None)
+    if statements:
+        result['job_id'] = _queue_index_job(context, data_dict, statements)
     result.pop('id', None)
     result.pop('connection_url')
     return result
 
 
+def _queue_index_job(context, data_dict, statements):
+    '''Queue a job that builds the indexes of a table and return its id.'''
+    import ckanext.datastore.tasks as tasks
+
+    model = context['model']
+    res_id = data_dict['resource_id']
+    site_user = p.toolkit.get_action('get_site_user')(
+        {'model': model, 'ignore_auth': True}, {})
+    job_id = unicode(uuid.uuid4())
+
+    progress = {'indexes_built': 0, 'indexes_total': len(statements)}
+    status_context = {'model': model, 'session': model.Session,
+                      'user': site_user['name'], 'ignore_auth': True}
+    p.toolkit.get_action('task_status_update_many')(status_context, {'data': [
+        tasks.task_status(res_id, u'celery_task_id', job_id, u'pending'),
+        tasks.task_status(res_id, u'progress', json.dumps(progress),
+                          u'pending'),
+    ]})
+
+    job_context = json.dumps({
+        'site_url': pylons.config['ckan.site_url'],
+        'apikey': site_user['apikey'],
+    })
+    job_data = json.dumps({
+        'resource_id': res_id,
+        'statements': statements,
+    })
+    tasks.celery.send_task('datastore.build_indexes',
+                           args=[job_context, job_data], task_id=job_id)
+    return job_id
+
+
 def datastore_upsert(context, data_dict):
     '''Updates or inserts into a table in the datastore
 
@@ -112,12 +172,7 @@ def datastore_upsert(context, data_dict):
 
     data_dict['connection_url'] = pylons.config['ckan.datastore.write_url']
 
-    resources_sql = sqlalchemy.text(u'''SELECT 1 FROM "_table_metadata"
-                                        WHERE name = :id AND alias_of IS NULL''')
-    results = db._get_engine(None, data_dict).execute(resources_sql, id=res_id)
-    res_exists = results.rowcount > 0
-
-    if not res_exists:
+    if not db.resource_exists(data_dict, alias=False):
         raise p.toolkit.ObjectNotFound(p.toolkit._(
             'Resource "{0}" was not found.'.format(res_id)
         ))
@@ -151,12 +206,7 @@ def datastore_delete(context, data_dict):
 
     data_dict['connection_url'] = pylons.config['ckan.datastore.write_url']
 
-    resources_sql = sqlalchemy.text(u'''SELECT 1 FROM "_table_metadata"
-                                        WHERE name = :id AND alias_of IS NULL''')
-    results = db._get_engine(None, data_dict).execute(resources_sql, id=res_id)
-    res_exists = results.rowcount > 0
-
-    if not res_exists:
+    if not db.resource_exists(data_dict, alias=False):
         raise p.toolkit.ObjectNotFound(p.toolkit._(
             'Resource "{0}" was not found.'.format(res_id)
         ))
@@ -194,6 +244,13 @@ def datastore_search(context, data_dict):
     :param sort: comma separated field names with ordering
                  e.g.: "fieldname1, fieldname2 desc"
     :type sort: string
+    :param records_format: the format of the records in the result:
+        ``objects`` (the default) for a list of dicts, ``lists`` for a list
+        of lists of values in the order of ``fields``, or ``columns`` for
+        one list of values per field. ``lists`` and ``columns`` don't repeat
+        the field names in every record, so they are smaller and quicker to
+        make for wide or long results.
+    :type records_format: string
 
     Setting the ``plain`` flag to false enables the entire PostgreSQL `full text search query language`_.
 
@@ -216,8 +273,8 @@ def datastore_search(context, data_dict):
     :type filters: list of dictionaries
     :param total: number of total matching records
     :type total: int
-    :param records: list of matching results
-    :type records: list of dictionaries
+    :param records: list of matching results, in the records_format
+    :type records: list of dictionaries or lists
 
     '''
     if 'id' in data_dict:
@@ -227,11 +284,7 @@ def datastore_search(context, data_dict):
     data_dict['connection_url'] = pylons.config.get('ckan.datastore.read_url',
             pylons.config['ckan.datastore.write_url'])
 
-    resources_sql = sqlalchemy.text(u'SELECT 1 FROM "_table_metadata" WHERE name = :id')
-    results = db._get_engine(None, data_dict).execute(resources_sql, id=res_id)
-    res_exists = results.rowcount > 0
-
-    if not res_exists:
+    if not db.resource_exists(data_dict):
         raise p.toolkit.ObjectNotFound(p.toolkit._(
             'Resource "{0}" was not found.'.format(res_id)
         ))
@@ -240,7 +293,7 @@ def datastore_search(context, data_dict):
 
     result = db.search(context, data_dict)
     result.pop('id', None)
-    result.pop('connection_url')
+    result.pop('connection_url', None)
     return result
 
 
@@ -259,6 +312,9 @@ def datastore_search_sql(context, data_dict):
 
     :param sql: a single sql select statement
     :type sql: string
+    :param records_format: ``objects`` (the default), ``lists`` or
+        ``columns``, see datastore_search
+    :type records_format: string
 
     **Results:**
 
@@ -267,8 +323,8 @@ def datastore_search_sql(context, data_dict):
     :rtype: A dictionary with the following keys
     :param fields: fields/columns and their extra metadata
     :type fields: list of dictionaries
-    :param records: list of matching results
-    :type records: list of dictionaries
+    :param records: list of matching results, in the records_format
+    :type records: list of dictionaries or lists
 
     '''
     sql = _get_or_bust(data_dict, 'sql')
@@ -286,5 +342,5 @@ def datastore_search_sql(context, data_dict):
 
     result = db.search_sql(context, data_dict)
     result.pop('id', None)
-    result.pop('connection_url')
+    result.pop('connection_url', None)
     return result
@@ -24,6 +24,7 @@ class DatastorePlugin(p.SingletonPlugin):
     p.implements(p.IConfigurable, inherit=True)
     p.implements(p.IActions)
     p.implements(p.IAuthFunctions)
+    p.implements(p.IRoutes, inherit=True)
 
     legacy_mode = False
 
@@ -81,23 +82,11 @@ class DatastorePlugin(p.SingletonPlugin):
         resource_show = p.toolkit.get_action('resource_show')
 
         def new_resource_show(context, data_dict):
-            engine = db._get_engine(
-                context,
-                {'connection_url': self.read_url}
-            )
             new_data_dict = resource_show(context, data_dict)
-            try:
-                connection = engine.connect()
-                result = connection.execute(
-                    'SELECT 1 FROM "_table_metadata" WHERE name = %s AND alias_of IS NULL',
-                    new_data_dict['id']
-                ).fetchone()
-                if result:
-                    new_data_dict['datastore_active'] = True
-                else:
-                    new_data_dict['datastore_active'] = False
-            finally:
-                connection.close()
+            new_data_dict['datastore_active'] = db.resource_exists(
+                {'connection_url': self.read_url,
+                 'resource_id': new_data_dict['id']},
+                alias=False)
             return new_data_dict
 
         ## Make sure do not run many times if configure is called repeatedly
@@ -204,6 +193,15 @@ class DatastorePlugin(p.SingletonPlugin):
         connection = db._get_engine(None,
             {'connection_url': pylons.config['ckan.datastore.write_url']}).connect()
         connection.execute(create_alias_table_sql)
+        trans = connection.begin()
+        try:
+            db._create_version_table(connection)
+            trans.commit()
+        except Exception:
+            trans.rollback()
+            raise
+        finally:
+            connection.close()
 
     def get_actions(self):
         actions = {'datastore_create': action.datastore_create,
@@ -214,6 +212,12 @@ class DatastorePlugin(p.SingletonPlugin):
             actions['datastore_search_sql'] = action.datastore_search_sql
         return actions
 
+    def before_map(self, m):
+        m.connect('/datastore/dump/{resource_id}',
+                  controller='ckanext.datastore.controller:DatastoreController',
+                  action='dump')
+        return m
+
     def get_auth_functions(self):
         return {'datastore_create': auth.datastore_create,
                 'datastore_upsert': auth.datastore_upsert,
@@ -0,0 +1,97 @@
+'''
+A cache of the results of datastore_search and datastore_search_sql.
+
+Previews and dashboards run the same searches on resources that rarely
+change over and over. The results are cached under the search's parameters
+and the version of the table (see db._get_table_version()), which every
+datastore_create, datastore_upsert and datastore_delete increases, so a
+result is never used once the table has changed. datastore_search_sql
+results are cached under the versions of the tables that the query reads,
+found by planning it (see db._get_query_version()); queries of the system
+catalogs and of several statements aren't cached.
+
+The results are kept as JSON in a bounded, in-process LRU cache and,
+optionally, in a shared Beaker cache (e.g. memcached) used by all the worker
+processes.
+
+Config settings:
+
+``ckan.datastore.search_cache.size``
+  The maximum number of results kept in each process (default: 1000, 0 turns
+  the cache off).
+
+``ckan.datastore.search_cache.max_bytes``
+  The maximum total size of the results kept in each process, as JSON
+  (default: 50000000). Results of more than a tenth of it aren't cached.
+
+``ckan.datastore.search_cache.expires``
+  How long, in seconds, a cached result is used for (default: 3600).
+
+``ckan.datastore.search_cache.shared_type``
+  The type of an optional Beaker cache shared by all processes, e.g.
+  ``ext:memcached``, using the ``beaker.cache.*`` settings (default: none).
+
+'''
+import hashlib
+import json
+
+import ckan.lib.caching as caching
+
+# data_dict keys that aren't part of the search
+_IGNORED_KEYS = ('connection_url',)
+# result keys that aren't returned by the actions, and mustn't be cached as
+# connection_url holds the database's password
+_UNCACHED_KEYS = ('connection_url', 'id')
+
+# the results are kept as JSON, and measured by their length
+_cache = caching.Cache('datastore_search', 'ckan.datastore.search_cache',
+                       max_bytes=50000000, cost=len)
+
+
+def make_key(kind, data_dict, version):
+    '''Return the key of the result of a search, or None if it can't be
+    cached.
+
+    :param kind: 'search' or 'search_sql'
+    :param data_dict: the search's parameters
+    :param version: the version of the table searched, or None if the
+        versions aren't kept
+    '''
+    if version is None or not _cache.max_size():
+        return None
+    search = dict((key, value) for key, value in data_dict.items()
+                  if key not in _IGNORED_KEYS)
+    if 'sql' in search:
+        search['sql'] = search['sql'].strip().rstrip(';').strip()
+    try:
+        search = json.dumps(search, sort_keys=True)
+    except TypeError:
+        return None
+    return hashlib.md5(repr((kind, version, search))).hexdigest()
+
+
+def get_result(key):
+    '''Return a copy of the result cached under `key`, or None.'''
+    result = _cache.get(key)
+    if result is None:
+        return None
+    return json.loads(result)
+
+
+def set_result(key, result):
+    '''Cache `result` under `key`.'''
+    result = json.dumps(dict((name, value) for name, value in result.items()
+                             if name not in _UNCACHED_KEYS))
+    if len(result) > _cache.max_bytes() / 10:
+        return
+    _cache.set(key, result)
+
+
+def clear():
+    '''Remove all the cached results.'''
+    _cache.clear()
+
+
+def stats():
+    '''Return this process's cache hit and miss counts and sizes.'''
+    return _cache.stats()
@@ -0,0 +1,87 @@
+'''
+The background jobs of the DataStore, run by ``paster celeryd``.
+'''
+import datetime
+import json
+import logging
+import urllib2
+import urlparse
+
+from pylons import config as pylons_config
+
+from ckan.lib.celery_app import celery, config
+import ckanext.datastore.db as db
+
+log = logging.getLogger(__name__)
+
+TASK_TYPE = 'datastore_create'
+
+
+def task_status(resource_id, key, value, state, error=u''):
+    return {
+        'entity_id': resource_id,
+        'entity_type': u'resource',
+        'task_type': TASK_TYPE,
+        'key': key,
+        'value': value,
+        'state': state,
+        'error': error,
+        'last_updated': datetime.datetime.now().isoformat(),
+    }
+
+
+def _update_task_status(context, task_status):
+    '''Save a task status through the API of the CKAN site that queued the
+    job, as the worker doesn't load the site's model.'''
+    url = urlparse.urljoin(context['site_url'],
+                           '/api/action/task_status_update')
+    request = urllib2.Request(url, json.dumps(task_status),
+                              {'Content-Type': 'application/json',
+                               'Authorization': context['apikey']})
+    try:
+        urllib2.urlopen(request).read()
+    except urllib2.URLError, e:
+        log.error('Could not update the task status of {0}: {1}'.format(
+            task_status['entity_id'], e))
+
+
+def _write_url():
+    '''Return the DataStore's write URL from the site's config, which the
+    worker has too, so that the password isn't sent in the jobs.'''
+    write_url = pylons_config.get('ckan.datastore.write_url')
+    if not write_url:
+        write_url = config.get('app:main', 'ckan.datastore.write_url')
+    return write_url
+
+
+@celery.task(name='datastore.build_indexes')
+def build_indexes(context, data):
+    '''Build the indexes of a table that datastore_create was called for
+    with async set, recording its progress in the task status with the key
+    "progress".
+
+    :param context: JSON dict with the site_url and the apikey to update the
+        task status with
+    :param data: JSON dict with the resource_id and the index statements
+    '''
+    context = json.loads(context)
+    data = json.loads(data)
+    data['connection_url'] = _write_url()
+    resource_id = data['resource_id']
+    status = {'indexes_built': 0, 'indexes_total': len(data['statements'])}
+
+    def progress(built, total):
+        status['indexes_built'] = built
+        _update_task_status(context, task_status(
+            resource_id, u'progress', json.dumps(status), u'running'))
+
+    try:
+        db.build_indexes({}, data, data['statements'], progress)
+    except Exception, e:
+        log.exception(e)
+        _update_task_status(context, task_status(
+            resource_id, u'progress', json.dumps(status), u'error',
+            unicode(e)))
+        raise
+    _update_task_status(context, task_status(
+        resource_id, u'progress', json.dumps(status), u'complete'))
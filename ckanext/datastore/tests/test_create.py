@@ -577,4 +577,88 @@ class TestDatastoreCreate(tests.WsgiAppCase):
                             extra_environ=auth, status=409)
         res_dict = json.loads(res.body)
 
-        assert res_dict['success'] is False
\ No newline at end of file
+        assert res_dict['success'] is False
+
+class TestDatastoreCreateDeferredIndexes(tests.WsgiAppCase):
+
+    @classmethod
+    def setup_class(cls):
+        if not tests.is_datastore_supported():
+            raise nose.SkipTest("Datastore not supported")
+        p.load('datastore')
+        ctd.CreateTestData.create()
+        import pylons
+        cls.write_url = pylons.config['ckan.datastore.write_url']
+        engine = db._get_engine(None, {'connection_url': cls.write_url})
+        cls.Session = orm.scoped_session(orm.sessionmaker(bind=engine))
+
+    @classmethod
+    def teardown_class(cls):
+        rebuild_all_dbs(cls.Session)
+
+    def _indexes(self, resource_id):
+        c = self.Session.connection()
+        results = c.execute(u'select indexname from pg_indexes '
+                            u'where tablename = %s', resource_id)
+        indexes = [row[0] for row in results]
+        self.Session.remove()
+        return indexes
+
+    def test_queued_job_has_no_connection_url(self):
+        import ckanext.datastore.logic.action as action
+        import ckanext.datastore.tasks as tasks
+        resource = model.Package.get('annakarenina').resources[0]
+        sent = []
+        send_task = tasks.celery.send_task
+        tasks.celery.send_task = \
+            lambda name, args, task_id: sent.append(args)
+        try:
+            action._queue_index_job({'model': model}, {
+                'resource_id': resource.id,
+                'connection_url': self.write_url,
+            }, [u'CREATE INDEX CONCURRENTLY ON "{0}" (author)'])
+        finally:
+            tasks.celery.send_task = send_task
+        job_context, job_data = sent[0]
+        assert 'connection_url' not in json.loads(job_data)
+        assert self.write_url not in job_context + job_data
+        assert tasks._write_url() == self.write_url
+
+    def test_defer_and_build_indexes(self):
+        resource = model.Package.get('annakarenina').resources[0]
+        data = {
+            'resource_id': resource.id,
+            'connection_url': self.write_url,
+            'fields': [{'id': 'book', 'type': 'text'},
+                       {'id': 'author', 'type': 'text'}],
+            'primary_key': 'book',
+            'indexes': 'author',
+            'records': [{'book': 'annakarenina', 'author': 'tolstoy'},
+                        {'book': 'warandpeace', 'author': 'tolstoy'}]
+        }
+        context = {'model': model, 'defer_indexes': True}
+        db.create(context, dict(data))
+        statements = context['index_statements']
+        assert len(statements) == 3, statements
+        for statement in statements:
+            assert 'CONCURRENTLY' in statement, statement
+        assert self._indexes(resource.id) == []
+
+        progress = []
+        db.build_indexes({}, data, statements,
+                         lambda built, total: progress.append((built, total)))
+        assert progress == [(0, 3), (1, 3), (2, 3), (3, 3)], progress
+        assert len(self._indexes(resource.id)) == 3
+
+        # the unique key can be used to upsert now
+        db.upsert({'model': model}, {
+            'resource_id': resource.id,
+            'connection_url': self.write_url,
+            'method': 'upsert',
+            'records': [{'book': 'warandpeace', 'author': 'leo tolstoy'}]
+        })
+        c = self.Session.connection()
+        results = c.execute(u'select author from "{0}" where book = %s'.format(
+            resource.id), 'warandpeace').fetchall()
+        self.Session.remove()
+        assert [row[0] for row in results] == ['leo tolstoy'], results
@@ -0,0 +1,97 @@
+import gzip
+import json
+import nose
+import StringIO
+
+import sqlalchemy.orm as orm
+
+import ckan.plugins as p
+import ckan.lib.create_test_data as ctd
+import ckan.model as model
+import ckan.tests as tests
+
+import ckanext.datastore.db as db
+from ckanext.datastore.tests.helpers import rebuild_all_dbs
+
+
+class TestDatastoreDump(tests.WsgiAppCase):
+    sysadmin_user = None
+
+    @classmethod
+    def setup_class(cls):
+        if not tests.is_datastore_supported():
+            raise nose.SkipTest("Datastore not supported")
+        p.load('datastore')
+        ctd.CreateTestData.create()
+        cls.sysadmin_user = model.User.get('testsysadmin')
+        resource = model.Package.get('annakarenina').resources[0]
+        cls.data = {
+            'resource_id': resource.id,
+            'fields': [{'id': u'b\xfck', 'type': 'text'},
+                       {'id': 'author', 'type': 'text'},
+                       {'id': 'published', 'type': 'timestamp'},
+                       {'id': 'nested', 'type': 'json'}],
+            'records': [{u'b\xfck': 'annakarenina', 'author': 'tolstoy',
+                         'published': '2005-03-01',
+                         'nested': ['b', {'moo': 'moo'}]},
+                        {u'b\xfck': 'warandpeace', 'author': 'tolstoy'},
+                        {u'b\xfck': 'the, idiot', 'author': 'dostoevsky'}]
+        }
+        postparams = '%s=1' % json.dumps(cls.data)
+        auth = {'Authorization': str(cls.sysadmin_user.apikey)}
+        res = cls.app.post('/api/action/datastore_create', params=postparams,
+                           extra_environ=auth)
+        res_dict = json.loads(res.body)
+        assert res_dict['success'] is True
+
+        import pylons
+        engine = db._get_engine(
+                None,
+                {'connection_url': pylons.config['ckan.datastore.write_url']}
+            )
+        cls.Session = orm.scoped_session(orm.sessionmaker(bind=engine))
+
+    @classmethod
+    def teardown_class(cls):
+        rebuild_all_dbs(cls.Session)
+
+    def _dump(self, status=200, headers=None, **params):
+        return self.app.get('/datastore/dump/{0}'.format(
+            self.data['resource_id']), params=params, status=status,
+            headers=headers or {})
+
+    def test_dump_csv(self):
+        res = self._dump()
+        assert res.headers['Content-Type'].startswith('text/csv')
+        lines = res.body.splitlines()
+        assert lines[0] == u'_id,b\xfck,author,published,nested'.encode(
+            'utf-8'), lines[0]
+        assert lines[1] == ('1,annakarenina,tolstoy,2005-03-01T00:00:00,'
+                            '"[""b"", {""moo"": ""moo""}]"'), lines[1]
+        assert lines[2] == '2,warandpeace,tolstoy,,', lines[2]
+        assert lines[3] == '3,"the, idiot",dostoevsky,,', lines[3]
+
+    def test_dump_tsv_fields_and_sort(self):
+        res = self._dump(format='tsv', fields='author,_id',
+                         sort='author, _id desc')
+        assert res.body.splitlines() == ['author\t_id', 'dostoevsky\t3',
+                                         'tolstoy\t2', 'tolstoy\t1'], res.body
+
+    def test_dump_jsonl_filters(self):
+        res = self._dump(format='jsonl',
+                         filters=json.dumps({'author': 'tolstoy'}))
+        records = [json.loads(line) for line in res.body.splitlines()]
+        assert len(records) == 2, records
+        assert records[0]['nested'] == ['b', {'moo': 'moo'}], records[0]
+        assert records[1][u'b\xfck'] == 'warandpeace', records[1]
+
+    def test_dump_gzip(self):
+        res = self._dump(headers={'Accept-Encoding': 'gzip'})
+        assert res.headers['Content-Encoding'] == 'gzip'
+        body = gzip.GzipFile(fileobj=StringIO.StringIO(res.body)).read()
+        assert len(body.splitlines()) == 4, body
+
+    def test_dump_invalid(self):
+        self._dump(status=400, format='xls')
+        self._dump(status=409, fields='missing')
+        self.app.get('/datastore/dump/not-a-resource', status=404)
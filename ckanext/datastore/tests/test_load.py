@@ -0,0 +1,81 @@
+import json
+import nose
+from nose.tools import assert_raises
+import StringIO
+
+import pylons
+import sqlalchemy.orm as orm
+
+import ckan.plugins as p
+import ckan.lib.create_test_data as ctd
+import ckan.model as model
+import ckan.tests as tests
+
+import ckanext.datastore.db as db
+import ckanext.datastore.loader as loader
+from ckanext.datastore.tests.helpers import rebuild_all_dbs
+
+
+class TestDatastoreLoad(tests.WsgiAppCase):
+    sysadmin_user = None
+
+    @classmethod
+    def setup_class(cls):
+        if not tests.is_datastore_supported():
+            raise nose.SkipTest("Datastore not supported")
+        p.load('datastore')
+        ctd.CreateTestData.create()
+        cls.sysadmin_user = model.User.get('testsysadmin')
+        cls.connection_url = pylons.config['ckan.datastore.write_url']
+        engine = db._get_engine(None, {'connection_url': cls.connection_url})
+        cls.Session = orm.scoped_session(orm.sessionmaker(bind=engine))
+
+    @classmethod
+    def teardown_class(cls):
+        rebuild_all_dbs(cls.Session)
+
+    def _search(self, resource_id):
+        postparams = '%s=1' % json.dumps({'resource_id': resource_id,
+                                          'sort': '_id'})
+        auth = {'Authorization': str(self.sysadmin_user.apikey)}
+        res = self.app.post('/api/action/datastore_search', params=postparams,
+                            extra_environ=auth)
+        res_dict = json.loads(res.body)
+        assert res_dict['success'] is True, res_dict
+        return res_dict['result']
+
+    def test_load_csv(self):
+        resource = model.Package.get('annakarenina').resources[0]
+        csv = (u'b\xfck,count,published\n'
+               u'annakarenina,1,2005-03-01\n'
+               u'warandpeace,,\n'
+               u'the idiot,3,1869-01-01\n').encode('utf-8')
+        progress = []
+        loaded = loader.load_csv(StringIO.StringIO(csv), resource.id,
+                                 self.connection_url, sample_size=2,
+                                 chunk_size=2,
+                                 progress=lambda n, s: progress.append(n))
+        assert loaded == 3, loaded
+        assert progress == [2, 3], progress
+
+        result = self._search(resource.id)
+        types = dict((field['id'], field['type'])
+                     for field in result['fields'])
+        assert types == {'_id': 'int4', u'b\xfck': 'text', 'count': 'int4',
+                         'published': 'timestamp'}, types
+        assert result['total'] == 3, result
+        assert result['records'][1]['count'] is None, result['records'][1]
+
+    def test_load_invalid(self):
+        resource = model.Package.get('annakarenina').resources[1]
+        assert_raises(
+            loader.LoadError, loader.load_csv, StringIO.StringIO(''),
+            resource.id, self.connection_url)
+        assert_raises(
+            loader.LoadError, loader.load_csv,
+            StringIO.StringIO('_id,book\n1,annakarenina\n'),
+            resource.id, self.connection_url)
+        assert_raises(
+            loader.LoadError, loader.load_csv,
+            StringIO.StringIO('book\nannakarenina,extra\n'),
+            resource.id, self.connection_url)
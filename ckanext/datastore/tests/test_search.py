@@ -10,6 +10,7 @@ import ckan.model as model
 import ckan.tests as tests
 
 import ckanext.datastore.db as db
+import ckanext.datastore.search_cache as search_cache
 from ckanext.datastore.tests.helpers import extract, rebuild_all_dbs
 
 
@@ -143,6 +144,49 @@ class TestDatastoreSearch(tests.WsgiAppCase):
         assert result['records'] == [{u'b\xfck': 'annakarenina', 'author': 'tolstoy'},
                     {u'b\xfck': 'warandpeace', 'author': 'tolstoy'}], result['records']
 
+    def test_search_records_format(self):
+        auth = {'Authorization': str(self.sysadmin_user.apikey)}
+        field_ids = ['_id', u'b\xfck', 'author', 'published', u'characters',
+                     'nested']
+        expected_lists = [[record[field_id] for field_id in field_ids]
+                          for record in self.expected_records]
+
+        data = {'resource_id': self.data['resource_id'],
+                'fields': field_ids,
+                'records_format': 'lists'}
+        postparams = '%s=1' % json.dumps(data)
+        res = self.app.post('/api/action/datastore_search', params=postparams,
+                            extra_environ=auth)
+        result = json.loads(res.body)['result']
+        assert result['total'] == len(self.data['records'])
+        assert [f['id'] for f in result['fields']] == field_ids, result['fields']
+        assert result['records'] == expected_lists, result['records']
+
+        data['records_format'] = 'columns'
+        postparams = '%s=1' % json.dumps(data)
+        res = self.app.post('/api/action/datastore_search', params=postparams,
+                            extra_environ=auth)
+        result = json.loads(res.body)['result']
+        assert result['records'] == map(list, zip(*expected_lists)), \
+            result['records']
+
+        data['records_format'] = 'objects'
+        postparams = '%s=1' % json.dumps(data)
+        res = self.app.post('/api/action/datastore_search', params=postparams,
+                            extra_environ=auth)
+        result = json.loads(res.body)['result']
+        assert result['records'] == self.expected_records, result['records']
+
+    def test_search_invalid_records_format(self):
+        data = {'resource_id': self.data['resource_id'],
+                'records_format': 'rows'}
+        postparams = '%s=1' % json.dumps(data)
+        auth = {'Authorization': str(self.sysadmin_user.apikey)}
+        res = self.app.post('/api/action/datastore_search', params=postparams,
+                            extra_environ=auth, status=409)
+        res_dict = json.loads(res.body)
+        assert res_dict['success'] is False
+
     def test_search_filters(self):
         data = {'resource_id': self.data['resource_id'],
                 'filters': {u'b\xfck': 'annakarenina'}}
@@ -396,6 +440,201 @@ class TestDatastoreFullTextSearch(tests.WsgiAppCase):
         assert res_dict['result']['total'] == 5, pprint.pformat(res_dict)
 
 
+class TestDatastoreSchemaCache(tests.WsgiAppCase):
+    @classmethod
+    def setup_class(cls):
+        if not tests.is_datastore_supported():
+            raise nose.SkipTest("Datastore not supported")
+        p.load('datastore')
+        ctd.CreateTestData.create()
+        cls.sysadmin_user = model.User.get('testsysadmin')
+        resource = model.Package.get('annakarenina').resources[0]
+        cls.data = {
+            'resource_id': resource.id,
+            'fields': [{'id': 'book', 'type': 'text'}],
+            'records': [{'book': 'annakarenina'}]
+        }
+        cls._post('datastore_create', cls.data)
+
+        import pylons
+        engine = db._get_engine(
+                None,
+                {'connection_url': pylons.config['ckan.datastore.write_url']}
+            )
+        cls.Session = orm.scoped_session(orm.sessionmaker(bind=engine))
+
+    @classmethod
+    def teardown_class(cls):
+        rebuild_all_dbs(cls.Session)
+
+    @classmethod
+    def _post(cls, action, data):
+        postparams = '%s=1' % json.dumps(data)
+        auth = {'Authorization': str(cls.sysadmin_user.apikey)}
+        res = cls.app.post('/api/action/{0}'.format(action),
+                           params=postparams, extra_environ=auth)
+        res_dict = json.loads(res.body)
+        assert res_dict['success'] is True, res_dict
+        return res_dict['result']
+
+    def _field_ids(self):
+        result = self._post('datastore_search',
+                            {'resource_id': self.data['resource_id']})
+        return [field['id'] for field in result['fields']]
+
+    def test_schema_cache(self):
+        field_ids = self._field_ids()
+        assert 'book' in field_ids, field_ids
+        assert self.data['resource_id'] in db._table_schemas
+
+        # add a column behind the datastore's back, like another process
+        # without the version change would
+        connection = self.Session.connection()
+        connection.execute(u'ALTER TABLE "{0}" ADD "author" text'.format(
+            self.data['resource_id']))
+        self.Session.commit()
+        assert self._field_ids() == field_ids, self._field_ids()
+
+        connection = self.Session.connection()
+        connection.execute(u'''UPDATE "_table_version"
+            SET version = version + 1 WHERE name = %s''',
+            self.data['resource_id'])
+        self.Session.commit()
+        assert self._field_ids() == field_ids + ['author'], \
+            self._field_ids()
+
+    def test_create_invalidates_schema_cache(self):
+        self._field_ids()
+        self._post('datastore_create', {
+            'resource_id': self.data['resource_id'],
+            'records': [{'book': 'warandpeace', 'year': 1869}]
+        })
+        assert 'year' in self._field_ids(), self._field_ids()
+
+
+class TestDatastoreSearchCache(tests.WsgiAppCase):
+    @classmethod
+    def setup_class(cls):
+        if not tests.is_datastore_supported():
+            raise nose.SkipTest("Datastore not supported")
+        p.load('datastore')
+        ctd.CreateTestData.create()
+        cls.sysadmin_user = model.User.get('testsysadmin')
+        resource = model.Package.get('annakarenina').resources[0]
+        cls.data = {
+            'resource_id': resource.id,
+            'aliases': 'books_cached',
+            'fields': [{'id': 'book', 'type': 'text'},
+                       {'id': 'year', 'type': 'int4'}],
+            'records': [{'book': 'annakarenina', 'year': 1877}]
+        }
+        cls._post('datastore_create', cls.data)
+
+        import pylons
+        engine = db._get_engine(
+                None,
+                {'connection_url': pylons.config['ckan.datastore.write_url']}
+            )
+        cls.Session = orm.scoped_session(orm.sessionmaker(bind=engine))
+
+    @classmethod
+    def teardown_class(cls):
+        rebuild_all_dbs(cls.Session)
+        search_cache.clear()
+
+    @classmethod
+    def _post(cls, action, data):
+        postparams = '%s=1' % json.dumps(data)
+        auth = {'Authorization': str(cls.sysadmin_user.apikey)}
+        res = cls.app.post('/api/action/{0}'.format(action),
+                           params=postparams, extra_environ=auth)
+        res_dict = json.loads(res.body)
+        assert res_dict['success'] is True, res_dict
+        return res_dict['result']
+
+    def _change_behind_back(self, sql):
+        # like a write that doesn't go through the datastore
+        connection = self.Session.connection()
+        connection.execute(sql.format(self.data['resource_id']))
+        self.Session.commit()
+
+    def _books(self, resource_id=None):
+        result = self._post('datastore_search', {
+            'resource_id': resource_id or self.data['resource_id'],
+            'fields': 'book', 'sort': 'book'})
+        return [record['book'] for record in result['records']]
+
+    def test_search_cache(self):
+        assert self._books() == ['annakarenina'], self._books()
+        assert self._books('books_cached') == ['annakarenina']
+        self._change_behind_back(u'UPDATE "{0}" SET book = \'changed\'')
+        assert self._books() == ['annakarenina'], self._books()
+
+        # writes through the datastore change the table's version
+        self._post('datastore_create', {
+            'resource_id': self.data['resource_id'],
+            'records': [{'book': 'warandpeace', 'year': 1869}]
+        })
+        assert self._books() == ['changed', 'warandpeace'], self._books()
+        assert self._books('books_cached') == ['changed', 'warandpeace']
+
+        self._post('datastore_delete', {
+            'resource_id': self.data['resource_id'],
+            'filters': {'book': 'changed'}
+        })
+        assert self._books() == ['warandpeace'], self._books()
+        assert self._books('books_cached') == ['warandpeace']
+
+    def test_search_sql_cache(self):
+        sql = u'SELECT count(*) AS count FROM "{0}"'.format(
+            self.data['resource_id'])
+        count = self._post('datastore_search_sql',
+                           {'sql': sql})['records'][0]['count']
+        self._change_behind_back(
+            u'INSERT INTO "{0}" (book) VALUES (\'anotherbook\')')
+        assert self._post('datastore_search_sql',
+                          {'sql': sql + ';'})['records'][0]['count'] == count
+
+        self._post('datastore_create', {
+            'resource_id': self.data['resource_id'],
+            'records': [{'book': 'thegambler', 'year': 1866}]
+        })
+        assert self._post('datastore_search_sql',
+                          {'sql': sql})['records'][0]['count'] == count + 2
+
+    def test_query_version_of_tables_read(self):
+        sql = u'SELECT * FROM "{0}"'.format(self.data['resource_id'])
+        connection = self.Session.get_bind().connect()
+        try:
+            version = db._get_query_version(connection, sql)
+            assert version[0][0] == self.data['resource_id'], version
+
+            # a write to another table doesn't change it
+            transaction = connection.begin()
+            db._bump_table_version({'connection': connection}, u'other')
+            transaction.commit()
+            assert db._get_query_version(connection, sql) == version
+
+            transaction = connection.begin()
+            db._bump_table_version({'connection': connection},
+                                   self.data['resource_id'])
+            transaction.commit()
+            assert db._get_query_version(connection, sql) != version
+
+            assert db._get_query_version(
+                connection, u'SELECT * FROM "_table_metadata"') is None
+            assert db._get_query_version(connection, sql + '; ' + sql) is None
+            assert db._get_query_version(
+                connection, u'SELECT * FROM "nosuchtable"') is None
+        finally:
+            connection.close()
+
+    def test_connection_url_not_cached(self):
+        search_cache.set_result('key', {'records': [], 'id': 'books',
+                                        'connection_url': 'postgresql://'})
+        assert search_cache.get_result('key') == {'records': []}
+
+
 class TestDatastoreSQL(tests.WsgiAppCase):
     sysadmin_user = None
     normal_user = None
@@ -1,3 +1,5 @@
+import datetime
+import decimal
 import unittest
 
 import ckanext.datastore.db as db
@@ -29,3 +31,53 @@ class TestTypeGetters(unittest.TestCase):
         assert db._get_bool('0') == False
         assert db._get_bool('on') == True
         assert db._get_bool('off') == False
+
+
+class TestConverters(unittest.TestCase):
+    def test_converter_matches_convert(self):
+        values = {
+            'int4': [1, None],
+            'int8': [2L, None],
+            'float8': [1.5, None],
+            'bool': [True, None],
+            'text': [u'b\xfck', None],
+            'numeric': [decimal.Decimal('1.50'), None],
+            'timestamp': [datetime.datetime(2005, 3, 1), None],
+            'nested': [('{"a": [1, 2]}',), None],
+            '_text': [[u'a', None, u'b'], None],
+            '_timestamp': [[datetime.datetime(2005, 3, 1)], None],
+        }
+        for type_name, column in values.items():
+            converter = db._converter(type_name) or (lambda data: data)
+            assert map(converter, column) == \
+                [db.convert(value, type_name) for value in column], type_name
+
+
+class TestGuessColumnType(unittest.TestCase):
+    def test_json_types(self):
+        assert db._guess_column_type([1, None, 2]) == 'int'
+        assert db._guess_column_type([1, 2.5]) == 'float'
+        assert db._guess_column_type([1, [2]]) == 'nested'
+        assert db._guess_column_type([None, '']) == 'text'
+
+    def test_big_json_integers(self):
+        assert db._guess_column_type([1, 3000000000]) == 'bigint'
+        assert db._guess_column_type([1, -3000000000L]) == 'bigint'
+        assert db._guess_column_type([1, 10 ** 20]) == 'numeric'
+        assert db._guess_column_type([True, 2 ** 31 - 1]) == 'int'
+
+    def test_strings(self):
+        assert db._guess_column_type(['1', ' -2', '']) == 'integer'
+        assert db._guess_column_type(['1', '3000000000']) == 'bigint'
+        assert db._guess_column_type(['1', '1' * 20]) == 'numeric'
+        assert db._guess_column_type(['1', '2.5', '1e3']) == 'numeric'
+        assert db._guess_column_type(['2005-12-01', '2005-12-31']) == \
+            'timestamp'
+        assert db._guess_column_type(['2005-12-01', '2005-13-01']) == 'text'
+        assert db._guess_column_type(['1', 'one']) == 'text'
+        assert db._guess_column_type([u'b\xfck', '2']) == 'text'
+
+    def test_field_type_uses_sample(self):
+        records = [{'a': '1'}, {'a': 'x'}]
+        assert db._guess_field_type(records, 'a') == 'text'
+        assert db._guess_field_type(records[:1], 'a') == 'integer'
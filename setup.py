@@ -89,6 +89,7 @@ setup(
     check-po-files = ckan.i18n.check_po_files:CheckPoFiles
     trans = ckan.lib.cli:TranslationsCommand
     minify = ckan.lib.cli:MinifyCommand
+    templates = ckan.lib.cli:TemplatesCommand
     datastore = ckanext.datastore.commands:SetupDatastoreCommand
 
     [console_scripts]
@@ -126,6 +127,11 @@ setup(
 
     [ckan.system_plugins]
     domain_object_mods = ckan.model.modification:DomainObjectModificationExtension
+    home_page_cache = ckan.lib.home_page_cache:HomePageCacheInvalidator
+    package_show_cache = ckan.lib.package_cache:PackageCacheInvalidator
+
+    [ckan.celery_task]
+    datastore = ckanext.datastore.celery_import:task_imports
 
     [babel.extractors]
 	    ckan = ckan.lib.extract:extract_ckan